@@ -2,6 +2,10 @@ import telebot
 from app.utils.logger import logger
 from app.bot.handlers import admin_panel, user_handlers, user_panel
 from app.bot.core.bot_instance import bot
+from app.bot.webhook_server import WebhookServer
+from app.bot.dispatcher import create_dispatcher
+from app.bot.broadcaster import create_broadcaster
+from app.utils.api_clients.circuit_breaker import add_state_listener, STATE_OPEN, STATE_CLOSED
 from config import settings
 
 
@@ -10,6 +14,12 @@ from config import settings
 class BotManager:
     def __init__(self):
         self.bot = bot
+        # 按 chat_id 分通道处理 update
+        create_dispatcher(self.bot).install()
+        # 恢复上次未完成的群发任务
+        create_broadcaster(self.bot).resume()
+        # 上游服务熔断和恢复时通知管理员
+        add_state_listener(self._notify_circuit_state)
 
         # 定义命令列表
         commands = [
@@ -107,6 +117,17 @@ class BotManager:
         # bot.register_message_handler(admin_handlers.get_score_chart_command, commands=['get_score_chart']) # 注册获取积分排行榜的命令
         # bot.register_message_handler(admin_handlers.toggle_clean_msg_system_command, commands=['toggle_clean_msg_system']) # 注册获取积分排行榜的命令
 
+    def _notify_circuit_state(self, name, old_state, new_state, stats):
+        """上游服务熔断器打开或关闭时通知管理员，half_open 只记录日志"""
+        if new_state == STATE_OPEN and old_state == STATE_CLOSED:
+            text = f"⚠️ 上游服务 {name} 连续请求失败，已熔断，{stats['retry_after']:.0f} 秒后尝试恢复，期间只提供缓存的只读数据。"
+        elif new_state == STATE_CLOSED:
+            text = f"✅ 上游服务 {name} 已恢复。"
+        else:
+            return
+        for admin_id in settings.ADMIN_TELEGRAM_IDS:
+            self.bot.send_message(admin_id, text, delay=None, wait=False)
+
     def get_bot(self):
         return self.bot
 
@@ -118,7 +139,8 @@ def run_bot():
     if settings.WEBHOOK_URL:
         logger.info(f"Bot 以 Webhook 模式启动")
         bot.remove_webhook()
-        bot.set_webhook(settings.WEBHOOK_URL)
+        bot.set_webhook(settings.WEBHOOK_URL, secret_token=settings.WEBHOOK_SECRET_TOKEN or None)
+        WebhookServer(bot).serve_forever()
     else:
         logger.info(f"Bot 以 Polling 模式启动")
         bot.infinity_polling()
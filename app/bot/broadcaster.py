@@ -0,0 +1,194 @@
+import threading
+import telebot
+from app.models import BroadcastJob
+from app.utils.logger import logger
+from config import settings
+
+# 需要安装的模块：无
+
+_broadcaster = None
+
+PAGE_RETRIES = 3  # 一页出错时的重试次数，仍然失败时暂停任务
+RETRY_DELAY = 5  # 第一次重试前等待的秒数，之后每次翻倍
+
+# 表示聊天已不可达的错误（用户屏蔽 Bot、账号注销、聊天不存在），之后的群发跳过这些聊天
+BLOCKED_ERRORS = ("bot was blocked by the user", "user is deactivated", "chat not found",
+                  "bot can't initiate conversation with a user", "bot was kicked")
+
+
+def get_blocked_reason(error):
+    """返回聊天不可达的原因，其他错误返回 None"""
+    if isinstance(error, telebot.apihelper.ApiTelegramException) and error.error_code in (400, 403):
+        description = error.description.lower()
+        for reason in BLOCKED_ERRORS:
+            if reason in description:
+                return reason
+    return None
+
+
+class Broadcaster:
+    """
+    群发引擎
+
+    按 Users.id 分页读取接收者，每页的消息同时提交到发送队列（SendQueue），由发送队列按 Telegram 的
+    全局速率发送；一页全部完成后把进度和不可达的聊天写入数据库，重启后从最后一个完成的页继续。
+    一页中途中断时该页会重新发送，同一用户最多收到两次。
+    一页出错（例如数据库写入失败）时等待后重试，重试 PAGE_RETRIES 次仍然失败时把任务标记为已暂停，
+    管理员可以恢复或取消已暂停的任务。
+    """
+
+    def __init__(self, bot, page_size=None, retry_delay=RETRY_DELAY):
+        """
+        初始化群发引擎
+        Args:
+            bot: TeleBot 实例
+            page_size: 每页的接收者数量
+            retry_delay: 第一次重试前等待的秒数
+        """
+        self.bot = bot
+        self.page_size = page_size or settings.BROADCAST_PAGE_SIZE
+        self.retry_delay = retry_delay
+        self._jobs = {}  # job_id -> 取消事件
+        self._lock = threading.Lock()
+        # 用户屏蔽或重新启用 Bot 时更新不可达列表
+        bot.register_my_chat_member_handler(self._on_my_chat_member)
+
+    def _on_my_chat_member(self, update):
+        """私聊中 Bot 的成员状态变化"""
+        if update.chat.type != "private":
+            return
+        if update.new_chat_member.status == "kicked":
+            BroadcastJob.block_chat(update.chat.id, "bot was blocked by the user")
+        elif update.new_chat_member.status == "member":
+            BroadcastJob.unblock_chat(update.chat.id)
+
+    def start(self, text, create_user_id=None, parse_mode=None):
+        """
+        创建群发任务并在后台开始发送
+        Returns:
+            BroadcastJob
+        """
+        job = BroadcastJob.create(text, settings.SERVICE_TYPE, parse_mode, create_user_id)
+        logger.info(f"创建群发任务: id={job.id}, create_user_id={create_user_id}")
+        self._spawn(job)
+        return job
+
+    def resume(self):
+        """恢复上次未完成的群发任务"""
+        jobs = BroadcastJob.get_by_status(BroadcastJob.STATUS_RUNNING)
+        for job in jobs:
+            logger.info(f"恢复群发任务: {job}")
+            self._spawn(job)
+        return len(jobs)
+
+    def resume_job(self, job_id):
+        """
+        恢复已暂停的群发任务，从最后保存的进度继续
+        Returns:
+            BroadcastJob，任务不存在或不是已暂停状态时返回 None
+        """
+        job = BroadcastJob.get_by_id(job_id)
+        if not job or job.status != BroadcastJob.STATUS_PAUSED:
+            return None
+        job.set_status(BroadcastJob.STATUS_RUNNING)
+        logger.info(f"恢复已暂停的群发任务: {job}")
+        self._spawn(job)
+        return job
+
+    def cancel(self, job_id):
+        """
+        取消群发任务：正在运行的任务在当前页发送完成后停止，已暂停的任务直接标记为已取消
+        Returns:
+            是否找到正在运行或已暂停的任务
+        """
+        with self._lock:
+            cancelled = self._jobs.get(job_id)
+        if cancelled is not None:
+            cancelled.set()
+            return True
+        job = BroadcastJob.get_by_id(job_id)
+        if not job or job.status != BroadcastJob.STATUS_PAUSED:
+            return False
+        job.set_status(BroadcastJob.STATUS_CANCELLED)
+        logger.info(f"已暂停的群发任务已取消: {job}")
+        return True
+
+    def _spawn(self, job):
+        """启动后台线程执行群发任务"""
+        with self._lock:
+            if job.id in self._jobs:
+                return
+            self._jobs[job.id] = threading.Event()
+        threading.Thread(target=self._run, args=(job,), name=f"broadcast-{job.id}", daemon=True).start()
+
+    def _run(self, job):
+        """逐页发送，直到没有接收者或被取消"""
+        cancelled = self._jobs[job.id]
+        retries = 0
+        try:
+            while not cancelled.is_set():
+                try:
+                    recipients = job.get_recipients(self.page_size)
+                    if not recipients:
+                        job.set_status(BroadcastJob.STATUS_FINISHED)
+                        logger.info(f"群发任务完成: {job}")
+                        return
+                    self._send_page(job, recipients)
+                    retries = 0
+                except Exception as e:
+                    if retries >= PAGE_RETRIES:
+                        job.set_status(BroadcastJob.STATUS_PAUSED)
+                        logger.error(f"群发任务多次出错，已暂停: {job}, error={e}")
+                        return
+                    delay = self.retry_delay * 2 ** retries
+                    retries += 1
+                    logger.warning(f"群发任务出错，{delay} 秒后重试第 {retries} 次: {job}, error={e}")
+                    cancelled.wait(delay)
+            job.set_status(BroadcastJob.STATUS_CANCELLED)
+            logger.info(f"群发任务已取消: {job}")
+        except Exception as e:
+            # 无法更新任务状态时保持 running 状态，重启后从最后的进度继续
+            logger.error(f"群发任务异常中断: {job}, error={e}")
+        finally:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+
+    def _send_page(self, job, recipients):
+        """发送一页并保存进度"""
+        futures = [(chat_id, self.bot.send_message(chat_id, job.text, parse_mode=job.parse_mode, delay=None, wait=False))
+                   for _, chat_id in recipients]
+        sent, failed, blocked_chats = 0, 0, []
+        for chat_id, future in futures:
+            try:
+                future.result()
+                sent += 1
+            except Exception as e:
+                reason = get_blocked_reason(e)
+                if reason:
+                    blocked_chats.append((chat_id, reason))
+                else:
+                    failed += 1
+        job.checkpoint(recipients[-1][0], sent, failed, blocked_chats)
+        logger.debug(f"群发进度: {job}")
+
+    def get_running_jobs(self):
+        """获取正在运行的任务 ID"""
+        with self._lock:
+            return list(self._jobs)
+
+
+def create_broadcaster(bot):
+    """创建Broadcaster实例，并赋值给全局变量_broadcaster"""
+    global _broadcaster
+    if not _broadcaster:
+        _broadcaster = Broadcaster(bot)
+    return _broadcaster
+
+
+def get_broadcaster():
+    """获取 Broadcaster 实例"""
+    global _broadcaster
+    if not _broadcaster:
+        from app.bot.core.bot_instance import bot
+        _broadcaster = create_broadcaster(bot)
+    return _broadcaster
@@ -1,14 +1,19 @@
+import threading
 import telebot
 from app.utils import logger
 from config.settings import TELEGRAM_BOT_TOKEN
 from config.settings import DELAY_INTERVAL, ENABLE_MESSAGE_CLEANER
 from app.utils.message_queue import get_message_queue, Message
 from app.utils.scheduler import get_scheduler
+from app.bot.core.send_queue import get_send_queue
+from concurrent.futures import Future
 
 
 scheduler = get_scheduler()
 message_queue = get_message_queue()
-bot = telebot.TeleBot(TELEGRAM_BOT_TOKEN)
+send_queue = get_send_queue()
+# update 的并发由 UpdateDispatcher 负责，bot 内部不再使用线程池
+bot = telebot.TeleBot(TELEGRAM_BOT_TOKEN, threaded=False)
 
 # 保存原始的 send_message 和 reply_to 方法
 original_send_message = bot.send_message
@@ -17,26 +22,34 @@ original_delete_message = bot.delete_message
 original_register_next_step_handler = bot.register_next_step_handler
 original_edit_message_text = bot.edit_message_text
 
-def send_message_with_delete(chat_id, text, delay=DELAY_INTERVAL, **kwargs):
-    # 调用原始的 send_message 方法
-    message = original_send_message(chat_id, text, **kwargs)
-    if ENABLE_MESSAGE_CLEANER and delay is not None:
+def delete_later(message, delay):
+    # 发送结果是 Future（wait=False）时，在发送完成后再加入删除队列
+    if isinstance(message, Future):
+        message.add_done_callback(lambda future: future.exception() or message_queue.add_message(future.result(), delay))
+    else:
         message_queue.add_message(message, delay)
+
+def send_message_with_delete(chat_id, text, delay=DELAY_INTERVAL, wait=True, **kwargs):
+    # 经发送队列限速后调用原始的 send_message 方法，wait=False 时不等待发送完成，直接返回 Future
+    future = send_queue.submit(chat_id, original_send_message, text=text, **kwargs)
+    message = future.result() if wait else future
+    if ENABLE_MESSAGE_CLEANER and delay is not None:
+        delete_later(message, delay)
     return message
 
 def reply_to_with_delete(message, text, delay=DELAY_INTERVAL, **kwargs):
-    # 调用原始的 reply_to 方法
-    reply_message = original_reply_to(message, text, **kwargs)
+    # 调用原始的 reply_to 方法（内部经 send_message_with_delete 发送）
+    reply_message = original_reply_to(message, text, delay=delay, **kwargs)
     if ENABLE_MESSAGE_CLEANER and delay is not None:
-        message_queue.add_message(reply_message, delay)
         message_queue.add_message(message, delay)
     return reply_message
 
-def edit_message_text_with_delete(text, chat_id, message_id, delay=DELAY_INTERVAL, **kwargs):
-    # 调用原始的 edit_message_text 方法
-    edited_message = original_edit_message_text(text, chat_id, message_id, **kwargs)
+def edit_message_text_with_delete(text, chat_id, message_id, delay=DELAY_INTERVAL, wait=True, **kwargs):
+    # 经发送队列限速后调用原始的 edit_message_text 方法
+    future = send_queue.submit(chat_id, original_edit_message_text, text, chat_id, message_id, **kwargs)
+    edited_message = future.result() if wait else future
     if ENABLE_MESSAGE_CLEANER and delay is not None:
-        message_queue.add_message(edited_message, delay)
+        delete_later(edited_message, delay)
     return edited_message
 
 def delete_message_with_delete(chat_id, message_id, **kwargs):
@@ -46,16 +59,35 @@ def delete_message_with_delete(chat_id, message_id, **kwargs):
     except Exception as e:
         logger.error(f"Delete message error: {e}")
 
+# 每个聊天当前的清除下一步处理器定时器，重新注册时取消旧的定时器
+step_handler_timers = {}
+step_handler_lock = threading.Lock()
+
 def register_next_step_handler_with_delete(message, callback, delay=30, **kwargs):
     # 调用原始的 register_next_step_handler 方法
     original_register_next_step_handler(message, callback, **kwargs)
     if ENABLE_MESSAGE_CLEANER and delay is not None:
-        scheduler.add_delayed_job(delay, clear_step_handler, [message])
+        chat_id = message.chat.id
+        with step_handler_lock:
+            previous = step_handler_timers.pop(chat_id, None)
+            if previous:
+                previous.cancel()
+            handle = None
+
+            def expire():
+                # 旧定时器已经开始执行时可能来不及取消，只清除自己注册的处理器，不影响新注册的处理器
+                with step_handler_lock:
+                    if step_handler_timers.get(chat_id) is not handle:
+                        return
+                    del step_handler_timers[chat_id]
+                clear_step_handler(message)
+
+            handle = step_handler_timers[chat_id] = scheduler.add_delayed_job(delay, expire)
 
 def clear_step_handler(message):
     logger.debug(f"Clear step handler for message {message.message_id}")
     bot.clear_step_handler(message)
-        
+
 bot.send_message = send_message_with_delete
 bot.reply_to = reply_to_with_delete
 bot.delete_message = delete_message_with_delete
@@ -0,0 +1,225 @@
+import heapq
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+import telebot
+from app.utils.logger import logger
+from app.utils.rate_limiter import TokenBucket, get_rate_limiter
+from config import settings
+
+# 需要安装的模块：无
+
+MAX_MESSAGE_LENGTH = 4096  # Telegram 单条消息最大长度
+MAX_CHAT_BUCKETS = 10000  # 最多保存多少个聊天的令牌桶
+MAX_RETRIES = 5  # 429 最多重试次数
+
+_send_queue = None
+
+
+class SendItem:
+    """
+    待发送的请求
+    """
+    __slots__ = ("chat_id", "func", "args", "kwargs", "future", "text", "retries")
+
+    def __init__(self, chat_id, func, args, kwargs, text=None):
+        self.chat_id = chat_id
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.text = text  # 可合并的纯文本消息
+        self.retries = 0
+
+
+class SendQueue:
+    """
+    发送队列
+
+    所有发往 Telegram 的消息经过全局令牌桶（TELEGRAM_GLOBAL_RATE 条/秒）和每个聊天的令牌桶
+    （私聊 TELEGRAM_CHAT_RATE 条/秒，群组 TELEGRAM_GROUP_RATE 条/分钟）限速，同一个聊天内按顺序发送。
+    聊天的令牌不足时放入延迟堆，不占用发送线程；返回 429 时按 retry_after 暂停该聊天并重新排队。
+    同一个聊天中连续排队的纯文本消息（参数相同、合并后不超过 4096 字符）合并为一条发送。
+    """
+
+    def __init__(self, workers=None):
+        """
+        初始化发送队列
+        Args:
+            workers: 发送线程数量
+        """
+        self.workers = workers or settings.TELEGRAM_SEND_WORKERS
+        self._global_bucket = get_rate_limiter("telegram_send", settings.TELEGRAM_GLOBAL_RATE)
+        self._chat_buckets = OrderedDict()  # chat_id -> TokenBucket
+        self._pending = {}  # chat_id -> deque[SendItem]
+        self._ready = deque()  # 可以发送的聊天
+        self._delayed = []  # (可发送时间, chat_id)
+        self._busy = set()  # 正在发送的聊天
+        self._condition = threading.Condition()
+        self._threads = []
+        self._stats = {"submitted": 0, "sent": 0, "merged": 0, "failed": 0, "rate_limited": 0, "throttled": 0}
+
+    def _chat_bucket(self, chat_id):
+        """获取聊天的令牌桶，调用方需持有锁"""
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if chat_id < 0:
+                bucket = TokenBucket(settings.TELEGRAM_GROUP_RATE / 60, capacity=settings.TELEGRAM_GROUP_RATE)
+            else:
+                bucket = TokenBucket(settings.TELEGRAM_CHAT_RATE)
+            self._chat_buckets[chat_id] = bucket
+            while len(self._chat_buckets) > MAX_CHAT_BUCKETS:
+                self._chat_buckets.popitem(last=False)
+        self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    def start(self):
+        """启动发送线程"""
+        with self._condition:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"send-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        logger.info(f"消息发送队列已启动: workers={self.workers}")
+
+    def submit(self, chat_id, func, *args, text=None, **kwargs):
+        """
+        提交发送请求
+        Args:
+            chat_id: 聊天 ID，用于限速和保证顺序
+            func: 实际发送的函数
+            text: 纯文本消息的内容，设置后允许与相邻的消息合并，此时 args 不包含文本
+        Returns:
+            concurrent.futures.Future，结果为 func 的返回值
+        """
+        self.start()
+        item = SendItem(chat_id, func, args, kwargs, text)
+        with self._condition:
+            self._stats["submitted"] += 1
+            queue = self._pending.setdefault(chat_id, deque())
+            queue.append(item)
+            if len(queue) == 1 and chat_id not in self._busy:
+                self._ready.append(chat_id)
+                self._condition.notify()
+        return item.future
+
+    def _take(self, chat_id):
+        """取出聊天队首的请求，并合并其后可以合并的纯文本消息，调用方需持有锁"""
+        queue = self._pending[chat_id]
+        items = [queue.popleft()]
+        if items[0].text is not None:
+            length = len(items[0].text)
+            while queue and queue[0].text is not None and queue[0].func is items[0].func \
+                    and queue[0].kwargs == items[0].kwargs and length + 1 + len(queue[0].text) <= MAX_MESSAGE_LENGTH:
+                length += 1 + len(queue[0].text)
+                items.append(queue.popleft())
+        if not queue:
+            del self._pending[chat_id]
+        return items
+
+    def _next_chat(self):
+        """等待下一个可以发送的聊天，调用方需持有锁"""
+        while True:
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, chat_id = heapq.heappop(self._delayed)
+                self._ready.append(chat_id)
+            while self._ready:
+                chat_id = self._ready.popleft()
+                bucket = self._chat_bucket(chat_id)
+                wait = bucket.wait_time()
+                if wait > 0:
+                    self._stats["throttled"] += 1
+                    heapq.heappush(self._delayed, (now + wait, chat_id))
+                    continue
+                bucket.try_acquire()
+                self._busy.add(chat_id)
+                return chat_id
+            self._condition.wait(self._delayed[0][0] - now if self._delayed else None)
+
+    def _run(self):
+        """发送线程主循环"""
+        while True:
+            with self._condition:
+                chat_id = self._next_chat()
+                items = self._take(chat_id)
+            retry_after = self._send(items)
+            with self._condition:
+                self._busy.discard(chat_id)
+                if retry_after:
+                    # 放回队首，等待 retry_after 后重新发送
+                    self._pending.setdefault(chat_id, deque()).extendleft(reversed(items))
+                    heapq.heappush(self._delayed, (time.monotonic() + retry_after, chat_id))
+                elif chat_id in self._pending:
+                    self._ready.append(chat_id)
+                self._condition.notify()
+
+    def _send(self, items):
+        """
+        发送一条（可能是合并后的）消息
+        Returns:
+            需要重试时返回等待的秒数，否则返回 None
+        """
+        first = items[0]
+        args = first.args
+        if first.text is not None:
+            args = (first.chat_id, "\n".join(item.text for item in items)) + first.args
+        self._global_bucket.acquire()
+        try:
+            result = first.func(*args, **first.kwargs)
+        except telebot.apihelper.ApiTelegramException as e:
+            if e.error_code == 429 and first.retries < MAX_RETRIES:
+                retry_after = (e.result_json.get("parameters") or {}).get("retry_after", 1)
+                for item in items:
+                    item.retries += 1
+                with self._condition:
+                    self._stats["rate_limited"] += 1
+                self._chat_buckets.get(first.chat_id, self._global_bucket).pause(retry_after)
+                logger.warning(f"发送消息被限流: chat_id={first.chat_id}, retry_after={retry_after}")
+                return retry_after
+            self._fail(items, e)
+            return None
+        except Exception as e:
+            self._fail(items, e)
+            return None
+        with self._condition:
+            self._stats["sent"] += 1
+            self._stats["merged"] += len(items) - 1
+        for item in items:
+            item.future.set_result(result)
+        return None
+
+    def _fail(self, items, error):
+        """发送失败，把异常交给调用方"""
+        with self._condition:
+            self._stats["failed"] += len(items)
+        logger.error(f"发送消息失败: chat_id={items[0].chat_id}, error={error}")
+        for item in items:
+            item.future.set_exception(error)
+
+    def get_stats(self):
+        """获取发送队列统计信息"""
+        with self._condition:
+            stats = dict(self._stats)
+            stats["pending"] = sum(len(queue) for queue in self._pending.values())
+            stats["delayed_chats"] = len(self._delayed)
+        return stats
+
+
+def create_send_queue():
+    """创建SendQueue实例，并赋值给全局变量_send_queue"""
+    global _send_queue
+    if not _send_queue:
+        _send_queue = SendQueue()
+    return _send_queue
+
+
+def get_send_queue():
+    """获取 SendQueue 实例"""
+    global _send_queue
+    if not _send_queue:
+        _send_queue = create_send_queue()
+    return _send_queue
@@ -0,0 +1,170 @@
+import queue
+import threading
+import time
+from functools import wraps
+from app.utils.logger import logger
+from config import settings
+
+# 需要安装的模块：无
+
+_dispatcher = None
+
+# 带有 chat 字段的 update 类型
+CHAT_UPDATE_FIELDS = ("message", "edited_message", "channel_post", "edited_channel_post", "my_chat_member",
+                      "chat_member", "chat_join_request", "message_reaction", "message_reaction_count")
+# 只有发送者的 update 类型
+USER_UPDATE_FIELDS = ("inline_query", "chosen_inline_result", "shipping_query", "pre_checkout_query")
+
+
+def get_update_chat_id(update):
+    """
+    获取 update 所属的聊天 ID，无法确定时返回 None
+    """
+    for field in CHAT_UPDATE_FIELDS:
+        obj = getattr(update, field, None)
+        if obj is not None and getattr(obj, "chat", None) is not None:
+            return obj.chat.id
+    callback_query = getattr(update, "callback_query", None)
+    if callback_query is not None:
+        if callback_query.message is not None:
+            return callback_query.message.chat.id
+        return callback_query.from_user.id
+    for field in USER_UPDATE_FIELDS:
+        obj = getattr(update, field, None)
+        if obj is not None:
+            return obj.from_user.id
+    poll_answer = getattr(update, "poll_answer", None)
+    if poll_answer is not None and poll_answer.user is not None:
+        return poll_answer.user.id
+    return None
+
+
+class Lane:
+    """
+    处理通道：一个有界队列和一个工作线程，队列中的任务按顺序执行
+    """
+
+    def __init__(self, name, queue_size):
+        self.name = name
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        self.stats = {"processed": 0, "failed": 0, "total_wait": 0.0, "max_wait": 0.0, "total_time": 0.0}
+
+    def start(self):
+        """启动工作线程"""
+        if not self.thread or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self.thread.start()
+
+    def put(self, func, *args, **kwargs):
+        """加入任务，队列已满时阻塞，把压力传回 polling 或 webhook"""
+        self.queue.put((time.monotonic(), func, args, kwargs))
+
+    def _run(self):
+        """工作线程主循环"""
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            enqueued_at, func, args, kwargs = item
+            start = time.monotonic()
+            wait = start - enqueued_at
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.error(f"处理任务失败: lane={self.name}, error={e}")
+            self.stats["processed"] += 1
+            self.stats["total_wait"] += wait
+            self.stats["max_wait"] = max(self.stats["max_wait"], wait)
+            self.stats["total_time"] += time.monotonic() - start
+
+
+class UpdateDispatcher:
+    """
+    Update 分发器
+
+    按 chat_id 把 update 分配到固定的处理通道：同一个聊天的 update 总在同一个通道内按顺序处理，
+    下一步处理器能按顺序收到消息；不同聊天分散在多个通道中并行处理。
+    耗时较长的管理员任务通过 low_priority 装饰器转到单独的低优先级通道，不占用普通通道。
+    """
+
+    def __init__(self, bot, lanes=None, queue_size=None):
+        """
+        初始化分发器
+        Args:
+            bot: TeleBot 实例，需要以 threaded=False 创建，由分发器负责并发
+            lanes: 普通通道数量
+            queue_size: 每个通道的队列长度
+        """
+        self.bot = bot
+        self._process_new_updates = bot.process_new_updates
+        queue_size = queue_size or settings.DISPATCHER_QUEUE_SIZE
+        self._lanes = [Lane(f"update-lane-{i}", queue_size) for i in range(lanes or settings.DISPATCHER_LANES)]
+        self._low_priority_lane = Lane("update-lane-low", queue_size)
+
+    def install(self):
+        """接管 bot 的 update 处理并启动所有通道"""
+        for lane in self._lanes + [self._low_priority_lane]:
+            lane.start()
+        self.bot.process_new_updates = self.dispatch
+        logger.info(f"Update 分发器已启动: lanes={len(self._lanes)}")
+
+    def _lane_for(self, update):
+        """根据 chat_id 选择通道"""
+        chat_id = get_update_chat_id(update)
+        key = chat_id if chat_id is not None else update.update_id
+        return self._lanes[hash(key) % len(self._lanes)]
+
+    def dispatch(self, updates):
+        """把 update 分配到各自的通道"""
+        for update in updates:
+            self._lane_for(update).put(self._process_new_updates, [update])
+
+    def submit_low_priority(self, func, *args, **kwargs):
+        """在低优先级通道中执行任务"""
+        self._low_priority_lane.put(func, *args, **kwargs)
+
+    def in_low_priority_lane(self):
+        """当前线程是否为低优先级通道"""
+        return threading.current_thread() is self._low_priority_lane.thread
+
+    def get_stats(self):
+        """获取各通道的统计信息"""
+        stats = {}
+        for lane in self._lanes + [self._low_priority_lane]:
+            lane_stats = dict(lane.stats)
+            lane_stats["queue_size"] = lane.queue.qsize()
+            processed = lane_stats["processed"]
+            lane_stats["avg_wait"] = lane_stats["total_wait"] / processed if processed else 0.0
+            lane_stats["avg_time"] = lane_stats["total_time"] / processed if processed else 0.0
+            stats[lane.name] = lane_stats
+        return stats
+
+
+def low_priority(func):
+    """
+    把耗时较长的处理函数转到低优先级通道执行的装饰器，分发器未启用时直接执行
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        dispatcher = _dispatcher
+        if dispatcher is None or dispatcher.in_low_priority_lane():
+            return func(*args, **kwargs)
+        logger.debug(f"转到低优先级通道执行: func={func.__name__}")
+        dispatcher.submit_low_priority(func, *args, **kwargs)
+
+    return wrapper
+
+
+def create_dispatcher(bot):
+    """创建UpdateDispatcher实例，并赋值给全局变量_dispatcher"""
+    global _dispatcher
+    if not _dispatcher:
+        _dispatcher = UpdateDispatcher(bot)
+    return _dispatcher
+
+
+def get_dispatcher():
+    """获取 UpdateDispatcher 实例，未创建时返回 None"""
+    return _dispatcher
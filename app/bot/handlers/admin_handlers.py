@@ -1,21 +1,54 @@
 # 管理员命令处理器
+import time
 from datetime import timedelta
 from app.bot.validators import confirmation_required
+from app.bot.dispatcher import low_priority
 from app.services.user_service import UserService
 from app.services.score_service import ScoreService
 from app.services.invite_code_service import InviteCodeService
+from app.services.stats_service import StatsService
+from app.models import ScoreLedger
 from app.utils.logger import logger
 from config import settings
 from app.bot.core.bot_instance import bot
 from telebot import types
 from app.utils.api_clients import service_api_client
-from app.utils.utils import paginate_list, create_pagination
+from app.utils.api_clients.transport import get_transport_stats, get_circuit_breaker_stats
+from app.utils.utils import create_pagination
+from app.utils.pagination import get_pagination_store
 from app.utils.message_cleaner import get_message_cleaner
 from app.utils.message_queue import get_message_queue
+from app.bot.broadcaster import get_broadcaster
+from app.models import BroadcastJob
 
 message_queue = get_message_queue()
 
 
+def _invite_code_page(code_type, is_used, offset=0, limit=0):
+    """分页查询邀请码，每项为一行文本"""
+    invite_codes, total = InviteCodeService.get_invite_code_page(code_type, is_used, offset, limit)
+    items = []
+    for invite_code in invite_codes:
+        expire_time = str(invite_code.create_time + timedelta(days=invite_code.expire_days))[:19]
+        if is_used is None:
+            items.append(f"{invite_code.code}: {expire_time}, {'已使用' if invite_code.is_used else '未使用'}, "
+                         f"创建者ID: {invite_code.create_user_id}")
+        else:
+            items.append(f"{invite_code.code}: {expire_time}")
+    return items, total
+
+
+def _expired_user_page(kind, offset=0, limit=0):
+    """分页查询过期（kind='expired'）或即将过期（kind='warning'）的用户名，翻页时重新读取"""
+    users = (UserService.get_expired_users() or {}).get(kind) or []
+    return [user['username'] for user in users[offset:offset + limit]], len(users)
+
+
+pagination_store = get_pagination_store()
+pagination_store.register_query("invite_codes", _invite_code_page)
+pagination_store.register_query("expired_users", _expired_user_page)
+
+
 def generate_invite_code_command(message):
     """生成邀请码 (管理员命令)"""
     telegram_id = message.from_user.id
@@ -90,112 +123,31 @@ def generate_renew_codes_command(message):
 
 def get_all_invite_codes_command(message):
     """查看所有邀请码 (管理员命令)"""
-    try:
-        invite_all_codes = InviteCodeService.get_all_invite_codes()
-        if invite_all_codes:
-            invite_codes_list = paginate_list(data_list=invite_all_codes, page_size=20)
-            page_count = 0
-            for invite_codes in invite_codes_list:
-                response = f"邀请码列表：当前第{page_count + 1}页\n"
-                for invite_code in invite_codes:
-                    expire_time = invite_code.create_time + timedelta(days=invite_code.expire_days)
-                    response += f"ID: {invite_code.id}, 邀请码: {invite_code.code}, 是否已使用: {'是' if invite_code.is_used else '否'}, 创建时间: {str(invite_code.create_time)[:-7]}, 过期时间: {str(expire_time)[:-7]}, 创建者ID: {invite_code.create_user_id}\n"
-                    response += f"--------\n"
-                    response += f"生成总数为：{len(invite_all_codes)},当前页有{len(invite_codes)}个未使用!"
-                page_count += 1
-                bot.reply_to(message, response)
-        else:
-            bot.reply_to(message, "获取邀请码列表失败，请重试！")
-    except ValueError:
-        bot.reply_to(message, "获取邀请码列表失败，请重试！")
-        logger.error(f"获取邀请码列表失败: telegram_id={message.from_user.id}")
-    # chat_id = message.chat.id
-    # message_id = message.id
-    # invite_all_codes = InviteCodeService.get_all_invite_codes()
-    # invite_code_list = []
-    # for invite_code in invite_all_codes:
-    #     invite_code_list.append(invite_code.code)
-    # text, markup = create_pagination(chat_id, message_id, invite_code_list, items_per_page=50)
-    # bot.send_message(chat_id, text, reply_markup=markup)
+    logger.info(f"管理员请求获取所有邀请码列表: telegram_id={message.from_user.id}")
+    if not create_pagination(message.chat.id, "invite_codes", 20, params=(None, None)):
+        bot.reply_to(message, "没有找到邀请码！")
 
 
 def get_unused_invite_codes_command(message):
     """获取未使用的邀请码列表 (管理员命令)"""
     telegram_id = message.from_user.id
-    try:
-        logger.info(f"管理员请求获取未使用的邀请码列表: telegram_id={telegram_id}")
-        invite_unused_codes = InviteCodeService.get_all_invite_codes(is_used=False)
-        if invite_unused_codes:
-            invite_codes_list = paginate_list(data_list=invite_unused_codes, page_size=50)
-            page_count = 0
-            for invite_codes in invite_codes_list:
-                response = f"未使用的邀请码：当前第{page_count + 1}\n"
-                response += f"--------\n"
-                response += f"邀请码：过期时间\n"
-                response += f"--------\n"
-                for invite_code in invite_codes:
-                    expire_time = invite_code.create_time + timedelta(days=invite_code.expire_days)
-                    response += f"<code>{invite_code.code}</code>: {str(expire_time)[:-7]}\n"
-                response += f"--------\n"
-                response += f"未使用总数为：{len(invite_unused_codes)}, 当前页有{len(invite_codes)}个未使用!"
-                page_count += 1
-                bot.send_message(message.chat.id, response, parse_mode='HTML')
-                # bot.reply_to(message, response, parse_mode='HTML')  # 发送HTML格式的消息，支持点击复制
-            logger.info(f"管理员获取未使用的邀请码列表成功: telegram_id={telegram_id}, count={len(invite_codes)}")
-        else:
-            bot.reply_to(message, "没有找到未使用的邀请码！")
-            logger.warning(f"没有找到未使用的邀请码: telegram_id={telegram_id}")
-    except ValueError:
-        bot.reply_to(message, "获取未使用的邀请码列表失败，请重试！")
-        logger.error(f"获取未使用的邀请码列表失败: telegram_id={telegram_id}")
-    # chat_id = message.chat.id
-    # message_id = message.id
-    # logger.info(f"message_id: {message_id}")
-    # invite_all_codes = InviteCodeService.get_all_invite_codes(is_used=False)
-    # invite_code_list = []
-    # for invite_code in invite_all_codes:
-    #     invite_code_list.append(invite_code.code)
-    # text, markup = create_pagination(chat_id, message_id, invite_code_list, items_per_page=50)
-    # bot.send_message(chat_id, text, reply_markup=markup)
+    logger.info(f"管理员请求获取未使用的邀请码列表: telegram_id={telegram_id}")
+    if create_pagination(message.chat.id, "invite_codes", 50, params=("invite", False)):
+        logger.info(f"管理员获取未使用的邀请码列表成功: telegram_id={telegram_id}")
+    else:
+        bot.reply_to(message, "没有找到未使用的邀请码！")
+        logger.warning(f"没有找到未使用的邀请码: telegram_id={telegram_id}")
 
 
 def get_unused_renew_codes_command(message):
     """获取未使用的续期码列表 (管理员命令)"""
-    try:
-        telegram_id = message.from_user.id
-        logger.info(f"管理员请求获取未使用的续期码列表: telegram_id={telegram_id}")
-        invite_unused_codes = InviteCodeService.get_all_invite_codes(code_type="renew", is_used=False)
-        if invite_unused_codes:
-            invite_codes_list = paginate_list(data_list=invite_unused_codes, page_size=50)
-            page_count = 0
-            for invite_codes in invite_codes_list:
-                response = f"未使用的续期码：当前第{page_count + 1}\n"
-                response += f"--------\n"
-                response += f"续期码：过期时间\n"
-                response += f"--------\n"
-                for invite_code in invite_codes:
-                    expire_time = invite_code.crate_time + timedelta(days=invite_code.expire_days)
-                    response += f"<code>{invite_code.code}</code>: {str(expire_time)[:-7]}\n"
-                response += f"--------\n"
-                response += f"未使用总数为：{len(invite_unused_codes)}, 当前页有{len(invite_codes)}个未使用!"
-                page_count += 1
-                bot.reply_to(message, response, parse_mode='HTML')  # 发送HTML格式的消息，支持点击复制
-            logger.info(f"管理员获取未使用的续期码列表成功: telegram_id={telegram_id}, count={len(invite_codes)}")
-        else:
-            bot.reply_to(message, "没有找到未使用的续期码！")
-            logger.warning(f"没有找到未使用的续期码: telegram_id={telegram_id}")
-    except ValueError:
-        bot.reply_to(message, "获取未使用的续期码列表失败，请重试！")
-        logger.error(f"获取未使用的续期码列表失败: telegram_id={telegram_id}")
-
-    # chat_id = message.chat.id
-    # message_id = message.id
-    # invite_all_codes = InviteCodeService.get_all_invite_codes(code_type="renew", is_used=False)
-    # invite_code_list = []
-    # for invite_code in invite_all_codes:
-    #     invite_code_list.append(invite_code.code)
-    # text, markup = create_pagination(chat_id, message_id, invite_code_list, items_per_page=50)
-    # bot.send_message(chat_id, text, reply_markup=markup)
+    telegram_id = message.from_user.id
+    logger.info(f"管理员请求获取未使用的续期码列表: telegram_id={telegram_id}")
+    if create_pagination(message.chat.id, "invite_codes", 50, params=("renew", False)):
+        logger.info(f"管理员获取未使用的续期码列表成功: telegram_id={telegram_id}")
+    else:
+        bot.reply_to(message, "没有找到未使用的续期码！")
+        logger.warning(f"没有找到未使用的续期码: telegram_id={telegram_id}")
 
 
 def toggle_invite_code_system_command(message):
@@ -238,9 +190,9 @@ def set_score_command(message):
         user = UserService.get_user_by_telegram_id(target_telegram_id, service_type)
         if user:
             # 调用服务层的设置用户积分方法
-            user = ScoreService.update_user_score(user.id, score)
-            if user:
-                logger.info(f"用户积分设置成功: user_id={user.id}, score={user.score}")
+            new_score = ScoreService.update_user_score(user.id, score)
+            if new_score is not None:
+                logger.info(f"用户积分设置成功: user_id={user.id}, score={new_score}")
                 bot.reply_to(message, f"用户 {target_telegram_id} 的积分已设置为: {score}")
             else:
                 logger.error(f"用户积分设置失败: telegram_id={target_telegram_id}")
@@ -319,9 +271,9 @@ def add_score_command(message):
         user = UserService.get_user_by_telegram_id(target_telegram_id, service_type)
         if user:
             # 调用服务层的增加用户积分方法
-            user = ScoreService.add_score(user.id, score)
-            if user:
-                logger.info(f"用户积分增加成功: user_id={user.id}, score={user.score}")
+            new_score = ScoreService.add_score(user.id, score, ScoreLedger.REASON_ADMIN_ADD)
+            if new_score is not None:
+                logger.info(f"用户积分增加成功: user_id={user.id}, score={new_score}")
                 bot.reply_to(message, f"已为用户 {target_telegram_id} 增加积分: {score}")
             else:
                 logger.error(f"用户积分增加失败: telegram_id={target_telegram_id}")
@@ -361,9 +313,9 @@ def reduce_score_command(message):
         user = UserService.get_user_by_telegram_id(target_telegram_id, service_type)
         if user:
             # 调用服务层的减少用户积分方法
-            user = ScoreService.reduce_score(user.id, score)
-            if user:
-                logger.info(f"用户积分减少成功: user_id={user.id}, score={user.score}")
+            new_score = ScoreService.reduce_score(user.id, score, ScoreLedger.REASON_ADMIN_REDUCE)
+            if new_score is not None:
+                logger.info(f"用户积分减少成功: user_id={user.id}, score={new_score}")
                 bot.reply_to(message, f"已为用户 {target_telegram_id} 减少积分: {score}")
             else:
                 logger.error(f"用户积分减少失败: telegram_id={target_telegram_id}")
@@ -480,6 +432,7 @@ def get_user_info_by_username_command(message):
         logger.error(f"查询用户信息失败: telegram_id={telegram_id}")
 
 
+@low_priority
 def get_stats_command(message):
     """
     获取统计信息 (管理员命令)
@@ -490,28 +443,15 @@ def get_stats_command(message):
     logger.info(f"管理员查询统计信息: telegram_id={telegram_id}, service_type={service_type}")
 
     try:
-        # 获取本地数据库用户数量
-        users = UserService.get_all_users()
-        local_user_count = len(users) if users else 0
-
-        # 获取 Navidrome 用户数量
-        navidrome_users = service_api_client.get_users()
-        web_user_count = navidrome_users['headers']['x-total-count']
-        # 获取 Navidrome 歌曲总数
-        songs = service_api_client.get_songs()
-        song_count = int(songs['x-total-count']) if songs and 'x-total-count' in songs else 0
-
-        # 获取 Navidrome 专辑总数
-        albums = service_api_client.get_albums()
-        album_count = int(albums['x-total-count']) if albums and 'x-total-count' in albums else 0
-
-        # 获取 Navidrome 艺术家总数
-        artists = service_api_client.get_artists()
-        artist_count = int(artists['x-total-count']) if artists and 'x-total-count' in artists else 0
-
-        # 获取 Navidrome 电台总数
-        radios = service_api_client.get_radios()
-        radio_count = int(radios['x-total-count']) if radios and 'x-total-count' in radios else 0
+        # 本地和上游的计数并发收集，结果带缓存
+        stats = StatsService.get_stats()
+        counts = {key: "获取失败" if value is None else value for key, value in stats.items()}
+        local_user_count = counts['local_user_count']
+        web_user_count = counts['web_user_count']
+        song_count = counts.get('song_count', 0)
+        album_count = counts.get('album_count', 0)
+        artist_count = counts.get('artist_count', 0)
+        radio_count = counts.get('radio_count', 0)
 
         response = f"统计信息:\n" \
                    f"本地数据库注册用户数量: {local_user_count}\n" \
@@ -524,6 +464,9 @@ def get_stats_command(message):
         response += f"-------\n"
         response += f"清理系统的状态为：{settings.ENABLE_EXPIRED_USER_CLEAN}\n"
         response += f"邀请码系统的状态为：{settings.INVITE_CODE_SYSTEM_ENABLED}\n"
+        breaker_stats = service_api_client.session.breaker.get_stats()
+        response += f"上游服务熔断器状态为：{breaker_stats['state']}（已熔断 {breaker_stats['opened']} 次）\n"
+        response += f"统计时间：{int(time.time() - stats['update_time'])} 秒前\n"
         bot.reply_to(message, response)
         logger.info(
             f"管理员获取注册状态成功: telegram_id={telegram_id}, 本地注册用户数量={local_user_count},  Navidrome Web 应用用户数量={web_user_count}, 歌曲总数={song_count}, 专辑总数={album_count}, 艺术家总数={artist_count}, 电台总数={radio_count}")
@@ -532,6 +475,31 @@ def get_stats_command(message):
         bot.reply_to(message, "获取注册状态失败，请重试！")
 
 
+def get_upstream_stats_command(message, limit=10):
+    """
+    获取上游服务的熔断器状态和按端点统计的请求延迟 (管理员命令)
+    每个上游服务只显示请求次数最多的 limit 个端点
+    """
+    logger.info(f"管理员查询上游请求统计: telegram_id={message.from_user.id}")
+    transport_stats = get_transport_stats()
+    breaker_stats = get_circuit_breaker_stats()
+    if not breaker_stats:
+        bot.reply_to(message, "还没有上游服务请求记录！")
+        return
+    response = "上游服务请求统计:\n"
+    for name, breaker in breaker_stats.items():
+        response += f"-------\n"
+        response += (f"[{name}] 熔断器：{breaker['state']}，连续失败 {breaker['consecutive_failures']} 次，"
+                     f"已熔断 {breaker['opened']} 次，拒绝 {breaker['rejected']} 次，"
+                     f"返回快照 {breaker['snapshots_served']} 次\n")
+        endpoints = sorted(transport_stats.get(name, {}).items(), key=lambda item: item[1]['count'], reverse=True)
+        for key, histogram in endpoints[:limit]:
+            response += (f"{key}：{histogram['count']} 次，失败 {histogram['errors']}，重试 {histogram['retries']}，"
+                         f"p50 {histogram['p50_ms']:.0f}ms，p95 {histogram['p95_ms']:.0f}ms，"
+                         f"p99 {histogram['p99_ms']:.0f}ms，最大 {histogram['max_ms']:.0f}ms\n")
+    bot.reply_to(message, response)
+
+
 @confirmation_required("你确定要更改清理用户系统状态嘛？")
 def toggle_expired_user_clean_command(message):
     """开启/关闭过期用户清理定时任务 (管理员命令)"""
@@ -544,11 +512,11 @@ def toggle_expired_user_clean_command(message):
     bot.reply_to(message, f"过期用户清理定时任务已{'开启' if settings.ENABLE_EXPIRED_USER_CLEAN else '关闭'}")
 
 
+@low_priority
 def get_expired_users_command(message):
     """获取已过期的用户 (管理员命令)"""
     telegram_id = message.from_user.id
     chat_id = message.chat.id
-    message_id = message.id
     logger.info(f"管理员请求获取已过期的用户列表: telegram_id={telegram_id}")
 
     settings.EXPIRED_DAYS = 30
@@ -569,36 +537,19 @@ def get_expired_users_command(message):
         bot.reply_to(message, "参数错误，请提供整数格式的过期时间！")
         return
 
-    expired_users = UserService.get_expired_users()
-
-    if expired_users and 'expired' in expired_users and expired_users['expired']:
-        expired_users_list = paginate_list(data_list=expired_users['expired'], page_size=50)
-        # expired_users_list = paginate_list_text(data_list=expired_users['expired'])
-        for expired_users in expired_users_list:
-            response = "已经过期用户列表：\n"
-            response += f"-----------\n"
-            for expired_user in expired_users:
-                response += f"{expired_user['username']}\n"
-            response += f"-----------\n"
-            response += f"已经过期的用户一共有：{len(expired_users)}位！\n"
-            bot.reply_to(message, response)
-        # expired_username_list = []
-        # for expired_user in expired_users['expired']:
-        #     expired_username_list.append(expired_user['username'])
-
-        # text, markup = create_pagination(chat_id, message_id, expired_username_list, items_per_page=50)
-        # bot.send_message(chat_id, text, reply_markup=markup)
-        logger.warning(f"管理员获取已经过期的用户列表成功: 共有{len(expired_users)}位！")
+    sent_message = create_pagination(chat_id, "expired_users", 50, params=("expired",))
+    if sent_message:
+        logger.warning(f"管理员获取已经过期的用户列表成功: telegram_id={telegram_id}")
     else:
         bot.reply_to(message, "没有已经过期的用户!")
         logger.info(f"没有已经过期的用户: telegram_id={telegram_id}")
 
 
+@low_priority
 def get_expiring_users_command(message):
     """获取即将过期的用户 (管理员命令)"""
     telegram_id = message.from_user.id
     chat_id = message.chat.id
-    message_id = message.id
     logger.info(f"管理员请求获取即将过期的用户列表: telegram_id={telegram_id}")
 
     settings.EXPIRED_DAYS = 30
@@ -620,32 +571,16 @@ def get_expiring_users_command(message):
         bot.reply_to(message, "参数错误，请提供整数格式的过期时间！")
         return
 
-    expiring_users = UserService.get_expired_users()
-
-    if expiring_users and 'warning' in expiring_users and expiring_users['warning']:
-        expiring_users_list = paginate_list(data_list=expiring_users['warning'], page_size=50)
-        # expiring_users_list = paginate_list_text(data_list=expiring_users['warning'])
-        for expiring_users in expiring_users_list:
-            response = "即将过期用户列表：\n"
-            response += f"-----------\n"
-            for expiring_user in expiring_users:
-                response += f"{expiring_user['username']}\n"
-            response += f"-----------\n"
-            response += f"即将过期的用户一共有：{len(expiring_users)}位！\n"
-            bot.reply_to(message, response)
-        # expiring_username_list = []
-        # for expired_user in expiring_users['warning']:
-        #     expiring_username_list.append(expired_user['username'])
-
-        # text, markup = create_pagination(chat_id, message_id, expiring_username_list, items_per_page=50)
-        # bot.send_message(chat_id, text, reply_markup=markup)
-        logger.warning(f"管理员获取即将过期的用户列表成功: 共有{len(expiring_users)}位！")
+    sent_message = create_pagination(chat_id, "expired_users", 50, params=("warning",))
+    if sent_message:
+        logger.warning(f"管理员获取即将过期的用户列表成功: telegram_id={telegram_id}")
     else:
         bot.reply_to(message, "没有即将过期的用户!")
         logger.info(f"没有即将过期的用户: telegram_id={telegram_id}")
 
 
 @confirmation_required("你确定要清理用户嘛？")
+@low_priority
 def clean_expired_users_command(message):
     """立即清理过期用户 (管理员命令)"""
     telegram_id = message.from_user.id
@@ -679,10 +614,11 @@ def clean_expired_users_command(message):
         logger.info(f"没有用户过期！")
 
 
+@low_priority
 def random_give_score_by_checkin_time_command(message):
     """
     根据签到时间给用户随机增加积分 (管理员命令)
-    /random_give_score_by_checkin_time <today|yesterday|2025-01-01>[可选] <max_score>[可选]
+    /random_give_score_by_checkin_time <today|yesterday|2025-01-01|2025-01-01~2025-01-07>[可选] <max_score>[可选]
     """
     telegram_id = message.from_user.id
     logger.info(f"管理员请求根据签到时间随机增加用户积分: telegram_id={telegram_id}")
@@ -694,18 +630,15 @@ def random_give_score_by_checkin_time_command(message):
 
     if len(args) == 0:
         logger.info("为今天所有签到的用户增加随机积分，最大积分为10分！")
-        users = UserService.get_sign_in_users(user_range)
     elif len(args) == 1:
-        logger.info(f"为今天签到所有签到的用户增加随机积分，最大积分为{max_score}分！")
         max_score = args[0]
-        users = UserService.get_sign_in_users(user_range)
+        logger.info(f"为今天签到所有签到的用户增加随机积分，最大积分为{max_score}分！")
     elif len(args) == 2:
-        logger.info(f"为{user_range}内所有签到的用户增加随机积分，最大积分为{max_score}分！")
         user_range, max_score = args
-        users = UserService.get_sign_in_users(user_range)
+        logger.info(f"为{user_range}内所有签到的用户增加随机积分，最大积分为{max_score}分！")
     else:
         bot.reply_to(message,
-                     "参数错误，请提供签到时间范围和最大积分数，格式为：/random_give_score_by_checkin_time <all|today|yesterday|weekly|month> "
+                     "参数错误，请提供签到时间范围和最大积分数，格式为：/random_give_score_by_checkin_time <today|yesterday|YYYY-MM-DD|YYYY-MM-DD~YYYY-MM-DD> "
                      "<max_score>")
         return
 
@@ -715,18 +648,23 @@ def random_give_score_by_checkin_time_command(message):
         bot.reply_to(message, "参数错误，最大积分数必须是整数！")
         return
 
-    if users:
-        for user in users:
-            score = ScoreService._generate_random_score(max_score=max_score)
-            ScoreService.add_score(user_id=user.id, score=score)
-            logger.info(f"为用户增加随机积分: telegram_id={telegram_id}, score={score}, range={user_range}")
-        bot.reply_to(message, f"已为{len(users)}个用户随机增加积分，范围: {user_range}，最大积分: {max_score}!")
+    user_ids = UserService.get_sign_in_user_ids(user_range)
+    if user_ids:
+        score_map = {user_id: ScoreService._generate_random_score(max_score=max_score) for user_id in user_ids}
+        count = ScoreService.grant_scores(score_map)
+        skipped = len(user_ids) - count
+        logger.info(f"为{count}个用户增加随机积分: telegram_id={telegram_id}, range={user_range}, skipped={skipped}")
+        response = f"已为{count}个用户随机增加积分，范围: {user_range}，最大积分: {max_score}!"
+        if skipped:
+            response += f"\n{skipped}个用户不存在，已跳过。"
+        bot.reply_to(message, response)
     else:
         bot.reply_to(message, "没有用户符合条件，无法增加积分")
         logger.info(f"没有用户符合条件，无法增加积分, range={user_range}")
 
 
 @confirmation_required(message_text="你确定要普天同庆吗？该过程较慢，Bot响应会比较慢。")
+@low_priority
 def add_random_score_command(message):
     """
     根据注册时间范围给用户随机增加积分 (管理员命令)
@@ -737,26 +675,23 @@ def add_random_score_command(message):
     logger.info(f"管理员请求根据注册时间范围随机增加用户积分: telegram_id={telegram_id}")
     args = message.text.split()
     max_score = 10
+    start_time = end_time = None
     if len(args) == 0:
         logger.info(f"为注册的所有用户增加随机积分！最大积分为10分")
-        users = UserService.get_users_by_register_time()
     elif len(args) == 1:
         max_score = args[0]
         logger.info(f"为注册的所有用户增加随机积分！最大积分为{max_score}")
-        users = UserService.get_users_by_register_time()
     elif len(args) == 2:
         start_time, end_time = args
         logger.info(f"为{start_time}-{end_time}期间注册所有用户增加随机积分！最大积分为10分")
-        start_time, end_time = args
-        users = UserService.get_users_by_register_time(start_time, end_time)
     elif len(args) == 3:
         start_time, end_time, max_score = args
         logger.info(f"为{start_time}-{end_time}期间注册所有用户增加随机积分！最大积分为{max_score}分")
-        users = UserService.get_users_by_register_time(start_time, end_time)
     else:
         logger.warning(f"提供的参数错误！")
         bot.reply_to(message,
                      "参数错误，请提供注册时间范围的开始时间、结束时间和最大积分数，格式为：/random_give_score_by_range_time <start_time>[可选] <end_time>[可选] <max_score>[可选]")
+        return
 
     try:
         max_score = int(max_score)
@@ -764,13 +699,31 @@ def add_random_score_command(message):
         bot.reply_to(message, "参数错误，最大积分数必须是整数！")
         return
 
-    users = UserService.get_users_by_register_time(start_time, end_time)
-    if users:
-        for user in users:
-            score = ScoreService._generate_random_score(max_score=max_score)
-            ScoreService.add_score(user_id=user.id, score=score)
-            logger.info(f"为用户增加随机积分: telegram_id={telegram_id}, score={score}")
-        bot.reply_to(message, f"已为{len(users)}个用户随机增加积分, 最大积分: {max_score}!")
+    try:
+        users = UserService.iter_users_by_register_time(start_time, end_time)
+    except ValueError:
+        bot.reply_to(message, "参数错误，时间格式必须是 YYYY-MM-DD！")
+        return
+
+    # 分批发放积分，每批在一个写操作中完成
+    count = total = 0
+    score_map = {}
+    for user in users:
+        score_map[user.id] = ScoreService._generate_random_score(max_score=max_score)
+        total += 1
+        if len(score_map) >= 500:
+            count += ScoreService.grant_scores(score_map)
+            score_map = {}
+    count += ScoreService.grant_scores(score_map)
+
+    if count:
+        skipped = total - count
+        logger.info(f"为{count}个用户增加随机积分: telegram_id={telegram_id}, start_time={start_time}, end_time={end_time}, "
+                    f"skipped={skipped}")
+        response = f"已为{count}个用户随机增加积分, 最大积分: {max_score}!"
+        if skipped:
+            response += f"\n{skipped}个用户已被删除，已跳过。"
+        bot.reply_to(message, response)
     else:
         bot.reply_to(message, "没有用户符合条件，无法增加积分")
         logger.info(f"没有用户符合条件，无法增加积分，start_time={start_time}, end_time={end_time}")
@@ -810,21 +763,24 @@ def get_user_info_in_server_command(message):
 def get_score_chart_command(message):
     """
     获取积分排行榜 (管理员命令)
-    /get_score_chart <num>
+    /get_score_chart <num> <page>
     """
     telegram_id = message.from_user.id
     logger.info(f"管理员请求获取积分排行榜: telegram_id={telegram_id}")
 
     args = message.text.split()
     limit = 10  # 默认10
+    page = 1
     if len(args) > 0:
         try:
             limit = int(args[0])
+            if len(args) > 1:
+                page = max(int(args[1]), 1)
         except ValueError:
-            bot.reply_to(message, "参数错误，排行榜用户数量必须是整数！")
+            bot.reply_to(message, "参数错误，排行榜用户数量和页码必须是整数！")
             return
 
-    score_chart = UserService.get_score_chart(limit=limit)
+    score_chart = UserService.get_score_chart(limit=limit, offset=(page - 1) * limit)
     if score_chart:
         response = "🏆 *积分排行榜*\n"
         response += f"排名 | 用户名 | 积分\n"
@@ -1055,4 +1011,65 @@ def get_user_status(message):
         # 如果输入不是整数，则尝试按用户名查找
         user = UserService.get_user_by_username(target_input)
 
-    bot.reply_to(message, f"用户状态：{user.status}\n\n 用户Telegram_ID：{user.telegram_id}")
\ No newline at end of file
+    bot.reply_to(message, f"用户状态：{user.status}\n\n 用户Telegram_ID：{user.telegram_id}")
+
+
+@confirmation_required("你确定要向所有用户群发这条消息嘛？")
+def broadcast_command(message):
+    """向所有注册用户群发消息 (管理员命令)"""
+    telegram_id = message.from_user.id
+    text = message.text.strip() if message.text else ""
+    if not text:
+        bot.reply_to(message, "群发内容不能为空！")
+        return
+    job = get_broadcaster().start(text, create_user_id=telegram_id)
+    logger.info(f"管理员创建群发任务: telegram_id={telegram_id}, job_id={job.id}")
+    bot.reply_to(message, f"群发任务已创建，任务 ID：{job.id}，可在“群发进度”中查看。")
+
+
+def get_broadcasts_command(message):
+    """查看最近的群发任务 (管理员命令)"""
+    jobs = BroadcastJob.get_recent()
+    if not jobs:
+        bot.reply_to(message, "没有群发任务！")
+        return
+    status_names = {BroadcastJob.STATUS_RUNNING: "发送中", BroadcastJob.STATUS_PAUSED: "已暂停",
+                    BroadcastJob.STATUS_FINISHED: "已完成", BroadcastJob.STATUS_CANCELLED: "已取消"}
+    response = "最近的群发任务：\n"
+    response += f"-----------\n"
+    for job in jobs:
+        response += (f"ID：{job.id} [{status_names.get(job.status, job.status)}] 成功：{job.sent_count}，"
+                     f"失败：{job.failed_count}，不可达：{job.blocked_count}\n")
+    if any(job.status == BroadcastJob.STATUS_PAUSED for job in jobs):
+        response += f"-----------\n已暂停的任务多次发送出错，可在“恢复群发”中继续或在“取消群发”中取消。\n"
+    bot.reply_to(message, response)
+
+
+def resume_broadcast_command(message):
+    """恢复已暂停的群发任务 (管理员命令)"""
+    args = message.text.split()
+    try:
+        job_id = int(args[0])
+    except (IndexError, ValueError):
+        bot.reply_to(message, "参数错误，请提供整数格式的任务 ID！")
+        return
+    if get_broadcaster().resume_job(job_id):
+        logger.info(f"管理员恢复群发任务: telegram_id={message.from_user.id}, job_id={job_id}")
+        bot.reply_to(message, f"群发任务 {job_id} 已恢复，将从上次的进度继续发送。")
+    else:
+        bot.reply_to(message, f"没有已暂停的群发任务：{job_id}")
+
+
+def cancel_broadcast_command(message):
+    """取消群发任务 (管理员命令)"""
+    args = message.text.split()
+    try:
+        job_id = int(args[0])
+    except (IndexError, ValueError):
+        bot.reply_to(message, "参数错误，请提供整数格式的任务 ID！")
+        return
+    if get_broadcaster().cancel(job_id):
+        logger.info(f"管理员取消群发任务: telegram_id={message.from_user.id}, job_id={job_id}")
+        bot.reply_to(message, f"群发任务 {job_id} 已取消，正在发送的批次完成后停止。")
+    else:
+        bot.reply_to(message, f"没有正在运行或已暂停的群发任务：{job_id}")
@@ -28,7 +28,12 @@ from app.bot.handlers.admin_handlers import (
     get_block_users,
     block_user_command,
     unblock_user_command,
-    set_whitelist_user
+    set_whitelist_user,
+    broadcast_command,
+    get_broadcasts_command,
+    get_upstream_stats_command,
+    resume_broadcast_command,
+    cancel_broadcast_command
 )
 
 
@@ -101,12 +106,17 @@ def create_status_management_panel():
     markup.row_width = 3
     markup.add(
         InlineKeyboardButton("获取统计信息", callback_data="admin_get_stats"),
+        InlineKeyboardButton("上游请求统计", callback_data="admin_get_upstream_stats"),
         InlineKeyboardButton("开启/关闭邀请码系统", callback_data="admin_toggle_invite_code_system"),
         InlineKeyboardButton("开启/关闭清理系统", callback_data="admin_toggle_expired_user_clean"),
         InlineKeyboardButton("获取过期用户", callback_data="admin_get_expired_users"),
         InlineKeyboardButton("获取即将过期用户", callback_data="admin_get_expiring_users"),
         InlineKeyboardButton("清理过期用户", callback_data="admin_clean_expired_users"),
         InlineKeyboardButton("开启/关闭消息清理", callback_data="admin_toggle_clean_msg_system"),
+        InlineKeyboardButton("群发消息", callback_data="admin_broadcast"),
+        InlineKeyboardButton("群发进度", callback_data="admin_get_broadcasts"),
+        InlineKeyboardButton("恢复群发", callback_data="admin_resume_broadcast"),
+        InlineKeyboardButton("取消群发", callback_data="admin_cancel_broadcast"),
         InlineKeyboardButton("返回主菜单", callback_data="admin_main_menu")
     )
     return markup
@@ -257,6 +267,8 @@ def admin_panel_callback(call):
             bot.register_next_step_handler(call.message, add_random_score_command)
         case "admin_get_stats":
             get_stats_command(call.message)
+        case "admin_get_upstream_stats":
+            get_upstream_stats_command(call.message)
         case "admin_toggle_invite_code_system":
             toggle_invite_code_system_command(call.message)
         case "admin_toggle_expired_user_clean": 
@@ -269,5 +281,19 @@ def admin_panel_callback(call):
             clean_expired_users_command(call.message)
         case "admin_toggle_clean_msg_system":
             toggle_clean_msg_system_command(call.message)
+        case "admin_broadcast":
+            bot.delete_message(chat_id, call.message.message_id)
+            bot.send_message(chat_id, "请输入要群发给所有用户的消息：<30S未输入自动退出>", reply_markup=markup, delay=30)
+            bot.register_next_step_handler(call.message, broadcast_command)
+        case "admin_get_broadcasts":
+            get_broadcasts_command(call.message)
+        case "admin_resume_broadcast":
+            bot.delete_message(chat_id, call.message.message_id)
+            bot.send_message(chat_id, "请输入要恢复的群发任务 ID：<30S未输入自动退出>", reply_markup=markup, delay=30)
+            bot.register_next_step_handler(call.message, resume_broadcast_command)
+        case "admin_cancel_broadcast":
+            bot.delete_message(chat_id, call.message.message_id)
+            bot.send_message(chat_id, "请输入要取消的群发任务 ID：<30S未输入自动退出>", reply_markup=markup, delay=30)
+            bot.register_next_step_handler(call.message, cancel_broadcast_command)
         case _:
             bot.send_message(chat_id, "未知操作，请重试！")
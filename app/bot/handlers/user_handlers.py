@@ -3,13 +3,15 @@ import json
 from app.services.user_service import UserService
 from app.services.score_service import ScoreService
 from app.services.invite_code_service import InviteCodeService
+from app.models import ScoreLedger
 from app.utils.message_queue import get_message_queue
 from app.utils.mailu import get_mailu
 from app.utils.logger import logger
 from config import settings
 from datetime import datetime, timedelta
 from app.bot.core.bot_instance import bot
-from app.bot.validators import user_exists, confirmation_required, score_enough, chat_type_required, service_id_exists
+from app.bot.validators import user_exists, confirmation_required, score_enough, chat_type_required, service_id_exists, \
+    upstream_available
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 
@@ -46,6 +48,7 @@ def help_command(message):
 
 
 @chat_type_required(["group", "supergroup"])
+@upstream_available
 @user_exists(negate=False)
 def register_user_command(message):
     if message.text.startswith('/'):
@@ -80,7 +83,7 @@ def reg_score_user_command(message):
     username = message.from_user.username
     logger.info(f"开始注册用户积分账号: telegram_id={telegram_id}, service_type={settings.SERVICE_TYPE}")
 
-    user = UserService.get_user_by_telegram_id(telegram_id=telegram_id)
+    user = UserService.resolve_user(message)
     if user:
         logger.info(f"本地用户已存在: user_id={user.id}")
         bot.reply_to(message, f"积分账号已存在，请勿重复注册")
@@ -93,6 +96,7 @@ def reg_score_user_command(message):
 
 
 @chat_type_required(["group", "supergroup"])
+@upstream_available
 @user_exists(negate=True)
 @confirmation_required(message_text="你确定要删除该用户吗？")
 def delete_user_command(message):
@@ -105,7 +109,7 @@ def delete_user_command(message):
     logger.info(f"用户请求删除账户: telegram_id={telegram_id}, service_type={service_type}")
 
     # 查找本地数据库中的用户
-    user = UserService.get_user_by_telegram_id(telegram_id)
+    user = UserService.resolve_user(message)
     if user:
         # 调用服务层的删除用户方法
         success = UserService.delete_user(user)
@@ -123,6 +127,7 @@ def delete_user_command(message):
 
 
 @chat_type_required(["group", "supergroup"])
+@upstream_available
 @user_exists(negate=False)
 def use_invite_code_command(message):
     """
@@ -223,13 +228,14 @@ def score_command(message):
     logger.info(f"用户查询积分: telegram_id={telegram_id}, service_type={service_type}")
 
     # 查找本地数据库中的用户
-    user = UserService.get_user_by_telegram_id(telegram_id)
+    user = UserService.resolve_user(message)
     if user:
         # 调用服务层的获取用户积分方法
         score = ScoreService.get_user_score(user.id)
         if score is not None:
             logger.info(f"用户积分查询成功: telegram_id={telegram_id}, username={user.username}, score={score}")
-            bot.reply_to(message, f"您的积分: {score}")
+            rank = UserService.get_score_rank(user.id)
+            bot.reply_to(message, f"您的积分: {score}，排名: 第 {rank} 名" if rank else f"您的积分: {score}")
         else:
             logger.error(f"用户积分查询失败: telegram_id={telegram_id}, username={user.username}")
             bot.reply_to(message, "查询积分失败，请重试!")
@@ -250,7 +256,7 @@ def checkin_command(message):
     logger.info(f"用户请求签到: telegram_id={telegram_id}, service_type={service_type}")
 
     # 查找本地数据库中的用户
-    user = UserService.get_user_by_telegram_id(telegram_id)
+    user = UserService.resolve_user(message)
     if user:
         # 调用服务层的签到方法
         score = ScoreService.sign_in(user.id)
@@ -279,14 +285,14 @@ def buy_invite_code_command(message):
     logger.info(f"用户请求购买邀请码: telegram_id={telegram_id}, service_type={service_type}")
 
     # 查找本地数据库中的用户
-    user = UserService.get_user_by_telegram_id(telegram_id)
+    user = UserService.resolve_user(message)
     if user:
         # 从配置文件中获取购买邀请码所需积分
         required_score = settings.INVITE_CODE_PRICE
         if user.score >= required_score:
             # 扣除积分
-            success = ScoreService.reduce_score(user.id, required_score)
-            if success:
+            new_score = ScoreService.reduce_score(user.id, required_score, ScoreLedger.REASON_BUY_INVITE)
+            if new_score is not None:
                 # 生成邀请码
                 invite_code = InviteCodeService.generate_invite_code(telegram_id)
                 if invite_code:
@@ -318,7 +324,7 @@ def info_command(message):
     处理 /info 命令，用户信息查询
     """
     telegram_id = message.from_user.id
-    user = UserService.get_user_by_telegram_id(telegram_id)
+    user = UserService.resolve_user(message)
     if user:
         logger.info(f"user: {user}")
         logger.info(f"用户信息查询成功: telegram_id={telegram_id}, user_id={user.id}")
@@ -369,7 +375,7 @@ def give_score_command(message):
         return
 
     # 检查赠送者是否存在
-    sender = UserService.get_user_by_telegram_id(telegram_id)
+    sender = UserService.resolve_user(message)
     if not sender:
         bot.reply_to(message, "未找到您的账户信息!")
         return
@@ -385,11 +391,8 @@ def give_score_command(message):
         bot.reply_to(message, f"您的积分不足，无法赠送 {score} 积分！")
         return
 
-    # 扣除赠送者积分，增加接收者积分
-    sender = ScoreService.reduce_score(sender.id, score)
-    receiver = ScoreService.add_score(receiver.id, score)
-
-    if sender and receiver:
+    # 在一个事务中扣除赠送者积分，增加接收者积分
+    if ScoreService.transfer_score(sender.id, receiver.id, score) is not None:
         logger.info(f"用户赠送积分成功: sender_id={sender.id}, receiver_id={receiver.id}, score={score}")
         bot.reply_to(message, f"您已成功向用户 {receiver_telegram_id} 赠送 {score} 积分!")
     else:
@@ -398,6 +401,7 @@ def give_score_command(message):
 
 
 @chat_type_required(["group", "supergroup"])
+@upstream_available
 def bind_command(message):
     """
     处理 /bind 命令，绑定 Web 服务账户
@@ -457,7 +461,7 @@ def unbind_command(message):
     logger.info(f"用户请求解绑账户: telegram_id={telegram_id}, service_type={service_type}")
 
     # 查找本地数据库中的用户
-    user = UserService.get_user_by_telegram_id(telegram_id)
+    user = UserService.resolve_user(message)
     if user:
         # 删除本地用户
         UserService.delete_local_user(user)
@@ -469,6 +473,7 @@ def unbind_command(message):
 
 
 @chat_type_required(["group", "supergroup"])
+@upstream_available
 # @user_exists(negate=True)
 @service_id_exists
 @confirmation_required(f"你确定要重置密码嘛？")
@@ -490,7 +495,7 @@ def reset_password_command(message):
         return
 
     new_password = args[0]
-    user = UserService.get_user_by_telegram_id(telegram_id)
+    user = UserService.resolve_user(message)
     if user and UserService.get_info_in_service_by_user_id(user.service_user_id):
         # 重置密码
         result = UserService.reset_password(user, new_password=new_password)
@@ -507,6 +512,7 @@ def reset_password_command(message):
 
 
 @chat_type_required(["group", "supergroup"])
+@upstream_available
 # @user_exists(negate=True)
 @service_id_exists
 def reset_username_command(message):
@@ -527,7 +533,7 @@ def reset_username_command(message):
         return
 
     new_username = args[0]
-    user = UserService.get_user_by_telegram_id(telegram_id)
+    user = UserService.resolve_user(message)
     if user and user.username != new_username:
         if UserService.get_info_in_service_by_user_id(user.service_user_id):
             # 重置用户名
@@ -569,19 +575,15 @@ def random_score_command(message):
         bot.reply_to(message, "参数错误，参与人数和总积分数必须是整数！")
 
         return
+    user = UserService.resolve_user(message)
+    # 创建活动和扣除积分在同一个写操作中完成，积分不足时不会发出红包
     event_id = ScoreService.create_random_score_event(create_user_id=message.from_user.id,
                                                       telegram_chat_id=message.chat.id, total_score=total_score,
-                                                      participants_count=participants_count)
+                                                      participants_count=participants_count, payer_id=user.id)
     if not event_id:
-        bot.reply_to(message, "创建积分活动失败")
-
+        bot.reply_to(message, "创建积分活动失败，请检查参与人数和总积分，或积分不足！")
         return
-
-    user = UserService.get_user_by_telegram_id(message.from_user.id)
-    logger.info(
-        f"用户 {user.username} 发送了总分为{total_score}分随机积分红包，原有积分为{user.score}分, 剩余积分为{user.score - total_score}分")
-    if ScoreService.reduce_score(user.id, total_score):
-        logger.info(f"积分成功扣除{total_score}分")
+    logger.info(f"用户 {user.username} 发送了总分为{total_score}分随机积分红包，积分成功扣除{total_score}分")
 
     keyboard = InlineKeyboardMarkup(
         [
@@ -662,7 +664,7 @@ def register_mail_command(message):
     logger.info(f"用户请求注册邮件: telegram_id={telegram_id}, service_type={service_type}")
 
     # 查找本地数据库中的用户
-    user = UserService.get_user_by_telegram_id(telegram_id)
+    user = UserService.resolve_user(message)
     if user:
         # 从配置文件中获取购买邀请码所需积分
         required_score = settings.MAILU_PRICE
@@ -671,7 +673,7 @@ def register_mail_command(message):
             result = mailu.create_user(f"{username}{domain_prefix}", password)
             if result and result['status'] == 'success':
                 logger.info(f"用户注册邮件成功：telegram_id = {telegram_id}, user = {user.username}")
-                success = ScoreService.reduce_score(user.id, required_score)
+                ScoreService.reduce_score(user.id, required_score, ScoreLedger.REASON_BUY_MAILU)
                 bot.reply_to(message, f"注册音海拾贝专属邮件成功，您的邮箱：<code>{username}{domain_prefix}</code>", parse_mode="HTML")    
             elif result and result['status'] == "duplicate":
                 logger.warning(f"用户名重复，要求用户重新输入！当前用户：{username}")
@@ -2,6 +2,7 @@
 from functools import wraps
 from app.services.user_service import UserService
 from app.services.invite_code_service import InviteCodeService
+from app.utils.api_clients import service_api_client
 from app.utils.logger import logger
 from datetime import datetime, timedelta
 from app.bot.core.bot_instance import bot
@@ -25,7 +26,7 @@ def user_exists(negate=True):
             telegram_id = message.from_user.id
             logger.debug(f"校验用户是否存在: telegram_id={telegram_id}")
 
-            user = UserService.get_user_by_telegram_id(telegram_id=telegram_id)
+            user = UserService.resolve_user(message)
 
             if user:
                 if negate:
@@ -69,7 +70,7 @@ def service_id_exists(func):
         telegram_id = message.from_user.id
         logger.debug(f"校验用户是否存在service_user_id: telegram_id={telegram_id}")
 
-        user = UserService.get_user_by_telegram_id(telegram_id=telegram_id)
+        user = UserService.resolve_user(message)
 
         if user and user.service_user_id:
             logger.info(f"用户存在service_user_id: telegram_id={telegram_id}")
@@ -82,6 +83,23 @@ def service_id_exists(func):
     return wrapper
         
     
+def upstream_available(func):
+    """
+    上游服务熔断时直接回复服务不可用，不再等待上游服务超时
+    """
+
+    @wraps(func)
+    def wrapper(message, *args, **kwargs):
+        retry_after = service_api_client.session.breaker.retry_after()
+        if retry_after > 0:
+            logger.info(f"上游服务熔断中，拒绝执行: telegram_id={message.from_user.id}, retry_after={retry_after:.0f}")
+            bot.reply_to(message, f"{settings.SERVICE_TYPE} 服务暂时不可用，请 {int(retry_after) + 1} 秒后再试！")
+            return
+        return func(message, *args, **kwargs)
+
+    return wrapper
+
+
 def admin_required(func):
     """
     验证用户是否是管理员的装饰器
@@ -169,7 +187,7 @@ def score_enough():
             required_score = int(message.text.split(" ")[-1]) if len(message.text.split(" ")) > 1 else 0
 
             logger.debug(f"校验用户积分是否足够: telegram_id={telegram_id}, required_score={required_score}")
-            user = UserService.get_user_by_telegram_id(telegram_id=telegram_id)
+            user = UserService.resolve_user(message)
 
             if user and user.score >= required_score:
                 logger.debug(
@@ -305,7 +323,7 @@ def user_status_required(status=None):
         @wraps(func)
         def wrapper(message, *args, **kwargs):
             telegram_id = message.from_user.id
-            user = UserService.get_user_by_telegram_id(telegram_id=telegram_id)
+            user = UserService.resolve_user(message)
             if user and user.status in status:
                 logger.debug(f"用户状态为{status}，允许执行: telegram_id={telegram_id}")
                 return func(message, *args, **kwargs)
@@ -0,0 +1,177 @@
+import hmac
+import json
+import queue
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+import telebot
+from app.utils.logger import logger
+from config import settings
+
+# 需要安装的模块：无
+
+MAX_BODY_SIZE = 1024 * 1024  # 单个 update 的最大字节数
+DEDUPE_SIZE = 10000  # 记住最近多少个 update_id 用于去重
+
+
+class WebhookServer:
+    """
+    Webhook 服务
+
+    内置 HTTP 服务接收 Telegram 推送的 update：校验 secret token，按 update_id 去重后放入有界队列立即返回 200，
+    由一个分发线程按入队顺序取出并交给 bot（UpdateDispatcher 按聊天分通道并行处理）。
+    解析和分发的代价很小，只用一个线程保证同一聊天的 update 按接收顺序进入通道。
+    队列已满时返回 503，Telegram 会稍后重试同一个 update，实现背压。
+    """
+
+    def __init__(self, bot, url=None, host=None, port=None, secret_token=None, queue_size=None):
+        """
+        初始化 Webhook 服务
+        Args:
+            bot: TeleBot 实例
+            url: Telegram 推送的地址，其路径即为服务监听的路径
+            host: 监听地址
+            port: 监听端口
+            secret_token: Telegram 请求头 X-Telegram-Bot-Api-Secret-Token 的值，为空时不校验
+            queue_size: update 队列长度
+        """
+        self.bot = bot
+        self.url = url or settings.WEBHOOK_URL
+        self.path = urlparse(self.url).path or "/"
+        self.host = host or settings.WEBHOOK_LISTEN
+        self.port = port or settings.WEBHOOK_PORT
+        self.secret_token = secret_token if secret_token is not None else settings.WEBHOOK_SECRET_TOKEN
+        self._queue = queue.Queue(maxsize=queue_size or settings.WEBHOOK_QUEUE_SIZE)
+        self._seen = OrderedDict()  # 最近收到的 update_id
+        self._lock = threading.Lock()
+        self._thread = None
+        self._httpd = None
+        self._stats = {"received": 0, "duplicates": 0, "rejected": 0, "unauthorized": 0, "processed": 0, "failed": 0}
+
+    def _incr(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _check_secret(self, headers):
+        """校验 secret token"""
+        if not self.secret_token:
+            return True
+        token = headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        return hmac.compare_digest(token, self.secret_token)
+
+    def _mark_seen(self, update_id):
+        """
+        记录 update_id
+        Returns:
+            是否为新的 update
+        """
+        with self._lock:
+            if update_id in self._seen:
+                return False
+            self._seen[update_id] = True
+            while len(self._seen) > DEDUPE_SIZE:
+                self._seen.popitem(last=False)
+            return True
+
+    def _forget(self, update_id):
+        """入队失败时移除 update_id，Telegram 重试时可以重新接收"""
+        with self._lock:
+            self._seen.pop(update_id, None)
+
+    def handle_update(self, headers, body):
+        """
+        处理一个 webhook 请求
+        Returns:
+            HTTP 状态码
+        """
+        if not self._check_secret(headers):
+            self._incr("unauthorized")
+            return 403
+        try:
+            data = json.loads(body)
+            update_id = data["update_id"]
+        except (ValueError, KeyError, TypeError):
+            return 400
+        self._incr("received")
+        if not self._mark_seen(update_id):
+            self._incr("duplicates")
+            return 200
+        try:
+            self._queue.put_nowait(data)
+        except queue.Full:
+            self._forget(update_id)
+            self._incr("rejected")
+            logger.warning(f"Webhook 队列已满，拒绝 update: update_id={update_id}")
+            return 503
+        return 200
+
+    def _dispatch_loop(self):
+        """分发线程：按入队顺序取出 update 交给 bot"""
+        while True:
+            data = self._queue.get()
+            if data is None:
+                break
+            try:
+                update = telebot.types.Update.de_json(data)
+                self.bot.process_new_updates([update])
+                self._incr("processed")
+            except Exception as e:
+                self._incr("failed")
+                logger.error(f"处理 update 失败: update_id={data.get('update_id')}, error={e}")
+
+    def _make_handler(self):
+        """创建 HTTP 请求处理类"""
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path.split("?", 1)[0] != server.path:
+                    return self._reply(404)
+                length = int(self.headers.get("Content-Length") or 0)
+                if length <= 0 or length > MAX_BODY_SIZE:
+                    return self._reply(413 if length > MAX_BODY_SIZE else 400)
+                status = server.handle_update(self.headers, self.rfile.read(length))
+                self._reply(status)
+
+            def _reply(self, status):
+                self.send_response(status)
+                if status == 503:
+                    self.send_header("Retry-After", "1")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                logger.debug(f"Webhook 请求: {self.address_string()} {format % args}")
+
+        return Handler
+
+    def start(self):
+        """启动分发线程和 HTTP 服务线程"""
+        self._thread = threading.Thread(target=self._dispatch_loop, name="webhook-dispatch", daemon=True)
+        self._thread.start()
+        self._httpd = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+        self._httpd.daemon_threads = True
+        threading.Thread(target=self._httpd.serve_forever, name="webhook-server", daemon=True).start()
+        logger.info(f"Webhook 服务已启动: host={self.host}, port={self.port}, path={self.path}")
+
+    def serve_forever(self):
+        """启动服务并阻塞当前线程"""
+        self.start()
+        self._thread.join()
+
+    def stop(self):
+        """停止 HTTP 服务和分发线程"""
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+        if self._thread:
+            self._queue.put(None)
+        logger.info("Webhook 服务已停止")
+
+    def get_stats(self):
+        """获取 Webhook 服务统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["queue_size"] = self._queue.qsize()
+        return stats
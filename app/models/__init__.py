@@ -1,4 +1,6 @@
 # app/models/__init__.py
 
 from .user import User, ServiceUser
-from .invite_code import InviteCode
\ No newline at end of file
+from .invite_code import InviteCode
+from .score_ledger import ScoreLedger
+from .broadcast import BroadcastJob
@@ -0,0 +1,136 @@
+from app.utils.db_utils import db_connection, execute_write
+from app.utils.logger import logger
+
+
+# 需要安装的模块：无
+class BroadcastJob:
+    """
+    群发任务模型
+
+    按 Users.id 顺序分页发送，last_user_id 记录已经发送完成的最后一个用户，重启后从该位置继续。
+    多次出错的任务标记为 paused，重启时不会自动恢复，由管理员恢复或取消。
+    """
+
+    STATUS_RUNNING = 'running'
+    STATUS_PAUSED = 'paused'
+    STATUS_FINISHED = 'finished'
+    STATUS_CANCELLED = 'cancelled'
+
+    def __init__(self, text, service_type, parse_mode=None, status=STATUS_RUNNING, last_user_id=0, sent_count=0,
+                 failed_count=0, blocked_count=0, create_user_id=None, create_time=None, update_time=None, id=None):
+        self.id = id
+        self.text = text
+        self.service_type = service_type
+        self.parse_mode = parse_mode
+        self.status = status
+        self.last_user_id = last_user_id
+        self.sent_count = sent_count
+        self.failed_count = failed_count
+        self.blocked_count = blocked_count
+        self.create_user_id = create_user_id
+        self.create_time = create_time
+        self.update_time = update_time
+
+    @staticmethod
+    def _from_row(row):
+        return BroadcastJob(row['text'], row['service_type'], row['parse_mode'], row['status'], row['last_user_id'],
+                            row['sent_count'], row['failed_count'], row['blocked_count'], row['create_user_id'],
+                            row['create_time'], row['update_time'], row['id'])
+
+    @staticmethod
+    def create(text, service_type, parse_mode=None, create_user_id=None):
+        """
+        创建群发任务
+        Returns:
+            BroadcastJob
+        """
+        logger.debug(f"创建群发任务: service_type={service_type}, create_user_id={create_user_id}")
+        job_id = execute_write(lambda conn: conn.execute(
+            "INSERT INTO BroadcastJobs (text, parse_mode, service_type, create_user_id) VALUES (?, ?, ?, ?)",
+            (text, parse_mode, service_type, create_user_id)
+        ).lastrowid)
+        return BroadcastJob.get_by_id(job_id)
+
+    @staticmethod
+    def get_by_id(job_id):
+        """根据 ID 获取群发任务"""
+        with db_connection() as conn:
+            row = conn.execute("SELECT * FROM BroadcastJobs WHERE id = ?", (job_id,)).fetchone()
+        return BroadcastJob._from_row(row) if row else None
+
+    @staticmethod
+    def get_by_status(status):
+        """获取指定状态的群发任务"""
+        with db_connection() as conn:
+            rows = conn.execute("SELECT * FROM BroadcastJobs WHERE status = ? ORDER BY id", (status,)).fetchall()
+        return [BroadcastJob._from_row(row) for row in rows]
+
+    @staticmethod
+    def get_recent(limit=5):
+        """获取最近的群发任务"""
+        with db_connection() as conn:
+            rows = conn.execute("SELECT * FROM BroadcastJobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [BroadcastJob._from_row(row) for row in rows]
+
+    def get_recipients(self, limit=100):
+        """
+        获取 last_user_id 之后的下一页接收者，跳过不可达的聊天
+        Returns:
+            [(用户 ID, telegram_id)] 列表，按用户 ID 升序
+        """
+        with db_connection() as conn:
+            rows = conn.execute(
+                "SELECT u.id, u.telegram_id FROM Users u WHERE u.id > ? AND u.service_type = ? "
+                "AND NOT EXISTS (SELECT 1 FROM BlockedChats b WHERE b.chat_id = u.telegram_id) ORDER BY u.id LIMIT ?",
+                (self.last_user_id, self.service_type, limit)
+            ).fetchall()
+        return [(row['id'], row['telegram_id']) for row in rows]
+
+    def checkpoint(self, last_user_id, sent, failed, blocked_chats):
+        """
+        保存一页的发送结果，更新进度和记录不可达的聊天在同一个写操作中完成
+        Args:
+            last_user_id: 本页最后一个用户 ID
+            sent: 本页发送成功的数量
+            failed: 本页发送失败的数量
+            blocked_chats: 本页发现的不可达聊天 [(chat_id, 原因)] 列表
+        """
+        def _checkpoint(conn):
+            conn.executemany("INSERT OR IGNORE INTO BlockedChats (chat_id, reason) VALUES (?, ?)", blocked_chats)
+            conn.execute(
+                "UPDATE BroadcastJobs SET last_user_id = ?, sent_count = sent_count + ?, failed_count = failed_count + ?, "
+                "blocked_count = blocked_count + ?, update_time = CURRENT_TIMESTAMP WHERE id = ?",
+                (last_user_id, sent, failed, len(blocked_chats), self.id)
+            )
+
+        execute_write(_checkpoint)
+        self.last_user_id = last_user_id
+        self.sent_count += sent
+        self.failed_count += failed
+        self.blocked_count += len(blocked_chats)
+
+    def set_status(self, status):
+        """更新任务状态"""
+        logger.debug(f"更新群发任务状态: id={self.id}, status={status}")
+        execute_write(lambda conn: conn.execute(
+            "UPDATE BroadcastJobs SET status = ?, update_time = CURRENT_TIMESTAMP WHERE id = ?", (status, self.id)
+        ))
+        self.status = status
+
+    @staticmethod
+    def block_chat(chat_id, reason=None):
+        """记录不可达的聊天，之后的群发会跳过"""
+        execute_write(lambda conn: conn.execute(
+            "INSERT OR REPLACE INTO BlockedChats (chat_id, reason) VALUES (?, ?)", (chat_id, reason)
+        ))
+
+    @staticmethod
+    def unblock_chat(chat_id):
+        """聊天重新可达（例如用户重新与 Bot 对话）时移出不可达列表"""
+        return execute_write(lambda conn: conn.execute(
+            "DELETE FROM BlockedChats WHERE chat_id = ?", (chat_id,)
+        ).rowcount)
+
+    def __str__(self):
+        return (f"BroadcastJob(id={self.id}, status={self.status}, last_user_id={self.last_user_id}, "
+                f"sent={self.sent_count}, failed={self.failed_count}, blocked={self.blocked_count})")
@@ -1,7 +1,7 @@
 import random
 import string
 from datetime import datetime, timedelta
-from app.utils.db_utils import get_db_connection, close_db_connection
+from app.utils.db_utils import db_connection, execute_write
 from config import settings
 from app.utils.logger import logger
 
@@ -31,27 +31,27 @@ class InviteCode:
     def save(self):
         """保存邀请码到数据库"""
         logger.info(f"保存邀请码到数据库: id={self.id}, code={self.code}, type={self.type}, create_user_id={self.create_user_id}")
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        if self.id:
-            # 更新
-            cursor.execute(
-                "UPDATE InviteCodes SET code=?, is_used=?, user_id=?, create_time=?, expire_days=?, create_user_id=?, type=? WHERE id=?",
-                (self.code, self.is_used, self.user_id, self.create_time, self.expire_days, self.create_user_id, self.type, self.id)
-            )
-            logger.debug(f"更新邀请码数据: id={self.id}, code={self.code}, create_user_id={self.create_user_id}")
-        else:
-            # 插入
-            cursor.execute(
-                "INSERT INTO InviteCodes (code, is_used, user_id, create_time, expire_days, create_user_id, type) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (self.code, self.is_used, self.user_id, self.create_time, self.expire_days, self.create_user_id, self.type)
-            )
-            self.id = cursor.lastrowid
-            logger.debug(f"插入邀请码数据: id={self.id}, code={self.code}, create_user_id={self.create_user_id}")
-
-        conn.commit()
-        close_db_connection(conn)
+
+        def _save(conn):
+            cursor = conn.cursor()
+
+            if self.id:
+                # 更新
+                cursor.execute(
+                    "UPDATE InviteCodes SET code=?, is_used=?, user_id=?, create_time=?, expire_days=?, create_user_id=?, type=? WHERE id=?",
+                    (self.code, self.is_used, self.user_id, self.create_time, self.expire_days, self.create_user_id, self.type, self.id)
+                )
+                logger.debug(f"更新邀请码数据: id={self.id}, code={self.code}, create_user_id={self.create_user_id}")
+            else:
+                # 插入
+                cursor.execute(
+                    "INSERT INTO InviteCodes (code, is_used, user_id, create_time, expire_days, create_user_id, type) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (self.code, self.is_used, self.user_id, self.create_time, self.expire_days, self.create_user_id, self.type)
+                )
+                self.id = cursor.lastrowid
+                logger.debug(f"插入邀请码数据: id={self.id}, code={self.code}, create_user_id={self.create_user_id}")
+
+        execute_write(_save)
         logger.info(f"邀请码保存成功: id={self.id}, code={self.code}, create_user_id={self.create_user_id}")
         return self
 
@@ -59,12 +59,11 @@ class InviteCode:
     def get_by_code(code):
         """根据邀请码查询"""
         logger.info(f"查询邀请码: code={code}")
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute("SELECT * FROM InviteCodes WHERE code = ?", (code,))
-        row = cursor.fetchone()
-        close_db_connection(conn)
+            cursor.execute("SELECT * FROM InviteCodes WHERE code = ?", (code,))
+            row = cursor.fetchone()
 
         if row:
             logger.info(f"查询邀请码成功: code={code}, id={row['id']}")
@@ -111,26 +110,51 @@ class InviteCode:
     def get_all():
       """查询所有邀请码"""
       logger.info("查询所有邀请码")
-      conn = get_db_connection()
-      cursor = conn.cursor()
+      with db_connection() as conn:
+          cursor = conn.cursor()
 
-      cursor.execute("SELECT * FROM InviteCodes")
-      rows = cursor.fetchall()
-      close_db_connection(conn)
+          cursor.execute("SELECT * FROM InviteCodes")
+          rows = cursor.fetchall()
       logger.info(f"查询所有邀请码成功, 共 {len(rows)} 个邀请码")
 
       return [InviteCode(row['code'], row['is_used'], row['user_id'], row['create_time'], row['expire_days'], row['create_user_id'], row['type'], row['id']) for row in rows]
 
+    @staticmethod
+    def get_page(code_type=None, is_used=None, offset=0, limit=50):
+        """
+        分页查询邀请码，按 ID 排序
+        Args:
+            code_type: 邀请码类型，None 表示不筛选
+            is_used: 是否已使用，None 表示不筛选
+            offset: 跳过的条目数
+            limit: 返回的条目数，为 0 时只查询总数
+        Returns:
+            (当前页邀请码列表, 总数)
+        """
+        conditions, params = [], []
+        if is_used is not None:
+            conditions.append("is_used = ?")
+            params.append(is_used)
+        if code_type is not None:
+            conditions.append("type = ?")
+            params.append(code_type)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        logger.debug(f"分页查询邀请码: code_type={code_type}, is_used={is_used}, offset={offset}, limit={limit}")
+        with db_connection() as conn:
+            total = conn.execute(f"SELECT COUNT(*) FROM InviteCodes{where}", params).fetchone()[0]
+            rows = conn.execute(f"SELECT * FROM InviteCodes{where} ORDER BY id LIMIT ? OFFSET ?",
+                                (*params, limit, offset)).fetchall() if limit else []
+        return [InviteCode(row['code'], row['is_used'], row['user_id'], row['create_time'], row['expire_days'], row['create_user_id'], row['type'], row['id']) for row in rows], total
+
     @staticmethod
     def get_by_is_used(is_used):
         """根据邀请码使用状态查询"""
         logger.info(f"查询邀请码,使用状态：is_used={is_used}")
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute("SELECT * FROM InviteCodes WHERE is_used = ?", (is_used,))
-        rows = cursor.fetchall()
-        close_db_connection(conn)
+            cursor.execute("SELECT * FROM InviteCodes WHERE is_used = ?", (is_used,))
+            rows = cursor.fetchall()
         if rows:
             logger.info(f"查询邀请码成功,使用状态：is_used={is_used}, count = {len(rows)}")
             return [InviteCode(row['code'], row['is_used'], row['user_id'], row['create_time'], row['expire_days'], row['create_user_id'], row['type'], row['id']) for row in rows]
@@ -142,11 +166,7 @@ class InviteCode:
       """删除邀请码"""
       logger.info(f"删除邀请码: id={self.id}, code={self.code}")
       if self.id:
-          conn = get_db_connection()
-          cursor = conn.cursor()
-          cursor.execute("DELETE FROM InviteCodes WHERE id = ?", (self.id,))
-          conn.commit()
-          close_db_connection(conn)
+          execute_write(lambda conn: conn.execute("DELETE FROM InviteCodes WHERE id = ?", (self.id,)))
           logger.info(f"邀请码删除成功: id={self.id}, code={self.code}")
           self.id = None  # 删除后将 id 设置为 None
       else:
@@ -0,0 +1,197 @@
+from app.utils.db_utils import db_connection, execute_write
+from app.utils.logger import logger
+
+
+# 需要安装的模块：无
+class ScoreLedger:
+    """
+    积分流水模型
+
+    只追加不修改，每次积分变动与余额更新在同一个写操作中记录。
+    ScoreSnapshots 定期保存所有用户的余额快照，快照之前的流水可以压缩删除。
+    """
+
+    # 积分变动原因
+    REASON_SYSTEM = 'system'
+    REASON_ADMIN_ADD = 'admin_add'
+    REASON_ADMIN_REDUCE = 'admin_reduce'
+    REASON_ADMIN_SET = 'admin_set'
+    REASON_ADMIN_GRANT = 'admin_grant'
+    REASON_SIGN_IN = 'sign_in'
+    REASON_GIVE_OUT = 'give_out'
+    REASON_GIVE_IN = 'give_in'
+    REASON_RED_PACKET_SEND = 'red_packet_send'
+    REASON_RED_PACKET_CLAIM = 'red_packet_claim'
+    REASON_BUY_INVITE = 'buy_invite'
+    REASON_BUY_MAILU = 'buy_mailu'
+
+    def __init__(self, user_id, delta, balance, reason, ref_id=None, create_time=None, id=None):
+        self.id = id
+        self.user_id = user_id
+        self.delta = delta
+        self.balance = balance
+        self.reason = reason
+        self.ref_id = ref_id
+        self.create_time = create_time
+
+    @staticmethod
+    def record(conn, user_id, delta, reason, ref_id=None):
+        """
+        在当前写操作中记录一条流水，余额取自更新后的 Users.score
+        Args:
+            conn: 写操作的数据库连接
+        Returns:
+            流水 ID，按提交顺序递增，可以作为积分的版本号
+        """
+        return conn.execute(
+            "INSERT INTO ScoreLedger (user_id, delta, balance, reason, ref_id) SELECT id, ?, score, ?, ? FROM Users WHERE id = ?",
+            (delta, reason, ref_id, user_id)
+        ).lastrowid
+
+    @staticmethod
+    def record_many(conn, score_map, reason, ref_id=None):
+        """
+        在当前写操作中批量记录流水
+        Args:
+            conn: 写操作的数据库连接
+            score_map: 字典，用户 ID -> 积分变化量
+        Returns:
+            (写入的流水条数, 不存在的用户 ID 列表)
+        """
+        written = conn.executemany(
+            "INSERT INTO ScoreLedger (user_id, delta, balance, reason, ref_id) SELECT id, ?, score, ?, ? FROM Users WHERE id = ?",
+            [(delta, reason, ref_id, user_id) for user_id, delta in score_map.items()]
+        ).rowcount
+        unmatched = []
+        if written < len(score_map):
+            user_ids = list(score_map)
+            for i in range(0, len(user_ids), 500):
+                chunk = user_ids[i:i + 500]
+                rows = conn.execute(f"SELECT id FROM Users WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+                found = {row['id'] for row in rows}
+                unmatched.extend(user_id for user_id in chunk if user_id not in found)
+            logger.warning(f"批量记录积分流水时用户不存在: reason={reason}, user_ids={unmatched}")
+        return written, unmatched
+
+    @staticmethod
+    def get_history(user_id, limit=20, before_id=None):
+        """
+        查询用户的积分流水，按时间倒序
+        Args:
+            user_id: 用户 ID
+            limit: 返回的条数
+            before_id: 只返回 id 小于该值的流水，用于翻页
+        """
+        logger.debug(f"查询积分流水: user_id={user_id}, limit={limit}, before_id={before_id}")
+        with db_connection() as conn:
+            if before_id:
+                rows = conn.execute(
+                    "SELECT * FROM ScoreLedger WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                    (user_id, before_id, limit)
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT * FROM ScoreLedger WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+                    (user_id, limit)
+                ).fetchall()
+        return [ScoreLedger(row['user_id'], row['delta'], row['balance'], row['reason'], row['ref_id'],
+                            row['create_time'], row['id']) for row in rows]
+
+    @staticmethod
+    def get_window_leaderboard(start_time, end_time, limit=10, reason=None):
+        """
+        统计时间窗口内积分净增加最多的用户
+        Args:
+            start_time: 开始时间（包含），格式与 create_time 一致，例如 '2024-12-25 00:00:00'
+            end_time: 结束时间（不包含）
+            limit: 返回的用户数量
+            reason: 只统计指定原因的流水
+        Returns:
+            [(user_id, 净增积分)] 列表
+        """
+        logger.debug(f"查询时间窗口积分排行: start_time={start_time}, end_time={end_time}, reason={reason}")
+        query = "SELECT user_id, SUM(delta) AS total FROM ScoreLedger WHERE create_time >= ? AND create_time < ?"
+        params = [start_time, end_time]
+        if reason:
+            query += " AND reason = ?"
+            params.append(reason)
+        query += " GROUP BY user_id ORDER BY total DESC LIMIT ?"
+        params.append(limit)
+        with db_connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+        return [(row['user_id'], row['total']) for row in rows]
+
+    @staticmethod
+    def audit(user_id=None):
+        """
+        对账：最近一次快照余额加上之后的流水应当等于当前余额
+        Args:
+            user_id: 只检查指定用户，None 表示检查所有用户
+        Returns:
+            [(user_id, 当前余额, 流水计算余额)] 不一致的用户列表
+        """
+        logger.debug(f"积分对账: user_id={user_id}")
+        query = """
+            SELECT u.id AS user_id, u.score AS score,
+                   COALESCE(s.score, 0) + COALESCE((
+                       SELECT SUM(l.delta) FROM ScoreLedger l
+                       WHERE l.user_id = u.id AND l.id > COALESCE(s.ledger_id, 0)
+                   ), 0) AS expected
+            FROM Users u
+            LEFT JOIN ScoreSnapshots s ON s.user_id = u.id
+                AND s.id = (SELECT MAX(id) FROM ScoreSnapshots WHERE user_id = u.id)
+        """
+        params = ()
+        if user_id is not None:
+            query += " WHERE u.id = ?"
+            params = (user_id,)
+        with db_connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+        return [(row['user_id'], row['score'], row['expected']) for row in rows if row['score'] != row['expected']]
+
+    @staticmethod
+    def take_snapshot():
+        """
+        保存所有用户的余额快照，记录快照时的最大流水 ID
+        Returns:
+            快照的用户数量
+        """
+        def _snapshot(conn):
+            return conn.execute("""
+                INSERT INTO ScoreSnapshots (user_id, score, ledger_id)
+                SELECT id, score, (SELECT COALESCE(MAX(id), 0) FROM ScoreLedger) FROM Users
+            """).rowcount
+
+        count = execute_write(_snapshot)
+        logger.info(f"积分快照保存成功: count={count}")
+        return count
+
+    @staticmethod
+    def compact(before_time):
+        """
+        压缩流水：删除 before_time 之前的快照（每个用户保留该时间之前的最近一次快照），
+        以及该快照已覆盖的流水
+        Args:
+            before_time: 截止时间，格式与 create_time 一致
+        Returns:
+            (删除的流水数量, 删除的快照数量)
+        """
+        def _compact(conn):
+            # 以截止时间前最近一次快照为基准，保留该快照，删除更早的快照和被它覆盖的流水
+            base = conn.execute(
+                "SELECT ledger_id, snapshot_time FROM ScoreSnapshots WHERE snapshot_time < ? ORDER BY id DESC LIMIT 1",
+                (before_time,)
+            ).fetchone()
+            if not base:
+                return 0, 0
+            ledger_count = conn.execute("DELETE FROM ScoreLedger WHERE id <= ?", (base['ledger_id'],)).rowcount
+            snapshot_count = conn.execute("DELETE FROM ScoreSnapshots WHERE snapshot_time < ?",
+                                          (base['snapshot_time'],)).rowcount
+            return ledger_count, snapshot_count
+
+        ledger_count, snapshot_count = execute_write(_compact)
+        logger.info(f"积分流水压缩完成: ledger_count={ledger_count}, snapshot_count={snapshot_count}")
+        return ledger_count, snapshot_count
+
+    def __str__(self):
+        return f"<ScoreLedger id={self.id}, user_id={self.user_id}, delta={self.delta}, balance={self.balance}, reason={self.reason}, ref_id={self.ref_id}, create_time={self.create_time}>"
@@ -1,8 +1,36 @@
+import copy
 from datetime import datetime
-from app.utils.db_utils import get_db_connection, close_db_connection
+from app.models.score_ledger import ScoreLedger
+from app.utils.db_utils import db_connection, execute_write, format_utc_datetime
+from app.utils.leaderboard import get_leaderboard
+from app.utils.cache import TTLCache, MISSING
 from app.utils.logger import logger
 from config import settings
 
+# 用户身份缓存：(telegram_id, service_type) -> ServiceUser，用户不存在时缓存 None
+_user_cache = TTLCache(settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL)
+
+
+def invalidate_user_cache(user_id=None, telegram_id=None):
+    """
+    用户数据变动后使缓存失效
+    Args:
+        user_id: 用户 ID
+        telegram_id: Telegram ID
+    """
+    _user_cache.delete_where(lambda key, user: key[0] == telegram_id or (
+            user is not None and user_id is not None and user.id == user_id))
+
+
+def get_user_cache_generation():
+    """获取用户缓存失效代数，任意用户数据变动后都会变化"""
+    return _user_cache.generation
+
+
+def get_user_cache_stats():
+    """获取用户缓存统计信息"""
+    return _user_cache.get_stats()
+
 
 # 需要安装的模块：无
 class User:
@@ -28,51 +56,69 @@ class User:
         logger.debug(f"创建用户模型: id={self.id}, telegram_id={self.telegram_id}, service_type={self.service_type}")
 
     def save(self):
-        """保存用户信息到数据库"""
+        """保存用户信息到数据库，更新时不写入积分，积分只通过 change_score、set_score 等原子操作修改"""
         logger.debug(
             f"保存用户信息到数据库: id={self.id}, telegram_id={self.telegram_id}, service_type={self.service_type}")
-        conn = get_db_connection()
-        cursor = conn.cursor()
 
-        if self.id:
-            # 更新
-            cursor.execute(
-                "UPDATE Users SET telegram_id = ?, service_type = ?, score = ?, invite_code = ?, last_sign_in_date = ?, username = ?, status = ?, expiration_date = ? WHERE id = ?",
-                (self.telegram_id, self.service_type, self.score, self.invite_code, self.last_sign_in_date,
-                 self.username, self.status, self.expiration_date, self.id)
-            )
-            logger.debug(
-                f"更新用户数据: id={self.id}, telegram_id={self.telegram_id}, service_type={self.service_type}")
-        else:
-            # 插入
-            cursor.execute(
-                "INSERT INTO Users (telegram_id, service_type, score, invite_code, last_sign_in_date, username, status, expiration_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                (self.telegram_id, self.service_type, self.score, self.invite_code, self.last_sign_in_date,
-                 self.username, self.status, self.expiration_date)
-            )
-            self.id = cursor.lastrowid
-            logger.debug(
-                f"插入用户数据: id={self.id}, telegram_id={self.telegram_id}, service_type={self.service_type}")
+        def _save(conn):
+            cursor = conn.cursor()
 
-        conn.commit()
-        close_db_connection(conn)
+            if self.id:
+                # 更新
+                cursor.execute(
+                    "UPDATE Users SET telegram_id = ?, service_type = ?, invite_code = ?, last_sign_in_date = ?, username = ?, status = ?, expiration_date = ? WHERE id = ?",
+                    (self.telegram_id, self.service_type, self.invite_code, format_utc_datetime(self.last_sign_in_date),
+                     self.username, self.status, self.expiration_date, self.id)
+                )
+                logger.debug(
+                    f"更新用户数据: id={self.id}, telegram_id={self.telegram_id}, service_type={self.service_type}")
+            else:
+                # 插入
+                cursor.execute(
+                    "INSERT INTO Users (telegram_id, service_type, score, invite_code, last_sign_in_date, username, status, expiration_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (self.telegram_id, self.service_type, self.score, self.invite_code, format_utc_datetime(self.last_sign_in_date),
+                     self.username, self.status, self.expiration_date)
+                )
+                self.id = cursor.lastrowid
+                # 初始积分也记一条流水，保证对账时流水之和等于余额
+                version = ScoreLedger.record(conn, self.id, self.score, ScoreLedger.REASON_SYSTEM) if self.score else None
+                logger.debug(
+                    f"插入用户数据: id={self.id}, telegram_id={self.telegram_id}, service_type={self.service_type}")
+                return True, version
+            return False, None
+
+        inserted, version = execute_write(_save)
+        invalidate_user_cache(self.id, self.telegram_id)
+        self._update_leaderboard(inserted, version)
         logger.debug(
             f"用户信息保存成功: id={self.id}, telegram_id={self.telegram_id}, service_type={self.service_type}")
         return self
 
+    def _update_leaderboard(self, inserted, version):
+        """
+        保存后更新排行榜：已有用户只更新用户名，积分由原子操作负责更新；
+        新用户按初始积分的流水 ID 入榜，没有初始积分时没有版本号，排行榜标记失效后重新加载
+        Args:
+            inserted: 是否为新插入的用户
+            version: 初始积分的流水 ID
+        """
+        if inserted:
+            get_leaderboard().update_score(self.id, self.score, self.telegram_id, self.username, version)
+        else:
+            get_leaderboard().update_profile(self.id, self.username)
+
     @staticmethod
     def get_by_telegram_id_and_service_type(telegram_id, service_type=None):
         """根据 Telegram ID 和服务名称查询用户"""
         logger.debug(f"查询用户: telegram_id={telegram_id}, service_type={service_type}")
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute(
-            "SELECT * FROM Users WHERE telegram_id = ? AND service_type = ?",
-            (telegram_id, service_type)
-        )
-        row = cursor.fetchone()
-        close_db_connection(conn)
+            cursor.execute(
+                "SELECT * FROM Users WHERE telegram_id = ? AND service_type = ?",
+                (telegram_id, service_type)
+            )
+            row = cursor.fetchone()
 
         if row:
             logger.debug(f"查询用户成功: telegram_id={telegram_id}, service_type={service_type}, id={row['id']}")
@@ -86,12 +132,11 @@ class User:
     def get_by_id(user_id):
         """根据用户 ID 查询用户"""
         logger.debug(f"查询用户: user_id={user_id}")
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute("SELECT * FROM Users WHERE id = ?", (user_id,))
-        row = cursor.fetchone()
-        close_db_connection(conn)
+            cursor.execute("SELECT * FROM Users WHERE id = ?", (user_id,))
+            row = cursor.fetchone()
 
         if row:
             logger.debug(f"查询用户成功: user_id={user_id}, telegram_id={row['telegram_id']}")
@@ -105,26 +150,29 @@ class User:
     def get_all():
         """查询所有用户"""
         logger.debug("查询所有用户")
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute("SELECT * FROM Users")
-        rows = cursor.fetchall()
-        close_db_connection(conn)
+            cursor.execute("SELECT * FROM Users")
+            rows = cursor.fetchall()
 
         logger.debug(f"查询所有用户成功，共 {len(rows)} 个用户")
         return [User(row['telegram_id'], row['service_type'], row['score'], row['invite_code'], row['id'],
                      row['last_sign_in_date'], row['username'], row['status'], row['expiration_date']) for row in rows]
 
+    @staticmethod
+    def count():
+        """查询用户数量"""
+        with db_connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM Users").fetchone()[0]
+
     def delete(self):
         """从数据库中删除用户"""
         logger.debug(f"删除用户: id={self.id}, telegram_id={self.telegram_id}, service_type={self.service_type}")
         if self.id:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM Users WHERE id = ?", (self.id,))
-            conn.commit()
-            close_db_connection(conn)
+            execute_write(lambda conn: conn.execute("DELETE FROM Users WHERE id = ?", (self.id,)))
+            invalidate_user_cache(self.id, self.telegram_id)
+            get_leaderboard().remove(self.id)
             logger.debug(
                 f"用户删除成功: id={self.id}, telegram_id={self.telegram_id}, service_type={self.service_type}")
             self.id = None  # 删除后将 id 设置为 None
@@ -150,61 +198,76 @@ class ServiceUser(User):
             f"创建 {service_type} 用户模型: id={self.id}, telegram_id={self.telegram_id}, service_user_id={self.service_user_id}")
 
     def save(self):
-        """保存用户信息到数据库"""
+        """保存用户信息到数据库，更新时不写入积分，积分只通过 change_score、set_score 等原子操作修改"""
         logger.debug(
             f"保存 {self.service_type} 用户信息到数据库: id={self.id}, telegram_id={self.telegram_id}, service_type={self.service_type}, service_user_id={self.service_user_id}")
-        conn = get_db_connection()
-        cursor = conn.cursor()
 
-        if self.id:
-            # 更新
-            cursor.execute(
-                "UPDATE Users SET telegram_id = ?, service_type = ?, score = ?, invite_code = ?, service_user_id = ?, last_sign_in_date = ?, username = ?, status = ?, expiration_date = ? WHERE id = ?",
-                (self.telegram_id, self.service_type, self.score, self.invite_code, self.service_user_id,
-                 self.last_sign_in_date, self.username, self.status, self.expiration_date, self.id)
-            )
-            logger.debug(
-                f"更新 {self.service_type} 用户数据: id={self.id}, telegram_id={self.telegram_id}, service_type={self.service_type}, service_user_id={self.service_user_id}")
-        else:
-            # 插入
-            cursor.execute(
-                "INSERT INTO Users (telegram_id, service_type, score, invite_code, service_user_id, last_sign_in_date, username, status, expiration_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                (self.telegram_id, self.service_type, self.score, self.invite_code, self.service_user_id,
-                 self.last_sign_in_date, self.username, self.status, self.expiration_date)
-            )
-            self.id = cursor.lastrowid
-            logger.debug(
-                f"插入 {self.service_type} 用户数据: id={self.id}, telegram_id={self.telegram_id}, service_type={self.service_type}, service_user_id={self.service_user_id}")
+        def _save(conn):
+            cursor = conn.cursor()
 
-        conn.commit()
-        close_db_connection(conn)
+            if self.id:
+                # 更新
+                cursor.execute(
+                    "UPDATE Users SET telegram_id = ?, service_type = ?, invite_code = ?, service_user_id = ?, last_sign_in_date = ?, username = ?, status = ?, expiration_date = ? WHERE id = ?",
+                    (self.telegram_id, self.service_type, self.invite_code, self.service_user_id,
+                     format_utc_datetime(self.last_sign_in_date), self.username, self.status, self.expiration_date, self.id)
+                )
+                logger.debug(
+                    f"更新 {self.service_type} 用户数据: id={self.id}, telegram_id={self.telegram_id}, service_type={self.service_type}, service_user_id={self.service_user_id}")
+            else:
+                # 插入
+                cursor.execute(
+                    "INSERT INTO Users (telegram_id, service_type, score, invite_code, service_user_id, last_sign_in_date, username, status, expiration_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (self.telegram_id, self.service_type, self.score, self.invite_code, self.service_user_id,
+                     format_utc_datetime(self.last_sign_in_date), self.username, self.status, self.expiration_date)
+                )
+                self.id = cursor.lastrowid
+                # 初始积分也记一条流水，保证对账时流水之和等于余额
+                version = ScoreLedger.record(conn, self.id, self.score, ScoreLedger.REASON_SYSTEM) if self.score else None
+                logger.debug(
+                    f"插入 {self.service_type} 用户数据: id={self.id}, telegram_id={self.telegram_id}, service_type={self.service_type}, service_user_id={self.service_user_id}")
+                return True, version
+            return False, None
+
+        inserted, version = execute_write(_save)
+        invalidate_user_cache(self.id, self.telegram_id)
+        self._update_leaderboard(inserted, version)
         logger.debug(
             f"{self.service_type} 用户信息保存成功: id={self.id}, telegram_id={self.telegram_id}, service_type={self.service_type}, service_user_id={self.service_user_id}")
         return self
 
     @staticmethod
     def get_by_telegram_id_and_service_type(telegram_id, service_type=None):
-        """根据 Telegram ID 和服务名称查询用户"""
+        """根据 Telegram ID 和服务名称查询用户，结果会被缓存"""
         service_type = service_type if service_type is not None else settings.SERVICE_TYPE
+        key = (telegram_id, service_type)
+        cached = _user_cache.get(key)
+        if cached is not MISSING:
+            logger.debug(f"查询 {service_type} 用户命中缓存: telegram_id={telegram_id}")
+            return copy.copy(cached)  # 返回副本，调用方修改对象不会影响缓存
+
         logger.debug(f"查询 {service_type} 用户: telegram_id={telegram_id}, service_type={service_type}")
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        generation = _user_cache.generation
+        with db_connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute(
-            "SELECT * FROM Users WHERE telegram_id = ? AND service_type = ?",
-            (telegram_id, service_type)
-        )
-        row = cursor.fetchone()
-        close_db_connection(conn)
+            cursor.execute(
+                "SELECT * FROM Users WHERE telegram_id = ? AND service_type = ?",
+                (telegram_id, service_type)
+            )
+            row = cursor.fetchone()
 
         if row:
             logger.debug(
                 f"查询 {service_type} 用户成功: telegram_id={telegram_id}, service_type={service_type}, id={row['id']}")
-            return ServiceUser(row['telegram_id'], row['score'], row['invite_code'], row['id'], row['service_user_id'],
+            user = ServiceUser(row['telegram_id'], row['score'], row['invite_code'], row['id'], row['service_user_id'],
                                row['last_sign_in_date'], row['service_type'], row['username'], row['status'],
                                row['expiration_date'])
+            _user_cache.set(key, copy.copy(user), generation)
+            return user
         else:
             logger.warning(f"{service_type} 用户不存在: telegram_id={telegram_id}, service_type={service_type}")
+            _user_cache.set(key, None, generation)
             return None
 
     @staticmethod
@@ -212,12 +275,11 @@ class ServiceUser(User):
         """根据用户 ID 查询用户"""
         service_type = service_type if service_type is not None else settings.SERVICE_TYPE
         logger.debug(f"查询 {service_type} 用户: user_id={user_id}")
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute("SELECT * FROM Users WHERE id = ?", (user_id,))
-        row = cursor.fetchone()
-        close_db_connection(conn)
+            cursor.execute("SELECT * FROM Users WHERE id = ?", (user_id,))
+            row = cursor.fetchone()
 
         if row:
             logger.debug(f"查询 {service_type} 用户成功: user_id={user_id}, telegram_id={row['telegram_id']}")
@@ -233,12 +295,11 @@ class ServiceUser(User):
         """根据用户 ID 查询用户"""
         service_type = service_type if service_type is not None else settings.SERVICE_TYPE
         logger.debug(f"查询 {service_type} 用户: user_id={user_id}")
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute("SELECT * FROM Users WHERE service_user_id = ?", (user_id,))
-        row = cursor.fetchone()
-        close_db_connection(conn)
+            cursor.execute("SELECT * FROM Users WHERE service_user_id = ?", (user_id,))
+            row = cursor.fetchone()
 
         if row:
             logger.debug(f"查询 {service_type} 用户成功: user_id={user_id}, telegram_id={row['telegram_id']}")
@@ -254,12 +315,11 @@ class ServiceUser(User):
         """根据 {service_type} 用户名查询用户"""
         service_type = service_type if service_type is not None else settings.SERVICE_TYPE
         logger.debug(f"根据 {service_type} 用户名查询用户: username={username}")
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute("SELECT * FROM Users WHERE username = ?", (username,))
-        row = cursor.fetchone()
-        close_db_connection(conn)
+            cursor.execute("SELECT * FROM Users WHERE username = ?", (username,))
+            row = cursor.fetchone()
 
         if row:
             logger.debug(
@@ -276,18 +336,232 @@ class ServiceUser(User):
         """查询所有用户"""
         service_type = service_type if service_type is not None else settings.SERVICE_TYPE
         logger.debug("查询所有 {service_type} 用户")
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute("SELECT * FROM Users")
-        rows = cursor.fetchall()
-        close_db_connection(conn)
+            cursor.execute("SELECT * FROM Users")
+            rows = cursor.fetchall()
 
         logger.debug(f"查询所有 {service_type} 用户成功, 共 {len(rows)} 个用户")
         return [ServiceUser(row['telegram_id'], row['score'], row['invite_code'], row['id'], row['service_user_id'],
                             row['last_sign_in_date'], row['service_type'], row['username'], row['status'],
                             row['expiration_date']) for row in rows]
 
+    @staticmethod
+    def iter_by_create_time(start_time=None, end_time=None, batch_size=500):
+        """
+        按注册时间范围分批查询用户（生成器）
+
+        使用 create_time 索引过滤，按 (create_time, id) 键集分页，每批从上一批最后一行之后沿索引继续读取，
+        每批查询完成后即释放连接，不会一次性加载所有用户。create_time 为空的用户不返回。
+        Args:
+            start_time: 开始时间（包含），格式与 create_time 一致，例如 '2024-12-25 00:00:00'，None 表示不限制
+            end_time: 结束时间（不包含），None 表示不限制
+            batch_size: 每批查询的用户数量
+        """
+        logger.debug(f"按注册时间范围查询用户: start_time={start_time}, end_time={end_time}")
+        conditions, params = [], []
+        if start_time is not None:
+            conditions.append("create_time >= ?")
+            params.append(start_time)
+        else:
+            conditions.append("create_time IS NOT NULL")
+        if end_time is not None:
+            conditions.append("create_time < ?")
+            params.append(end_time)
+        first_query = f"SELECT * FROM Users WHERE {' AND '.join(conditions)} ORDER BY create_time, id LIMIT ?"
+        conditions.append("(create_time > ? OR (create_time = ? AND id > ?))")
+        next_query = f"SELECT * FROM Users WHERE {' AND '.join(conditions)} ORDER BY create_time, id LIMIT ?"
+
+        last = None
+        while True:
+            with db_connection() as conn:
+                if last is None:
+                    rows = conn.execute(first_query, (*params, batch_size)).fetchall()
+                else:
+                    rows = conn.execute(next_query, (*params, last[0], last[0], last[1], batch_size)).fetchall()
+            for row in rows:
+                yield ServiceUser(row['telegram_id'], row['score'], row['invite_code'], row['id'],
+                                  row['service_user_id'], row['last_sign_in_date'], row['service_type'],
+                                  row['username'], row['status'], row['expiration_date'])
+            if len(rows) < batch_size:
+                break
+            last = (rows[-1]['create_time'], rows[-1]['id'])
+
+    @staticmethod
+    def get_ids_by_sign_in_range(start_time, end_time):
+        """
+        查询签到时间在指定范围内的用户 ID
+
+        Args:
+            start_time: 开始时间（包含），UTC 时间字符串，格式见 format_utc_datetime
+            end_time: 结束时间（不包含），UTC 时间字符串
+        Returns:
+            用户 ID 列表
+        """
+        logger.debug(f"查询签到用户 ID: start_time={start_time}, end_time={end_time}")
+        with db_connection() as conn:
+            rows = conn.execute(
+                "SELECT id FROM Users WHERE last_sign_in_date >= ? AND last_sign_in_date < ?",
+                (start_time, end_time)
+            ).fetchall()
+        logger.debug(f"查询签到用户 ID 成功: count={len(rows)}")
+        return [row['id'] for row in rows]
+
+    @staticmethod
+    def change_score(user_id, delta, min_score=None, reason=ScoreLedger.REASON_SYSTEM, ref_id=None):
+        """
+        原子增减用户积分，并在同一个写操作中记录积分流水
+
+        Args:
+            user_id: 用户 ID
+            delta: 积分变化量，负数表示扣减
+            min_score: 扣减前要求的最低积分，不满足时不做修改
+            reason: 积分变动原因，见 ScoreLedger.REASON_*
+            ref_id: 关联的业务 ID，例如红包活动 ID
+        Returns:
+            修改后的积分，用户不存在或积分不足时返回 None
+        """
+        logger.debug(f"修改用户积分: user_id={user_id}, delta={delta}, min_score={min_score}, reason={reason}")
+        result = execute_write(ServiceUser.apply_score_change, user_id, delta, min_score, reason, ref_id)
+        return ServiceUser.on_score_changed(user_id, result)
+
+    @staticmethod
+    def apply_score_change(conn, user_id, delta, min_score=None, reason=ScoreLedger.REASON_SYSTEM, ref_id=None):
+        """
+        在调用方的写操作中原子增减积分并记录流水，用于和其他修改放在同一个事务中，
+        提交后把返回值交给 on_score_changed
+        Args:
+            conn: 写操作的数据库连接
+        Returns:
+            (RETURNING 行, 流水 ID)，用户不存在或积分不足时返回 None
+        """
+        if min_score is None:
+            rows = conn.execute("UPDATE Users SET score = score + ? WHERE id = ? RETURNING score, telegram_id, username",
+                                (delta, user_id)).fetchall()
+        else:
+            rows = conn.execute("UPDATE Users SET score = score + ? WHERE id = ? AND score >= ? "
+                                "RETURNING score, telegram_id, username", (delta, user_id, min_score)).fetchall()
+        if not rows:
+            return None
+        return rows[0], ScoreLedger.record(conn, user_id, delta, reason, ref_id)
+
+    @staticmethod
+    def set_score(user_id, score, reason=ScoreLedger.REASON_ADMIN_SET):
+        """
+        设置用户积分，并记录积分流水
+        Returns:
+            修改后的积分，用户不存在时返回 None
+        """
+        logger.debug(f"设置用户积分: user_id={user_id}, score={score}")
+
+        def _set(conn):
+            row = conn.execute("SELECT score FROM Users WHERE id = ?", (user_id,)).fetchone()
+            if not row:
+                return None
+            rows = conn.execute("UPDATE Users SET score = ? WHERE id = ? RETURNING score, telegram_id, username",
+                                (score, user_id)).fetchall()
+            return rows[0], ScoreLedger.record(conn, user_id, score - row['score'], reason)
+
+        return ServiceUser.on_score_changed(user_id, execute_write(_set))
+
+    @staticmethod
+    def add_scores(score_map, reason=ScoreLedger.REASON_ADMIN_GRANT, ref_id=None):
+        """
+        批量增加用户积分，在一个事务中完成并记录积分流水，不存在的用户跳过
+        Args:
+            score_map: 字典，用户 ID -> 积分变化量
+            reason: 积分变动原因
+        Returns:
+            实际更新的用户数量，小于 score_map 的长度时说明有用户不存在
+        """
+        logger.debug(f"批量修改用户积分: count={len(score_map)}, reason={reason}")
+        params = [(delta, user_id) for user_id, delta in score_map.items()]
+
+        def _add(conn):
+            count = conn.executemany("UPDATE Users SET score = score + ? WHERE id = ?", params).rowcount
+            ScoreLedger.record_many(conn, score_map, reason, ref_id)
+            return count
+
+        count = execute_write(_add)
+        _user_cache.delete_where(lambda key, user: user is not None and user.id in score_map)
+        get_leaderboard().invalidate()
+        return count
+
+    @staticmethod
+    def transfer_score(from_user_id, to_user_id, score):
+        """
+        在一个事务中从一个用户转移积分给另一个用户，转出方积分不足时不做修改
+        Returns:
+            (转出方积分, 转入方积分)，失败时返回 None
+        """
+        logger.debug(f"转移用户积分: from_user_id={from_user_id}, to_user_id={to_user_id}, score={score}")
+
+        def _transfer(conn):
+            sender = conn.execute(
+                "UPDATE Users SET score = score - ? WHERE id = ? AND score >= ? RETURNING score, telegram_id, username",
+                (score, from_user_id, score)
+            ).fetchall()
+            if not sender:
+                return None
+            receiver = conn.execute(
+                "UPDATE Users SET score = score + ? WHERE id = ? RETURNING score, telegram_id, username",
+                (score, to_user_id)
+            ).fetchall()
+            if not receiver:
+                raise ValueError(f"用户不存在: user_id={to_user_id}")  # 回滚已扣除的积分
+            sender_version = ScoreLedger.record(conn, from_user_id, -score, ScoreLedger.REASON_GIVE_OUT, str(to_user_id))
+            receiver_version = ScoreLedger.record(conn, to_user_id, score, ScoreLedger.REASON_GIVE_IN, str(from_user_id))
+            return (sender[0], sender_version), (receiver[0], receiver_version)
+
+        result = execute_write(_transfer)
+        if result is None:
+            return None
+        return (ServiceUser.on_score_changed(from_user_id, result[0]),
+                ServiceUser.on_score_changed(to_user_id, result[1]))
+
+    @staticmethod
+    def sign_in(user_id, score, sign_in_time, day_start):
+        """
+        原子签到，仅当用户在 day_start 之后没有签到过时增加积分并记录签到时间和积分流水
+
+        Args:
+            user_id: 用户 ID
+            score: 签到获得的积分
+            sign_in_time: 签到时间
+            day_start: 当天开始时间（UTC 时间字符串）
+        Returns:
+            签到后的积分，已签到或用户不存在时返回 None
+        """
+        logger.debug(f"用户签到: user_id={user_id}, score={score}")
+
+        def _sign_in(conn):
+            rows = conn.execute(
+                "UPDATE Users SET score = score + ?, last_sign_in_date = ? "
+                "WHERE id = ? AND (last_sign_in_date IS NULL OR last_sign_in_date < ?) RETURNING score, telegram_id, username",
+                (score, format_utc_datetime(sign_in_time), user_id, day_start)
+            ).fetchall()
+            if not rows:
+                return None
+            return rows[0], ScoreLedger.record(conn, user_id, score, ScoreLedger.REASON_SIGN_IN)
+
+        return ServiceUser.on_score_changed(user_id, execute_write(_sign_in))
+
+    @staticmethod
+    def on_score_changed(user_id, result):
+        """
+        积分变动后使用户缓存失效并更新排行榜，返回变动后的积分
+        Args:
+            result: 写操作返回的 (RETURNING 行, 流水 ID)，失败时为 None
+        """
+        if result is None:
+            return None
+        row, version = result
+        invalidate_user_cache(user_id, row['telegram_id'])
+        # 流水 ID 作为版本号，排行榜丢弃比已应用版本旧的更新，调用方线程的执行顺序不影响结果
+        get_leaderboard().update_score(user_id, row['score'], row['telegram_id'], row['username'], version)
+        return row['score']
+
     @staticmethod
     def update_username(telegram_id, new_username, service_type=None):
         """
@@ -299,19 +573,20 @@ class ServiceUser(User):
         """
         service_type = service_type if service_type is not None else settings.SERVICE_TYPE
         logger.debug(f"修改 {service_type} 用户名: new_username={new_username}")
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        cursor.execute("UPDATE Users SET username = ? WHERE telegram_id = ? AND service_type = ?",
-                       (new_username, telegram_id, service_type))
-        conn.commit()
-        # 获取更新后的数据
-        cursor.execute(
-            "SELECT * FROM Users WHERE telegram_id = ? AND service_type = ?",
-            (telegram_id, service_type)
-        )
-        row = cursor.fetchone()
-        close_db_connection(conn)
+        def _update(conn):
+            cursor = conn.cursor()
+
+            cursor.execute("UPDATE Users SET username = ? WHERE telegram_id = ? AND service_type = ?",
+                           (new_username, telegram_id, service_type))
+            # 获取更新后的数据
+            cursor.execute(
+                "SELECT * FROM Users WHERE telegram_id = ? AND service_type = ?",
+                (telegram_id, service_type)
+            )
+            return cursor.fetchone()
+
+        row = execute_write(_update)
+        invalidate_user_cache(telegram_id=telegram_id)
         if row:
             logger.debug(
                 f"修改 {service_type} 用户名成功, 返回新的ServiceUser对象: new_username={new_username}, telegram_id={telegram_id}, service_type={service_type}, id={row['id']}")
@@ -327,13 +602,12 @@ class ServiceUser(User):
         """获取用户状态"""
         service_type = service_type if service_type is not None else settings.SERVICE_TYPE
         logger.debug(f"获取 {service_type} 用户状态: telegram_id={telegram_id}")
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute("SELECT status FROM Users WHERE telegram_id = ? AND service_type = ?",
-                       (telegram_id, service_type))
-        row = cursor.fetchone()
-        close_db_connection(conn)
+            cursor.execute("SELECT status FROM Users WHERE telegram_id = ? AND service_type = ?",
+                           (telegram_id, service_type))
+            row = cursor.fetchone()
 
         if row:
             logger.debug(f"获取 {service_type} 用户状态成功: telegram_id={telegram_id}, status={row['status']}")
@@ -347,19 +621,20 @@ class ServiceUser(User):
         """修改用户状态"""
         service_type = service_type if service_type is not None else settings.SERVICE_TYPE
         logger.debug(f"修改 {service_type} 用户状态: telegram_id={telegram_id}, new_status={new_status}")
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        cursor.execute("UPDATE Users SET status = ? WHERE telegram_id = ? AND service_type = ?",
-                       (new_status, telegram_id, service_type))
-        conn.commit()
-        # 获取更新后的数据
-        cursor.execute(
-            "SELECT * FROM Users WHERE telegram_id = ? AND service_type = ?",
-            (telegram_id, service_type)
-        )
-        row = cursor.fetchone()
-        close_db_connection(conn)
+        def _update(conn):
+            cursor = conn.cursor()
+
+            cursor.execute("UPDATE Users SET status = ? WHERE telegram_id = ? AND service_type = ?",
+                           (new_status, telegram_id, service_type))
+            # 获取更新后的数据
+            cursor.execute(
+                "SELECT * FROM Users WHERE telegram_id = ? AND service_type = ?",
+                (telegram_id, service_type)
+            )
+            return cursor.fetchone()
+
+        row = execute_write(_update)
+        invalidate_user_cache(telegram_id=telegram_id)
         if row:
             logger.debug(
                 f"修改 {service_type} 用户状态成功, 返回新的ServiceUser对象: new_status={new_status}, telegram_id={telegram_id}, service_type={service_type}, id={row['id']}")
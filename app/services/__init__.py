@@ -2,4 +2,5 @@
 
 from .user_service import UserService
 from .invite_code_service import InviteCodeService
-from .score_service import ScoreService
\ No newline at end of file
+from .score_service import ScoreService
+from .stats_service import StatsService
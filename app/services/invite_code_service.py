@@ -154,6 +154,22 @@ class InviteCodeService:
             logger.warning("获取所有邀请码失败")
             return None
 
+    @staticmethod
+    def get_invite_code_page(code_type=None, is_used=None, offset=0, limit=50):
+        """
+        分页获取邀请码，只读取当前页
+
+        Args:
+            code_type: 邀请码类型，'invite' 或 'renew'，默认为 None（不筛选）
+            is_used: 是否使用，True 或 False，默认为 None（不筛选）
+            offset: 跳过的条目数
+            limit: 每页条目数，为 0 时只返回总数
+
+        Returns:
+            (当前页邀请码列表, 总数)
+        """
+        return InviteCode.get_page(code_type, is_used, offset, limit)
+
     @staticmethod
     def delete_invite_code(invite_code):
         """删除邀请码"""
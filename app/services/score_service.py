@@ -1,12 +1,14 @@
 # 积分服务
-from app.models import User
+from app.models import User, ServiceUser, ScoreLedger
 from app.utils.logger import logger
 from app.services.user_service import UserService
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import pytz
 import json
 import random
-from app.utils.db_utils import insert_data, select_data, update_data
+from app.utils.db_utils import select_data, execute_write
+from app.utils.scheduler import get_scheduler
+from config import settings
 # 需要安装的模块：无
 
 class ScoreService:
@@ -35,55 +37,92 @@ class ScoreService:
             return None
 
     @staticmethod
-    def add_score(user_id, score):
+    def add_score(user_id, score, reason=ScoreLedger.REASON_SYSTEM, ref_id=None):
         """
         增加用户积分
 
         Args:
             user_id: 用户 ID
             score: 增加的积分
+            reason: 积分变动原因，见 ScoreLedger.REASON_*
+            ref_id: 关联的业务 ID
 
         Returns:
-            更新后的用户对象，如果用户不存在则返回 None
+            更新后的积分，如果用户不存在则返回 None
         """
         logger.debug(f"增加用户积分: user_id={user_id}, score={score}")
-        user = UserService.get_user_by_id(user_id)
-        if user:
-            user.score += score
-            user.save()
-            logger.debug(f"增加用户积分成功: user_id={user_id}, score={user.score}")
-            return user
+        new_score = ServiceUser.change_score(user_id, score, reason=reason, ref_id=ref_id)
+        if new_score is not None:
+            logger.debug(f"增加用户积分成功: user_id={user_id}, score={new_score}")
         else:
             logger.warning(f"用户不存在: user_id={user_id}")
-            return None
+        return new_score
+
+    @staticmethod
+    def grant_scores(score_map, reason=ScoreLedger.REASON_ADMIN_GRANT):
+        """
+        批量增加用户积分，在一个事务中完成
+
+        Args:
+            score_map: 字典，用户 ID -> 增加的积分
+            reason: 积分变动原因
+
+        Returns:
+            更新的用户数量，不存在的用户不计入
+        """
+        if not score_map:
+            return 0
+        count = ServiceUser.add_scores(score_map, reason=reason)
+        if count < len(score_map):
+            logger.warning(f"批量增加用户积分时有用户不存在: requested={len(score_map)}, updated={count}")
+        logger.debug(f"批量增加用户积分成功: count={count}")
+        return count
 
     @staticmethod
-    def reduce_score(user_id, score):
+    def reduce_score(user_id, score, reason=ScoreLedger.REASON_SYSTEM, ref_id=None):
         """
         减少用户积分
 
         Args:
             user_id: 用户 ID
             score: 减少的积分
+            reason: 积分变动原因，见 ScoreLedger.REASON_*
+            ref_id: 关联的业务 ID
 
         Returns:
-            更新后的用户对象，如果用户不存在则返回 None
+            更新后的积分，如果用户不存在或积分不足则返回 None
         """
         logger.debug(f"减少用户积分: user_id={user_id}, score={score}")
-        user = UserService.get_user_by_id(user_id)
-        if user:
-            if user.score >= score:
-                user.score -= score
-                user.save()
-                logger.debug(f"减少用户积分成功: user_id={user_id}, score={user.score}")
-                return user
-            else:
-                logger.warning(f"用户积分不足: user_id={user_id}, score={user.score}, required={score}")
-                return None
+        new_score = ServiceUser.change_score(user_id, -score, min_score=score, reason=reason, ref_id=ref_id)
+        if new_score is not None:
+            logger.debug(f"减少用户积分成功: user_id={user_id}, score={new_score}")
         else:
-            logger.warning(f"用户不存在: user_id={user_id}")
+            logger.warning(f"用户不存在或积分不足: user_id={user_id}, required={score}")
+        return new_score
+
+    @staticmethod
+    def transfer_score(from_user_id, to_user_id, score):
+        """
+        转移积分
+
+        Args:
+            from_user_id: 转出用户 ID
+            to_user_id: 转入用户 ID
+            score: 转移的积分
+
+        Returns:
+            (转出方积分, 转入方积分)，如果转出方积分不足或用户不存在则返回 None
+        """
+        logger.debug(f"转移用户积分: from_user_id={from_user_id}, to_user_id={to_user_id}, score={score}")
+        try:
+            result = ServiceUser.transfer_score(from_user_id, to_user_id, score)
+        except ValueError as e:
+            logger.warning(f"转移用户积分失败: {e}")
             return None
-    
+        if result is None:
+            logger.warning(f"用户不存在或积分不足: user_id={from_user_id}, required={score}")
+        return result
+
     @staticmethod
     def update_user_score(user_id, score):
         """
@@ -94,18 +133,15 @@ class ScoreService:
             score: 设置的积分
 
         Returns:
-            更新后的用户对象，如果用户不存在则返回 None
+            更新后的积分，如果用户不存在则返回 None
         """
         logger.debug(f"设置用户积分: user_id={user_id}, score={score}")
-        user = UserService.get_user_by_id(user_id)
-        if user:
-            user.score = score
-            user.save()
-            logger.debug(f"设置用户积分成功: user_id={user_id}, score={user.score}")
-            return user
+        new_score = ServiceUser.set_score(user_id, score)
+        if new_score is not None:
+            logger.debug(f"设置用户积分成功: user_id={user_id}, score={new_score}")
         else:
             logger.warning(f"用户不存在: user_id={user_id}")
-            return None
+        return new_score
 
     @staticmethod
     def sign_in(user_id, max_score=10):
@@ -120,45 +156,125 @@ class ScoreService:
             签到结果，如果签到成功则返回 sign_in_score，如果用户不存在或已签到则返回 False
         """
         logger.debug(f"用户签到: user_id={user_id}")
-        user = UserService.get_user_by_id(user_id)
-        if user:
-            # 检查今天是否已签到
-            shanghai_tz = pytz.timezone('Asia/Shanghai')
-            now_shanghai = datetime.now(shanghai_tz)
-            
-            last_sign_in_date = getattr(user, 'last_sign_in_date', None)
-            if last_sign_in_date and last_sign_in_date.astimezone(shanghai_tz).date() == now_shanghai.date():
-                logger.warning(f"用户今日已签到: user_id={user_id}")
-                return False
-
-            # 签到，增加随机积分
-            import random
-            sign_in_score = random.randint(1, max_score)  # 生成 1 到 max_score 之间的随机整数
-            user.score += sign_in_score
-            user.last_sign_in_date = now_shanghai
-            user.save()
-            logger.debug(f"用户签到成功: user_id={user_id}, 获得积分={sign_in_score}, 总积分={user.score}, 时间={now_shanghai}")
-            return sign_in_score
-        else:
-            logger.warning(f"用户不存在: user_id={user_id}")
+        sign_in_score = random.randint(1, max_score)  # 生成 1 到 max_score 之间的随机整数
+        day_start, _ = UserService.get_sign_in_bounds("today")
+        new_score = ServiceUser.sign_in(user_id, sign_in_score, datetime.now(pytz.utc), day_start)
+        if new_score is None:
+            logger.warning(f"用户今日已签到或用户不存在: user_id={user_id}")
             return False
-    
+        logger.debug(f"用户签到成功: user_id={user_id}, 获得积分={sign_in_score}, 总积分={new_score}")
+        return sign_in_score
+
+    @staticmethod
+    def get_score_history(user_id, limit=20, before_id=None):
+        """
+        获取用户积分流水
+
+        Args:
+            user_id: 用户 ID
+            limit: 返回的条数
+            before_id: 翻页用，只返回 id 小于该值的流水
+
+        Returns:
+            ScoreLedger 列表，按时间倒序
+        """
+        logger.debug(f"获取用户积分流水: user_id={user_id}, limit={limit}, before_id={before_id}")
+        return ScoreLedger.get_history(user_id, limit, before_id)
+
     @staticmethod
-    def create_random_score_event(create_user_id, telegram_chat_id, total_score, participants_count):
-      """创建随机积分活动"""
+    def get_window_leaderboard(start_time, end_time, limit=10, reason=None):
+        """
+        获取时间窗口内的积分排行榜（按净增积分）
+
+        Args:
+            start_time: 开始时间，datetime 对象
+            end_time: 结束时间（不包含），datetime 对象
+            limit: 返回的用户数量
+            reason: 只统计指定原因的流水
+
+        Returns:
+            [(user_id, 净增积分)] 列表
+        """
+        start_time = start_time.astimezone(pytz.utc).strftime("%Y-%m-%d %H:%M:%S")
+        end_time = end_time.astimezone(pytz.utc).strftime("%Y-%m-%d %H:%M:%S")
+        return ScoreLedger.get_window_leaderboard(start_time, end_time, limit, reason)
+
+    @staticmethod
+    def audit_scores(user_id=None):
+        """
+        积分对账，检查余额与流水是否一致
+
+        Returns:
+            [(user_id, 当前余额, 流水计算余额)] 不一致的用户列表
+        """
+        mismatches = ScoreLedger.audit(user_id)
+        if mismatches:
+            logger.warning(f"积分对账不一致: count={len(mismatches)}, mismatches={mismatches[:10]}")
+        else:
+            logger.info(f"积分对账完成，余额与流水一致: user_id={user_id}")
+        return mismatches
+
+    @staticmethod
+    def snapshot_scores():
+        """保存积分余额快照"""
+        return ScoreLedger.take_snapshot()
+
+    @staticmethod
+    def compact_score_ledger():
+        """压缩超过保留天数的积分流水"""
+        before_time = (datetime.now(pytz.utc) - timedelta(days=settings.SCORE_LEDGER_RETENTION_DAYS)).strftime("%Y-%m-%d %H:%M:%S")
+        return ScoreLedger.compact(before_time)
+
+    @staticmethod
+    def start_ledger_jobs():
+        """添加积分快照和流水压缩定时任务"""
+        scheduler = get_scheduler()
+        scheduler.add_job(job_name="score_snapshot", interval=settings.SCORE_SNAPSHOT_INTERVAL,
+                          job_func=ScoreService.snapshot_scores)
+        scheduler.add_job(job_name="score_ledger_compact", interval=settings.SCORE_SNAPSHOT_INTERVAL,
+                          job_func=ScoreService.compact_score_ledger)
+
+    @staticmethod
+    def create_random_score_event(create_user_id, telegram_chat_id, total_score, participants_count, payer_id=None):
+      """
+      创建随机积分活动
+      Args:
+          create_user_id: 发红包用户的 Telegram ID
+          payer_id: 发红包用户的本地用户 ID，不为 None 时在同一个写操作中扣除 total_score 积分，
+                    积分不足时不创建活动
+      Returns:
+          活动 ID，参数不合法或积分不足时返回 None
+      """
       logger.debug(f"创建随机积分活动，create_user_id={create_user_id}, telegram_chat_id={telegram_chat_id}, total_score={total_score}, participants_count={participants_count}")
 
       score_list = ScoreService._generate_random_scores(total_score=total_score, participants_count=participants_count)
-      data = {
-              "create_user_id": create_user_id,
-               "telegram_chat_id": telegram_chat_id,
-               "total_score": total_score,
-               "participants_count": participants_count,
-              "score_list": json.dumps(score_list),
-            }
-      row_id = insert_data("RandomScoreEvents", data)
-      logger.debug(f"创建随机积分活动成功，id={row_id}")
-      return row_id
+      if not score_list:
+          return None
+
+      def _create(conn):
+          event_id = conn.execute(
+              "INSERT INTO RandomScoreEvents (create_user_id, telegram_chat_id, total_score, participants_count, score_list) "
+              "VALUES (?, ?, ?, ?, ?)",
+              (create_user_id, telegram_chat_id, total_score, participants_count, json.dumps(score_list))
+          ).lastrowid
+          if payer_id is None:
+              return event_id, None
+          debit = ServiceUser.apply_score_change(conn, payer_id, -total_score, total_score,
+                                                 ScoreLedger.REASON_RED_PACKET_SEND, str(event_id))
+          if debit is None:
+              # 积分不足，撤销刚创建的活动
+              conn.execute("DELETE FROM RandomScoreEvents WHERE id = ?", (event_id,))
+              return None, None
+          return event_id, debit
+
+      event_id, debit = execute_write(_create)
+      if event_id is None:
+          logger.warning(f"积分不足，创建随机积分活动失败: payer_id={payer_id}, total_score={total_score}")
+          return None
+      if debit is not None:
+          ServiceUser.on_score_changed(payer_id, debit)
+      logger.debug(f"创建随机积分活动成功，id={event_id}")
+      return event_id
 
     @staticmethod
     def _generate_random_scores(total_score, participants_count):
@@ -169,20 +285,17 @@ class ScoreService:
             return []
         
         min_score = 1
-        max_score = 2 * (total_score / participants_count)
-
         scores = []
         remaining_score = total_score
-        for _ in range(participants_count - 1):
-           score = random.randint(min_score, int(max_score))
-           scores.append(score)
-           remaining_score -= score
-           if remaining_score <= 0:
-                break
-
-        # 如果还有剩余，则添加到最后一个
-        if remaining_score > 0:
-          scores.append(remaining_score)
+        for remaining_count in range(participants_count, 1, -1):
+            # 每次最多取剩余平均值的两倍，并给之后的每个人至少留 1 分
+            max_score = min(2 * remaining_score // remaining_count, remaining_score - (remaining_count - 1))
+            score = random.randint(min_score, max(min_score, max_score))
+            scores.append(score)
+            remaining_score -= score
+
+        # 剩余的积分是最后一个人的
+        scores.append(remaining_score)
         
         random.shuffle(scores)
         logger.debug(f"生成随机积分列表成功，scores={scores}")
@@ -203,50 +316,55 @@ class ScoreService:
 
     @staticmethod
     def use_random_score(event_id, user_id, user_name):
-        """使用随机积分"""
+        """
+        领取随机积分：检查是否已领取、是否还有剩余份数、记录领取结果和增加积分在同一个写操作中完成，
+        并发领取时每一份只会发给一个用户
+        Args:
+            user_id: 领取用户的 Telegram ID
+        Returns:
+            领取到的积分；已经分发完毕时返回 0；已经领取过、用户未注册或活动不存在时返回 None
+        """
         logger.debug(f"使用随机积分, event_id={event_id}, user_id={user_id}, user_name={user_name}")
-        event_data = ScoreService.get_random_score_event(event_id)
-        if event_data:
-           score_list = json.loads(event_data['score_list'])
-           if event_data['score_result']:
-               score_result = json.loads(event_data['score_result'])
-           else:
-               score_result = []
-
-           if any(item.get('user_id') == user_id for item in score_result):
-              logger.warning(f"用户已经获取过随机积分, user_id={user_id}")
-              return None
-           
-           if len(score_list) <= len(score_result):
-              logger.warning(f"积分已经分发完毕")
-              return None
-
-           user_score_data = score_list[len(score_result)]
-           user_score = user_score_data
-
-           score_result.append({"user_id": user_id, 'user_name': user_name, 'score':user_score })
-           
-           data = {
-            "score_result": json.dumps(score_result),
-           }
-           
-           if len(score_list) == len(score_result):
-            data['is_finished'] = True
-            data['end_time'] = datetime.now()
-            logger.debug(f"积分分发完成, 设置is_finished=True")
-
-           update_data("RandomScoreEvents", data, f"id = {event_id}")
-           
-           user = UserService.get_user_by_telegram_id(user_id)
-           if user:
-               # 扣除赠送者积分，增加接收者积分
-            ScoreService.add_score(user.id, user_score)
-            logger.debug(f"已为{user.username}增加积分: {user_score}分")
-           return user_score
-        else:
-          logger.warning(f"未获取到活动信息, event_id={event_id}")
-          return None
-    
+
+        def _claim(conn):
+            event = conn.execute("SELECT score_list, score_result FROM RandomScoreEvents WHERE id = ?",
+                                 (event_id,)).fetchone()
+            if not event:
+                logger.warning(f"未获取到活动信息, event_id={event_id}")
+                return None
+            score_list = json.loads(event['score_list'])
+            score_result = json.loads(event['score_result']) if event['score_result'] else []
+            if any(item.get('user_id') == user_id for item in score_result):
+                logger.warning(f"用户已经获取过随机积分, user_id={user_id}")
+                return None
+            if len(score_list) <= len(score_result):
+                logger.warning(f"积分已经分发完毕")
+                return 0, None, None
+            user = conn.execute("SELECT id FROM Users WHERE telegram_id = ? AND service_type = ?",
+                                (user_id, settings.SERVICE_TYPE)).fetchone()
+            if not user:
+                logger.warning(f"用户未注册，不能领取随机积分, user_id={user_id}")
+                return None
+
+            user_score = score_list[len(score_result)]
+            score_result.append({"user_id": user_id, 'user_name': user_name, 'score': user_score})
+            finished = len(score_list) == len(score_result)
+            conn.execute("UPDATE RandomScoreEvents SET score_result = ?, is_finished = ?, end_time = COALESCE(?, end_time) "
+                         "WHERE id = ?",
+                         (json.dumps(score_result), finished, datetime.now().isoformat(" ") if finished else None, event_id))
+            credit = ServiceUser.apply_score_change(conn, user['id'], user_score, None,
+                                                    ScoreLedger.REASON_RED_PACKET_CLAIM, str(event_id))
+            return user_score, user['id'], credit
+
+        result = execute_write(_claim)
+        if result is None:
+            return None
+        user_score, local_user_id, credit = result
+        if credit is not None:
+            ServiceUser.on_score_changed(local_user_id, credit)
+            logger.debug(f"已为用户增加积分: user_id={user_id}, score={user_score}")
+        return user_score
+
     @staticmethod
     def _generate_random_score(max_score=10):
         """生成随机积分"""
@@ -0,0 +1,137 @@
+# 统计服务
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from app.models import User
+from app.utils.api_clients import service_api_client
+from app.utils.cache import TTLCache, MISSING
+from app.utils.logger import logger
+from app.utils.scheduler import get_scheduler
+from app.utils.user_directory import get_user_directory
+from config import settings
+
+# 需要安装的模块：无
+
+# 统计结果缓存：超过 STATS_CACHE_TTL 秒后先返回旧结果并在后台刷新，超过 STATS_CACHE_MAX_AGE 秒后失效
+_stats_cache = TTLCache(maxsize=1, ttl=settings.STATS_CACHE_MAX_AGE)
+_refresh_lock = threading.Lock()
+_pending_lock = threading.Lock()
+_refreshing = False
+_executor = None
+_executor_lock = threading.Lock()
+
+# 上游服务计数器：统计项 -> 客户端方法名，方法返回 {'x-total-count': ...}
+UPSTREAM_COUNTERS = {
+    "song_count": "get_songs",
+    "album_count": "get_albums",
+    "artist_count": "get_artists",
+    "radio_count": "get_radios",
+}
+
+
+def _get_executor():
+    """获取并发请求上游服务的线程池"""
+    global _executor
+    if not _executor:
+        with _executor_lock:
+            if not _executor:
+                _executor = ThreadPoolExecutor(max_workers=len(UPSTREAM_COUNTERS) + 2, thread_name_prefix="stats")
+    return _executor
+
+
+class StatsService:
+    """
+    统计服务
+
+    本地用户数使用 COUNT(*) 查询，上游服务的用户、歌曲、专辑、艺术家和电台数量并发请求，
+    总耗时约等于最慢的一次请求。结果缓存在 TTL 缓存中，重复查询直接返回缓存。
+    """
+
+    @staticmethod
+    def _count_web_users():
+        """上游服务用户数量，优先使用本地镜像"""
+        user_directory = get_user_directory()
+        if user_directory and user_directory.ready:
+            return user_directory.count()
+        result = service_api_client.get_users()
+        return int(result['headers']['x-total-count'])
+
+    @staticmethod
+    def _count_upstream(method_name):
+        """调用上游服务的计数接口"""
+        result = getattr(service_api_client, method_name)()
+        return int(result['x-total-count']) if result and 'x-total-count' in result else 0
+
+    @staticmethod
+    def collect():
+        """
+        并发收集统计信息，不使用缓存
+        Returns:
+            统计信息字典，获取失败的项为 None
+        """
+        start = time.monotonic()
+        executor = _get_executor()
+        futures = {
+            "local_user_count": executor.submit(User.count),
+            "web_user_count": executor.submit(StatsService._count_web_users),
+        }
+        for key, method_name in UPSTREAM_COUNTERS.items():
+            if hasattr(service_api_client, method_name):
+                futures[key] = executor.submit(StatsService._count_upstream, method_name)
+        stats = {}
+        for key, future in futures.items():
+            try:
+                stats[key] = future.result()
+            except Exception as e:
+                logger.error(f"获取统计项失败: key={key}, error={e}")
+                stats[key] = None
+        stats["update_time"] = time.time()
+        logger.debug(f"收集统计信息完成: elapsed={time.monotonic() - start:.3f}s, stats={stats}")
+        return stats
+
+    @staticmethod
+    def refresh(min_update_time=0.0):
+        """
+        收集统计信息并写入缓存，同一时间只有一个刷新在进行；有统计项失败时不写入缓存，下次查询重新收集
+        Args:
+            min_update_time: 等待锁期间其他线程已经收集了不早于这个时间的结果时直接返回该结果
+        Returns:
+            统计信息字典
+        """
+        with _refresh_lock:
+            stats = _stats_cache.get("stats")
+            if stats is not MISSING and stats["update_time"] >= min_update_time:
+                return stats
+            stats = StatsService.collect()
+            if None not in stats.values():
+                _stats_cache.set("stats", stats)
+            return stats
+
+    @staticmethod
+    def _refresh_in_background():
+        global _refreshing
+        try:
+            StatsService.refresh(time.time())
+        finally:
+            with _pending_lock:
+                _refreshing = False
+
+    @staticmethod
+    def get_stats():
+        """
+        获取统计信息：缓存未过期时直接返回；缓存较旧时返回旧结果并在后台刷新；没有缓存时同步收集
+        Returns:
+            统计信息字典，update_time 为收集时间
+        """
+        global _refreshing
+        now = time.time()
+        stats = _stats_cache.get("stats")
+        if stats is MISSING:
+            return StatsService.refresh(now)
+        if now - stats["update_time"] > settings.STATS_CACHE_TTL:
+            with _pending_lock:
+                if _refreshing:
+                    return stats
+                _refreshing = True
+            get_scheduler().add_delayed_job(0, StatsService._refresh_in_background)
+        return stats
@@ -1,10 +1,12 @@
 from app.models import User, ServiceUser
+from app.models.user import get_user_cache_generation
 from app.utils.api_clients import service_api_client
+from app.utils.db_utils import format_utc_datetime
+from app.utils.leaderboard import get_leaderboard
 from app.utils.logger import logger
 from config import settings
 from datetime import datetime, timedelta
 import pytz
-import operator
 
 
 # 需要安装的模块：无
@@ -141,6 +143,30 @@ class UserService:
             logger.warning(f"用户不存在: telegram_id={telegram_id}")
             return None
 
+    @staticmethod
+    def resolve_user(message):
+        """
+        获取消息发送者对应的用户，同一条消息只查询一次
+
+        结果保存在消息对象上，校验装饰器和处理函数共用；期间有用户数据变动时重新查询。
+
+        Args:
+            message: Telegram 消息对象
+
+        Returns:
+            User 对象，如果用户不存在则返回 None
+        """
+        generation = get_user_cache_generation()
+        resolved = getattr(message, "_resolved_user", None)
+        if resolved is not None and resolved[0] == generation:
+            return resolved[1]
+        user = UserService.get_user_by_telegram_id(message.from_user.id)
+        try:
+            message._resolved_user = (generation, user)
+        except AttributeError:
+            pass  # 不支持设置属性的消息对象不做缓存
+        return user
+
     @staticmethod
     def get_user_by_id(user_id):
         """
@@ -231,9 +257,12 @@ class UserService:
 
     @staticmethod
     def update_user_score(user, score):
-        """更新用户积分"""
-        user.score = score
-        user.save()
+        """更新用户积分，通过 ServiceUser.set_score 原子修改并记录积分流水"""
+        new_score = ServiceUser.set_score(user.id, score)
+        if new_score is None:
+            logger.warning(f"用户不存在，积分更新失败: user_id={user.id}")
+            return None
+        user.score = new_score
         logger.debug(f"用户积分更新成功: user_id={user.id}, score={user.score}")
         return user
 
@@ -336,6 +365,25 @@ class UserService:
         logger.debug("准备关闭/开启清理系统")
         service_api_client.start_clean_expired_users()
 
+    @staticmethod
+    def iter_users_by_register_time(start_time=None, end_time=None):
+        """
+      按注册时间范围分批获取用户（生成器），时间区间为闭区间，按日期比较
+      Args:
+        start_time:  开始时间，日期字符串，例如 '2024-12-25'
+        end_time: 结束时间，日期字符串，例如 '2024-12-30'
+      Returns:
+        符合条件的用户生成器，时间格式错误时抛出 ValueError
+      """
+        logger.debug(f"获取指定注册时间范围内注册的用户, start_time={start_time}, end_time={end_time}")
+        start_bound = end_bound = None
+        if start_time is not None:
+            start_bound = datetime.strptime(start_time, "%Y-%m-%d").strftime("%Y-%m-%d %H:%M:%S")
+        if end_time is not None:
+            end_date = datetime.strptime(end_time, "%Y-%m-%d") + timedelta(days=1)
+            end_bound = end_date.strftime("%Y-%m-%d %H:%M:%S")
+        return ServiceUser.iter_by_create_time(start_bound, end_bound)
+
     @staticmethod
     def get_users_by_register_time(start_time=None, end_time=None):
         """
@@ -346,76 +394,68 @@ class UserService:
       Returns:
         符合条件的用户列表
       """
-        logger.debug(f"获取指定注册时间范围内注册的用户, start_time={start_time}, end_time={end_time}")
-        if start_time is None and end_time is None:
-            logger.debug(f"未指定时间区间，获取所有用户的列表")
-            return UserService.get_all_users()
-
         try:
-            start_date = datetime.strptime(start_time, "%Y-%m-%d").date()
-            end_date = datetime.strptime(end_time, "%Y-%m-%d").date()
+            user_list = list(UserService.iter_users_by_register_time(start_time, end_time))
         except ValueError:
             logger.warning(f"时间格式错误, 请使用 'YYYY-MM-DD'格式, start_time={start_time}, end_time={end_time}")
             return []
-        users = UserService.get_all_users()
-        if not users:
-            logger.warning("没有用户，无法获取签到用户列表！")
-            return []
-
-        user_list = [user for user in users if hasattr(user, 'id') and user.id and User.get_by_id(
-            user.id).create_time and start_date <= User.get_by_id(user.id).create_time.date() <= end_date]
         logger.debug(
             f"获取指定注册时间范围内注册的用户成功, start_time={start_time}, end_time={end_time}, count={len(user_list)}")
         return user_list
 
     @staticmethod
-    def get_sign_in_users(time_range="today"):
+    def get_sign_in_bounds(time_range="today"):
         """
-        获取指定时间范围内签到的用户
-    
+        计算签到时间范围对应的 UTC 时间边界，日期按 Asia/Shanghai 划分
+
         Args:
-            time_range: 时间范围，例如 "today", "yesterday", "2024-12-25"
-    
+            time_range: 时间范围，例如 "today", "yesterday", "2024-12-25", "2024-12-01~2024-12-31"（闭区间）
+
         Returns:
-            符合条件的用户列表
+            (开始时间, 结束时间) 的 UTC 时间字符串，左闭右开，格式不正确时抛出 ValueError
         """
-        logger.debug(f"获取签到用户列表，时间范围: {time_range}")
         shanghai_tz = pytz.timezone('Asia/Shanghai')
-        now_shanghai = datetime.now(shanghai_tz)
-        users = UserService.get_all_users()
-        if not users:
-            logger.warning("没有用户，无法获取签到用户列表！")
-            return []
-
-        user_list = []
+        today = datetime.now(shanghai_tz).date()
         if time_range == "today":
-            user_list = [user for user in users if hasattr(user,
-                                                           'last_sign_in_date') and user.last_sign_in_date and user.last_sign_in_date.astimezone(
-                shanghai_tz).date() == now_shanghai.date()]
+            start_date = end_date = today
         elif time_range == "yesterday":
-            yesterday_shanghai = now_shanghai - timedelta(days=1)
-            user_list = [user for user in users if hasattr(user,
-                                                           'last_sign_in_date') and user.last_sign_in_date and user.last_sign_in_date.astimezone(
-                shanghai_tz).date() == yesterday_shanghai.date()]
-        elif isinstance(time_range, str) and len(time_range) == 10 and time_range[4] == "-" and time_range[7] == "-":
-            try:
-                target_date = datetime.strptime(time_range, "%Y-%m-%d").date()
-                user_list = [user for user in users if hasattr(user,
-                                                               'last_sign_in_date') and user.last_sign_in_date and user.last_sign_in_date.astimezone(
-                    shanghai_tz).date() == target_date]
-            except ValueError:
-                logger.warning(f"时间格式错误，请使用YYYY-MM-DD格式，使用today查询，time_range={time_range}")
-                user_list = [user for user in users if hasattr(user,
-                                                               'last_sign_in_date') and user.last_sign_in_date and user.last_sign_in_date.astimezone(
-                    shanghai_tz).date() == now_shanghai.date()]
+            start_date = end_date = today - timedelta(days=1)
+        elif isinstance(time_range, str) and "~" in time_range:
+            start_text, end_text = time_range.split("~", 1)
+            start_date = datetime.strptime(start_text.strip(), "%Y-%m-%d").date()
+            end_date = datetime.strptime(end_text.strip(), "%Y-%m-%d").date()
+        elif isinstance(time_range, str):
+            start_date = end_date = datetime.strptime(time_range, "%Y-%m-%d").date()
         else:
+            raise ValueError(f"不支持的时间范围: {time_range}")
+        if start_date > end_date:
+            raise ValueError(f"开始日期不能晚于结束日期: {time_range}")
+
+        start_time = shanghai_tz.localize(datetime.combine(start_date, datetime.min.time()))
+        end_time = shanghai_tz.localize(datetime.combine(end_date + timedelta(days=1), datetime.min.time()))
+        return format_utc_datetime(start_time), format_utc_datetime(end_time)
+
+    @staticmethod
+    def get_sign_in_user_ids(time_range="today"):
+        """
+        获取指定时间范围内签到的用户 ID
+
+        Args:
+            time_range: 时间范围，例如 "today", "yesterday", "2024-12-25", "2024-12-01~2024-12-31"
+
+        Returns:
+            符合条件的用户 ID 列表
+        """
+        logger.debug(f"获取签到用户列表，时间范围: {time_range}")
+        try:
+            start_time, end_time = UserService.get_sign_in_bounds(time_range)
+        except ValueError:
             logger.warning(f"不支持的时间范围: {time_range}, 使用today查询")
-            user_list = [user for user in users if hasattr(user,
-                                                           'last_sign_in_date') and user.last_sign_in_date and user.last_sign_in_date.astimezone(
-                shanghai_tz).date() == now_shanghai.date()]
+            start_time, end_time = UserService.get_sign_in_bounds("today")
 
-        logger.debug(f"成功获取签到用户列表: {time_range}, count={len(user_list)}")
-        return user_list
+        user_ids = ServiceUser.get_ids_by_sign_in_range(start_time, end_time)
+        logger.debug(f"成功获取签到用户列表: {time_range}, count={len(user_ids)}")
+        return user_ids
 
     @staticmethod
     def get_info_in_service_by_user_id(user_id):
@@ -448,29 +488,36 @@ class UserService:
             return None
 
     @staticmethod
-    def get_score_chart(limit=10):
-        """获取积分排行榜"""
-        logger.debug(f"获取积分排行榜，limit={limit}")
-        users = UserService.get_all_users()
-        if not users:
+    def get_score_chart(limit=10, offset=0):
+        """
+        获取积分排行榜
+
+        Args:
+            limit: 返回的用户数量
+            offset: 跳过的用户数量，用于翻页
+
+        Returns:
+            [{"rank", "user_id", "telegram_id", "username", "score"}] 列表
+        """
+        logger.debug(f"获取积分排行榜，limit={limit}, offset={offset}")
+        chart = get_leaderboard().get_page(offset, limit)
+        if not chart:
             logger.warning("没有用户，无法获取排行榜")
             return []
+        logger.debug(f"获取积分排行榜成功, limit={limit}, offset={offset}")
+        return chart
 
-        # 按积分降序排序
-        sorted_users = sorted(users, key=operator.attrgetter('score'), reverse=True)
-
-        # 获取指定数量的用户
-        top_users = sorted_users[:limit]
+    @staticmethod
+    def get_score_rank(user_id):
+        """
+        获取用户的积分排名
 
-        # 创建排行榜数据列表
-        rank = 1
-        chart = []
-        for user in top_users:
-            chart.append(
-                {"rank": rank, "telegram_id": user.telegram_id, "username": user.username, "score": user.score})
-            rank += 1
-        logger.debug(f"获取积分排行榜成功, limit={limit}")
-        return chart
+        Returns:
+            排名（从 1 开始），用户不存在时返回 None
+        """
+        rank = get_leaderboard().get_rank(user_id)
+        logger.debug(f"获取用户积分排名: user_id={user_id}, rank={rank}")
+        return rank
 
     @staticmethod
     def get_user_status(user_id):
@@ -16,19 +16,23 @@ class AudiobookshelfAPIClient(BaseAPIClient):
     Audiobookshelf API 客户端
     """
 
+    transport_name = "audiobookshelf"
+    auth_header = "Authorization"
+    auth_prefix = "Bearer "
+
     def __init__(self):
         super().__init__(settings.AUDIOBOOKSHELF_API_URL, username=settings.AUDIOBOOKSHELF_API_USERNAME, password=settings.AUDIOBOOKSHELF_API_PASSWORD, token=settings.AUDIOBOOKSHELF_API_KEY, auth_type='token')
         self._token_lock = threading.Lock()
-        self.session = requests.Session()
         
         if self.auth_type == 'token':
-            self.token = settings.AUDIOBOOKSHELF_API_KEY
-            self.session.headers.update({"Authorization": f"Bearer {self.token}"})
+            self.tokens.offer(settings.AUDIOBOOKSHELF_API_KEY, persist=False)
             result = self.get_libraries()
             if result and result['status'] == 'success':
                 logger.info(f"Audiobookshelf 使用 Key 认证，登录成功")
         else:
-            self.token = self._login()  # 初始化时登录并获取 token
+            # 优先使用上次保存的未过期 token，避免每次重启都重新登录
+            if not self.tokens.load():
+                self.tokens.refresh()
         if self._get_copy_config():
             self.config = self._get_copy_config()
         else:
@@ -45,19 +49,19 @@ class AudiobookshelfAPIClient(BaseAPIClient):
             response.raise_for_status()
             token = response.json().get("token")
             logger.info(f"Audiobookshelf 登录成功")
-            self.session.headers.update({"Authorization": f"Bearer {token}"})
             return token
         except requests.exceptions.RequestException as e:
             logger.error(f"Audiobookshelf 登录失败: {e}")
             return None
     
-    def _make_request(self, method, endpoint, params=None, data=None, headers=None):
+    def _make_request(self, method, endpoint, params=None, data=None, headers=None, retry_login=True):
         """发送 API 请求"""
         url = f"{self.api_url}{endpoint}"
         self.session.headers.update({"Content-Type": "application/json"})
         self.session.headers.update({"User-Agent": "Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.1 (KHTML, like Gecko) Chrome/22.0.1207.1 Safari/537.1"})
         
-        _headers = {"Authorization": f"Bearer {self.token}"} if self.token else {}
+        token, epoch = self.tokens.get()
+        _headers = {"Authorization": f"Bearer {token}"} if token else {}
         if headers:
             _headers.update(headers)  # 如果传入了 headers，则合并
         response = None
@@ -69,19 +73,13 @@ class AudiobookshelfAPIClient(BaseAPIClient):
                 return {"status": "success", "data": response.json(), "headers": response.headers}
             # elif response.status_code == 204:
             #     return {"status": "success", "data": "", "headers": response.headers}
-            elif response.status_code == 401:
-                max_retries = 3
-                retries = 0
-
-                while retries < max_retries:
-                    logger.warning(f"Audiobookshelf token 过期，尝试第{retries}次重新登录...")
-                    self.token = self._login()
-                    if self.token:
-                        logger.info("Audiobookshelf 重新登录成功，使用新 token 重新发送请求")
-                        return self._make_request(method, endpoint, params, data, headers)
-                    else:
-                        logger.warning(f"尝试第{retries}次重新登录失败...")
-                        retries += 1
+            elif response.status_code == 401 and retry_login:
+                # 并发请求同时遇到 token 失效时只登录一次，其余请求等待同一次登录的结果
+                logger.warning("Audiobookshelf token 过期，重新登录...")
+                if self.tokens.refresh(epoch):
+                    logger.info("Audiobookshelf 重新登录成功，使用新 token 重新发送请求")
+                    return self._make_request(method, endpoint, params, data, headers, retry_login=False)
+                raise requests.exceptions.RequestException("Audiobookshelf 重新登录失败")
             else:
                 raise requests.exceptions.RequestException
         except requests.exceptions.RequestException as e:
@@ -155,7 +153,8 @@ class AudiobookshelfAPIClient(BaseAPIClient):
         url = f"{self.api_url}{endpoint}"
         data = {"username": username, "password": password}
         try:
-            response = requests.post(url, json=data)
+            # 不带管理员的认证头，只验证该用户的账号密码
+            response = self.session.post(url, json=data, headers={"Authorization": None})
             response.raise_for_status()
             user_id = response.json().get("id")
             logger.info(f"用户认证成功")
@@ -1,4 +1,6 @@
 from abc import ABC, abstractmethod
+from .transport import HTTPTransport
+from .token_manager import TokenManager
 
 # 需要安装的模块：无 (abc 是 Python 内置模块)
 
@@ -7,6 +9,16 @@ class BaseAPIClient(ABC):
     API 客户端基类，定义通用接口
     """
 
+    # HTTP 传输层的名称，用于日志和延迟统计
+    transport_name = "api"
+
+    # 管理员 token 所在的请求头和前缀
+    auth_header = "Authorization"
+    auth_prefix = "Bearer "
+
+    # 上游用户镜像（见 UserDirectory），客户端实现 _list_upstream_users 和 _normalize_user 后由 create_user_directory 设置
+    directory = None
+
     def __init__(self, api_url, username=None, password=None, token=None, auth_type='basic'):
         """
         初始化 API 客户端
@@ -22,6 +34,32 @@ class BaseAPIClient(ABC):
         self.password = password
         self.token = token
         self.auth_type = auth_type
+        # 所有请求经过共用的传输层（超时、连接池、重试和延迟统计）
+        self.session = HTTPTransport(self.transport_name)
+        # 管理员 token 的单飞刷新和持久化，见 TokenManager
+        self.tokens = TokenManager(f"{self.transport_name}:{username}", self._login, on_update=self._apply_token)
+
+    def _login(self):
+        """登录上游服务并返回 token，失败时返回 None (需要 token 认证的子类实现)"""
+        return None
+
+    def _apply_token(self, token):
+        """token 变化后更新 session 的认证请求头"""
+        self.token = token
+        self.session.headers.update({self.auth_header: f"{self.auth_prefix}{token}"})
+
+    def _on_users_changed(self, result, deleted_user_id=None):
+        """
+        上游用户修改请求成功后更新镜像：删除用户时移除该用户，其他修改在后台重新同步，请求失败时镜像保持不变
+        Returns:
+            原样返回 result
+        """
+        if self.directory is not None and result and result.get('status') == 'success':
+            if deleted_user_id is not None:
+                self.directory.discard(deleted_user_id)
+            else:
+                self.directory.request_sync()
+        return result
 
     @abstractmethod
     def _make_request(self, method, endpoint, params=None, data=None, headers=None):
@@ -0,0 +1,154 @@
+import threading
+import time
+import requests
+from app.utils.logger import logger
+from config import settings
+
+# 需要安装的模块：无
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+# 熔断器状态变化的监听函数：func(name, old_state, new_state, stats)
+_state_listeners = []
+
+
+def add_state_listener(func):
+    """注册熔断器状态变化的监听函数，例如通知管理员"""
+    _state_listeners.append(func)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    熔断器打开时直接拒绝请求，继承 ConnectionError，客户端已有的异常处理会把它当作请求失败
+    """
+
+
+class CircuitBreaker:
+    """
+    上游服务熔断器
+
+    closed：正常放行，连续失败 failure_threshold 次后打开；
+    open：直接拒绝请求，recovery_timeout 秒后进入 half_open；
+    half_open：只放行一个试探请求，成功则关闭，失败则重新打开。
+    连接错误、超时和 5xx 响应算作失败，4xx 响应说明服务可用，算作成功。
+    """
+
+    def __init__(self, name, failure_threshold=None, recovery_timeout=None):
+        """
+        初始化熔断器
+        Args:
+            name: 上游服务名称
+            failure_threshold: 连续失败多少次后打开
+            recovery_timeout: 打开多少秒后尝试恢复
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold or settings.CIRCUIT_FAILURE_THRESHOLD
+        self.recovery_timeout = recovery_timeout or settings.CIRCUIT_RECOVERY_TIMEOUT
+        self.state = STATE_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False  # half_open 状态下是否已有试探请求
+        self._lock = threading.Lock()
+        self._stats = {"opened": 0, "rejected": 0, "successes": 0, "failures": 0, "snapshots_served": 0,
+                       "last_change": 0.0}
+
+    def _set_state(self, state):
+        """切换状态，调用方需持有锁，返回需要通知的 (旧状态, 新状态)"""
+        old_state = self.state
+        self.state = state
+        self._stats["last_change"] = time.time()
+        if state == STATE_OPEN:
+            self._opened_at = time.monotonic()
+            self._stats["opened"] += 1
+        return old_state, state
+
+    def _notify(self, change):
+        if not change:
+            return
+        old_state, new_state = change
+        logger.warning(f"上游服务熔断器状态变化: name={self.name}, {old_state} -> {new_state}")
+        stats = self.get_stats()
+        for func in list(_state_listeners):
+            try:
+                func(self.name, old_state, new_state, stats)
+            except Exception as e:
+                logger.error(f"熔断器状态监听函数执行失败: {e}")
+
+    def retry_after(self):
+        """熔断器打开时距离尝试恢复的秒数，其他状态返回 0"""
+        with self._lock:
+            if self.state != STATE_OPEN:
+                return 0.0
+            return max(self._opened_at + self.recovery_timeout - time.monotonic(), 0.0)
+
+    def is_open(self):
+        """是否处于打开状态且还没到尝试恢复的时间"""
+        return self.retry_after() > 0
+
+    def allow(self):
+        """
+        是否放行请求，放行后必须调用 record_success、record_failure 或 release
+        """
+        change = None
+        with self._lock:
+            if self.state == STATE_OPEN:
+                if time.monotonic() - self._opened_at < self.recovery_timeout:
+                    self._stats["rejected"] += 1
+                    return False
+                change = self._set_state(STATE_HALF_OPEN)
+            if self.state == STATE_HALF_OPEN:
+                if self._probing:
+                    self._stats["rejected"] += 1
+                    allowed = False
+                else:
+                    self._probing = True
+                    allowed = True
+            else:
+                allowed = True
+        self._notify(change)
+        return allowed
+
+    def record_success(self):
+        """记录一次成功"""
+        change = None
+        with self._lock:
+            self._stats["successes"] += 1
+            self._failures = 0
+            if self.state != STATE_CLOSED:
+                self._probing = False
+                change = self._set_state(STATE_CLOSED)
+        self._notify(change)
+
+    def record_failure(self):
+        """记录一次失败"""
+        change = None
+        with self._lock:
+            self._stats["failures"] += 1
+            self._failures += 1
+            if self.state == STATE_HALF_OPEN:
+                self._probing = False
+                change = self._set_state(STATE_OPEN)
+            elif self.state == STATE_CLOSED and self._failures >= self.failure_threshold:
+                change = self._set_state(STATE_OPEN)
+        self._notify(change)
+
+    def release(self):
+        """放行的请求没有得到能说明上游服务状态的结果时调用（例如地址配置错误、请求被取消），只释放试探名额，不改变状态"""
+        with self._lock:
+            self._probing = False
+
+    def record_snapshot_served(self):
+        with self._lock:
+            self._stats["snapshots_served"] += 1
+
+    def get_stats(self):
+        """获取熔断器统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["state"] = self.state
+            stats["consecutive_failures"] = self._failures
+            stats["retry_after"] = max(self._opened_at + self.recovery_timeout - time.monotonic(), 0.0) \
+                if self.state == STATE_OPEN else 0.0
+        return stats
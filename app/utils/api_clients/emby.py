@@ -4,6 +4,7 @@ import requests
 from datetime import datetime, timedelta
 
 from app.utils.scheduler import get_scheduler
+from app.utils.user_directory import UpstreamUser, parse_upstream_time
 from .base import BaseAPIClient
 from config import settings
 from app.utils.logger import logger
@@ -14,20 +15,24 @@ class EmbyAPIClient(BaseAPIClient):
     Emby API 客户端
     """
 
+    transport_name = "emby"
+    auth_header = "X-Emby-Token"
+    auth_prefix = ""
+
     def __init__(self):
         super().__init__(settings.EMBY_API_URL, username=settings.EMBY_API_USERNAME, password=settings.EMBY_API_PASSWORD, token=settings.EMBY_API_KEY, auth_type='token')
         self._token_lock = threading.Lock()
-        self.session = requests.Session()
         # self.session.headers.update({"X-Emby-Client": "Emby Web", "X-Emby-Device-Name": "Firefox Windows", "X-Emby-Device-Id": "1606ef80-1738-4279-b6c5-b4e920969dab", "X-Emby-Client-Version": "4.8.10.0"})
         if self.auth_type == 'token':
-            self.token = settings.EMBY_API_KEY
-            self.session.headers.update({"X-Emby-Token": f"{self.token}"})
+            self.tokens.offer(settings.EMBY_API_KEY, persist=False)
             params = {"Limit": 1}
             result = self.get_users(params=params)
             if result and result['status'] == 'success':
                 logger.info(f"Emby 使用 Key 认证，登录成功")
         else:
-            self.token = self._login()  # 初始化时登录并获取 token
+            # 优先使用上次保存的未过期 token，避免每次重启都重新登录
+            if not self.tokens.load():
+                self.tokens.refresh()
         # scheduler.add_job(job_name="Emby_keep_live", interval=settings.CLEAN_INTERVAL, job_func=self._keep_alive)
         logger.info("EmbyAPIClient 初始化完成") # 初始化时登录并获取 token
 
@@ -43,20 +48,20 @@ class EmbyAPIClient(BaseAPIClient):
             response.raise_for_status()
             token = response.json().get("AccessToken")
             logger.info(f"Emby 登录成功")
-            self.session.headers.update({"X-Emby-Token": f"{token}"})
             return token
         except requests.exceptions.RequestException as e:
             print(f"Emby 登录失败: {e}")
             return None
     
-    def _make_request(self, method, endpoint, params=None, data=None, headers=None):
+    def _make_request(self, method, endpoint, params=None, data=None, headers=None, retry_login=True):
         """发送 API 请求"""
         url = f"{self.api_url}{endpoint}"
         self.session.headers.update({"Content-Type": "application/json"})
         self.session.headers.update({"User-Agent": "Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.1 (KHTML, like Gecko) Chrome/22.0.1207.1 Safari/537.1"})
  
         # 如果 token 存在，则添加到请求头
-        _headers = {"X-Emby-Token": f"{self.token}"} if self.token else {}
+        token, epoch = self.tokens.get()
+        _headers = {"X-Emby-Token": f"{token}"} if token else {}
         if headers:
           _headers.update(headers) # 如果传入了 headers，则合并
 
@@ -68,19 +73,13 @@ class EmbyAPIClient(BaseAPIClient):
                 return {"status": "success", "data": response.json(), "headers": response.headers}
             elif response.status_code == 204:
                 return {"status": "success", "data": "", "headers": response.headers}
-            elif response.status_code == 401:
-                max_retries = 3
-                retries = 0
-
-                while retries < max_retries:
-                    logger.warning(f"Emby token 过期，尝试第{retries}次重新登录...")
-                    self.token = self._login()
-                    if self.token:
-                        logger.info("Emby 重新登录成功，使用新 token 重新发送请求")
-                        return self._make_request(method, endpoint, params, data, headers)
-                    else:
-                        logger.warning(f"尝试第{retries}次重新登录失败...")
-                        retries += 1
+            elif response.status_code == 401 and retry_login:
+                # 并发请求同时遇到 token 失效时只登录一次，其余请求等待同一次登录的结果
+                logger.warning("Emby token 过期，重新登录...")
+                if self.tokens.refresh(epoch):
+                    logger.info("Emby 重新登录成功，使用新 token 重新发送请求")
+                    return self._make_request(method, endpoint, params, data, headers, retry_login=False)
+                raise requests.exceptions.RequestException("Emby 重新登录失败")
             else:
                 raise requests.exceptions.RequestException
         except requests.exceptions.RequestException as e:
@@ -99,12 +98,29 @@ class EmbyAPIClient(BaseAPIClient):
 
     def get_user_by_username(self, username):
         """根据用户名获取 Emby 用户信息"""
+        if self.directory is not None and self.directory.ready:
+            user = self.directory.get_by_username(username)
+            return user.data if user else None
         users = self.get_users()
         if users and users['status'] == 'success':
-            for index, user in enumerate(users['data']['Items']):
+            for user in users['data']['Items']:
                 if user['Name'] == username:
-                    return users['data'][index]
+                    return user
+        return None
+
+    def _list_upstream_users(self):
+        """获取所有用户的原始数据，供 UserDirectory 同步，失败时返回 None"""
+        users = self.get_users()
+        if users and users['status'] == 'success':
+            return users['data']['Items']
         return None
+
+    def _normalize_user(self, raw):
+        """把 Emby 用户数据转换为 UpstreamUser"""
+        last_seen = [t for t in (parse_upstream_time(raw.get('LastLoginDate')),
+                                 parse_upstream_time(raw.get('LastActivityDate'))) if t is not None]
+        return UpstreamUser(raw['Id'], raw['Name'], bool((raw.get('Policy') or {}).get('IsAdministrator')),
+                            max(last_seen) if last_seen else None)
         
     def create_user(self, username, password):
         """创建 Emby 用户"""
@@ -124,12 +140,12 @@ class EmbyAPIClient(BaseAPIClient):
         except requests.exceptions.RequestException as e:
             logger.error(f"Emby API 请求失败: {e}")
             return {"status": "error", "message": str(e)}
-        return resp
+        return self._on_users_changed(resp)
 
     def update_user(self, action, user_id, user_data):
         """更新 Emby 用户信息"""
         endpoint = f"/Users/{user_id}/{action}"
-        return self._make_request("POST", endpoint, data=user_data)
+        return self._on_users_changed(self._make_request("POST", endpoint, data=user_data))
 
 
     def auth_user(self, username, password):
@@ -139,7 +155,8 @@ class EmbyAPIClient(BaseAPIClient):
         data = {"Username": username, "Pw": password}
         params = {"X-Emby-Client": "Emby Web", "X-Emby-Device-Name": "Firefox Windows", "X-Emby-Device-Id": "1606ef80-1738-4279-b6c5-b4e920969dab", "X-Emby-Client-Version": "4.8.10.0"}
         try:
-            response = requests.post(url, json=data, params=params)
+            # 不带管理员的认证头，只验证该用户的账号密码
+            response = self.session.post(url, json=data, params=params, headers={"X-Emby-Token": None})
             response.raise_for_status()
             user_id = response.json().get("Id")
             logger.info(f"用户认证成功")
@@ -162,12 +179,12 @@ class EmbyAPIClient(BaseAPIClient):
             result = self._make_request("POST", endpoint, data=data)
         elif password:
             result = self.update_password(user_id, password)
-        return result
+        return self._on_users_changed(result)
 
     def delete_user(self, user_id):
         """删除 Emby 用户"""
         endpoint = f"/Users/{user_id}/Delete"
-        return self._make_request("POST", endpoint)
+        return self._on_users_changed(self._make_request("POST", endpoint), deleted_user_id=user_id)
     
     def update_password(self, user_id, password):
         """更新 Emby 用户密码"""
@@ -6,6 +6,7 @@ import requests
 from datetime import datetime, timedelta
 
 from app.utils.scheduler import get_scheduler
+from app.utils.user_directory import UpstreamUser, parse_upstream_time
 from .base import BaseAPIClient
 from config import settings
 from app.utils.logger import logger
@@ -21,12 +22,16 @@ class NavidromeAPIClient(BaseAPIClient):
     Navidrome API 客户端
     """
 
+    transport_name = "navidrome"
+    auth_header = "x-nd-authorization"
+
     def __init__(self):
         super().__init__(settings.NAVIDROME_API_URL, username=settings.NAVIDROME_API_USERNAME,
                          password=settings.NAVIDROME_API_PASSWORD, auth_type='token')
         self._token_lock = threading.Lock()
-        self.session = requests.Session()
-        self.token = self._login()  # 初始化时登录并获取 token
+        # 优先使用上次保存的未过期 token，避免每次重启都重新登录
+        if not self.tokens.load():
+            self.tokens.refresh()
         # self._start_keep_alive()
         scheduler.add_job(job_name="navidrome_keep_live", interval=3600, job_func=self._keep_alive)
         logger.info("NavidromeAPIClient 初始化完成")  # 初始化时登录并获取 token
@@ -42,7 +47,6 @@ class NavidromeAPIClient(BaseAPIClient):
             response.raise_for_status()
             token = response.json().get("token")
             logger.info(f"Navidrome 登录成功")
-            self.session.headers.update({"x-nd-authorization": f"Bearer {token}"})
             return token
         except requests.exceptions.RequestException as e:
             print(f"Navidrome 登录失败: {e}")
@@ -86,6 +90,8 @@ class NavidromeAPIClient(BaseAPIClient):
 
     def _get_expired_users(self):
         """获取过期用户和即将过期的用户(不包括管理员)"""
+        if self.directory is not None and self.directory.ready:
+            return self.directory.get_expired_users(settings.EXPIRED_DAYS, settings.WARNING_DAYS)
         expired_users = []
         warning_users = []
         users = self.get_users()
@@ -141,20 +147,13 @@ class NavidromeAPIClient(BaseAPIClient):
         return {'expired': expired_users, 'warning': warning_users}
 
     def _keep_alive(self):
-        """发送 Navidrome 保活请求"""
-        with self._token_lock:
-            if self.token:
-                endpoint = "/api/keepalive/keepalive"  # 使用用户列表接口来保活
-                result = self._make_request("GET", endpoint)
-                if result and result['status'] == 'success':
-                    logger.info("Navidrome 保活请求成功")
-                else:
-                    logger.warning(f"Navidrome 保活请求失败, result: {result} , 重新获取token")
-                    self.token = self._login()
-                    if self.token:
-                        logger.info("Navidrome 重新登录成功")
-                    else:
-                        logger.error("Navidrome 重新登录失败")
+        """发送 Navidrome 保活请求，token 失效时由 _make_request 通过 TokenManager 刷新"""
+        endpoint = "/api/keepalive/keepalive"
+        result = self._make_request("GET", endpoint)
+        if result and result['status'] == 'success':
+            logger.info("Navidrome 保活请求成功")
+        else:
+            logger.warning(f"Navidrome 保活请求失败, result: {result}")
         # self._start_keep_alive()
 
     def _start_keep_alive(self):
@@ -166,12 +165,13 @@ class NavidromeAPIClient(BaseAPIClient):
         self._keep_alive_timer.start()
         logger.info(f"Navidrome 保活定时器启动，时间间隔：{interval} 秒")
 
-    def _make_request(self, method, endpoint, params=None, data=None, headers=None):
+    def _make_request(self, method, endpoint, params=None, data=None, headers=None, retry_login=True):
         """发送 API 请求"""
         url = f"{self.api_url}{endpoint}"
 
         # 如果 token 存在，则添加到请求头
-        _headers = {"x-nd-authorization": f"Bearer {self.token}"} if self.token else {}
+        token, epoch = self.tokens.get()
+        _headers = {"x-nd-authorization": f"Bearer {token}"} if token else {}
         if headers:
             _headers.update(headers)  # 如果传入了 headers，则合并
 
@@ -180,21 +180,19 @@ class NavidromeAPIClient(BaseAPIClient):
             response = self.session.request(method, url, params=params, json=data, headers=_headers)
             # 根据状态码返回不同的结果
             if response.status_code == 200:
+                # Navidrome 在响应头中下发续期后的 token
+                refreshed = response.headers.get("x-nd-authorization", "")
+                if refreshed.startswith("Bearer "):
+                    self.tokens.offer(refreshed[len("Bearer "):])
                 return {"status": "success", "data": response.json(), "headers": response.headers}
 
-            elif response.status_code == 401:
-                max_retries = 3
-                retries = 0
-
-                while retries < max_retries:
-                    logger.warning(f"Navidrome token 过期，尝试第{retries}次重新登录...")
-                    self.token = self._login()
-                    if self.token:
-                        logger.info("Navidrome 重新登录成功，使用新 token 重新发送请求")
-                        return self._make_request(method, endpoint, params, data, headers)
-                    else:
-                        logger.warning(f"尝试第{retries}次重新登录失败...")
-                        retries += 1
+            elif response.status_code == 401 and retry_login:
+                # 并发请求同时遇到 token 失效时只登录一次，其余请求等待同一次登录的结果
+                logger.warning("Navidrome token 过期，重新登录...")
+                if self.tokens.refresh(epoch):
+                    logger.info("Navidrome 重新登录成功，使用新 token 重新发送请求")
+                    return self._make_request(method, endpoint, params, data, headers, retry_login=False)
+                raise requests.exceptions.RequestException("Navidrome 重新登录失败")
             else:
                 raise requests.exceptions.RequestException
         except requests.exceptions.RequestException as e:
@@ -213,14 +211,29 @@ class NavidromeAPIClient(BaseAPIClient):
 
     def get_user_by_username(self, username):
         """根据用户名获取 Navidrome 用户信息"""
+        if self.directory is not None and self.directory.ready:
+            user = self.directory.get_by_username(username)
+            return user.data if user else None
         users = self.get_users()
         if users and users['status'] == 'success':
-            for index, user in enumerate(users['data']):
-                logger.info(f"index: {index}, user: {user}")
+            for user in users['data']:
                 if user['userName'] == username:
-                    return users['data'][index]
+                    return user
+        return None
+
+    def _list_upstream_users(self):
+        """获取所有用户的原始数据，供 UserDirectory 同步，失败时返回 None"""
+        users = self.get_users()
+        if users and users['status'] == 'success':
+            return users['data']
         return None
 
+    def _normalize_user(self, raw):
+        """把 Navidrome 用户数据转换为 UpstreamUser"""
+        last_seen = [t for t in (parse_upstream_time(raw.get('lastLoginAt')),
+                                 parse_upstream_time(raw.get('lastAccessAt'))) if t is not None]
+        return UpstreamUser(raw['id'], raw['userName'], bool(raw.get('isAdmin')), max(last_seen) if last_seen else None)
+
     def create_user(self, username, password):
         """创建 Navidrome 用户"""
         endpoint = "/api/user"
@@ -232,7 +245,7 @@ class NavidromeAPIClient(BaseAPIClient):
             "email": "",
             "isAdmin": False,
         }
-        return self._make_request("POST", endpoint, data=data)
+        return self._on_users_changed(self._make_request("POST", endpoint, data=data))
 
     def update_user(self, user_id, user_data):
         """更新 Navidrome 用户信息"""
@@ -246,7 +259,8 @@ class NavidromeAPIClient(BaseAPIClient):
         data = {"username": username, "password": password}
 
         try:
-            response = requests.post(url, json=data)
+            # 不带管理员的认证头，只验证该用户的账号密码
+            response = self.session.post(url, json=data, headers={"x-nd-authorization": None})
             response.raise_for_status()
             user_id = response.json().get('id')
             logger.info(f"Navidrome 用户认证成功")
@@ -270,12 +284,12 @@ class NavidromeAPIClient(BaseAPIClient):
             data['changePassword'] = True
             data['password'] = password
         logger.debug(f"data: {data}")
-        return self._make_request("PUT", endpoint, data=data)
+        return self._on_users_changed(self._make_request("PUT", endpoint, data=data))
 
     def delete_user(self, user_id):
         """删除 Navidrome 用户"""
         endpoint = f"/api/user/{user_id}"
-        return self._make_request("DELETE", endpoint)
+        return self._on_users_changed(self._make_request("DELETE", endpoint), deleted_user_id=user_id)
 
     def get_albums(self, _end=1, _order="", _sort="", _start=0):
         """
@@ -0,0 +1,178 @@
+import base64
+import json
+import sqlite3
+import threading
+import time
+from app.utils.db_utils import db_connection, submit_write
+from app.utils.logger import logger
+from config import settings
+
+# 需要安装的模块：无
+
+REFRESH_WAIT_TIMEOUT = 60  # 等待正在进行的刷新最多多少秒
+
+
+def get_token_expiry(token):
+    """
+    读取 JWT 的 exp 声明
+    Returns:
+        过期时间戳（秒），不是 JWT 或没有 exp 时返回 None
+    """
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get("exp")
+        return float(exp) if exp else None
+    except (AttributeError, IndexError, ValueError, TypeError):
+        return None
+
+
+class TokenManager:
+    """
+    上游服务的管理员 token 管理器
+
+    - 单飞刷新：每次刷新使 epoch 加一，请求返回 401 时调用 refresh(epoch) 并传入发送请求时的 epoch，
+      同一 epoch 内只有第一个调用方登录，其余调用方等待同一次刷新的结果；
+    - 提前刷新：JWT 的 exp 声明距现在不到 TOKEN_REFRESH_MARGIN 秒时在后台刷新，刷新期间继续使用旧 token；
+    - 持久化：token 保存在 ApiTokens 表中，重启后直接使用未过期的 token，不需要重新登录。
+    """
+
+    def __init__(self, name, login, on_update=None, refresh_margin=None):
+        """
+        初始化 token 管理器
+        Args:
+            name: 名称，也是 ApiTokens 表的主键
+            login: 登录函数，返回新 token，失败时返回 None
+            on_update: token 变化时调用 on_update(token)，例如更新 session 的请求头
+            refresh_margin: 距过期多少秒时提前刷新
+        """
+        self.name = name
+        self._login = login
+        self._on_update = on_update
+        self.refresh_margin = refresh_margin if refresh_margin is not None else settings.TOKEN_REFRESH_MARGIN
+        self.token = None
+        self.expires_at = None
+        self.epoch = 0
+        self._refreshing = False
+        self._persisted_expires_at = None
+        self._cond = threading.Condition()
+        self._stats = {"logins": 0, "login_failures": 0, "waits": 0, "proactive": 0, "offered": 0, "loaded": 0}
+
+    def _set(self, token, persist=True):
+        """设置新 token，调用方需持有锁"""
+        self.token = token
+        self.expires_at = get_token_expiry(token)
+        self.epoch += 1
+        if self._on_update:
+            self._on_update(token)
+        if persist and (self._persisted_expires_at is None or self.expires_at is None
+                        or self.expires_at - self._persisted_expires_at >= self.refresh_margin):
+            self._persisted_expires_at = self.expires_at
+            self._persist(token, self.expires_at)
+
+    def _persist(self, token, expires_at):
+        def _write(conn):
+            conn.execute("INSERT OR REPLACE INTO ApiTokens (name, token, expires_at, update_time) "
+                         "VALUES (?, ?, ?, CURRENT_TIMESTAMP)", (self.name, token, expires_at))
+
+        def _done(future):
+            if future.exception():
+                # 首次启动时数据库迁移可能还没有执行，下一次 token 变化时重新保存
+                self._persisted_expires_at = None
+                logger.warning(f"保存 token 失败: name={self.name}, error={future.exception()}")
+
+        submit_write(_write).add_done_callback(_done)
+
+    def _expired(self, now=None):
+        return self.expires_at is not None and self.expires_at <= (now or time.time())
+
+    def load(self):
+        """
+        从数据库加载未过期的 token
+        Returns:
+            是否加载成功
+        """
+        try:
+            with db_connection() as conn:
+                row = conn.execute("SELECT token, expires_at FROM ApiTokens WHERE name = ?", (self.name,)).fetchone()
+        except sqlite3.OperationalError as e:
+            # 首次启动时数据库迁移还没有执行
+            logger.debug(f"读取已保存的 token 失败: name={self.name}, error={e}")
+            return False
+        if not row or (row['expires_at'] is not None and row['expires_at'] - self.refresh_margin <= time.time()):
+            return False
+        with self._cond:
+            self._persisted_expires_at = row['expires_at']
+            self._set(row['token'], persist=False)
+            self._stats["loaded"] += 1
+        logger.info(f"使用已保存的 token: name={self.name}")
+        return True
+
+    def offer(self, token, persist=True):
+        """使用外部提供的 token，例如 API Key 或上游服务在响应中下发的新 token"""
+        with self._cond:
+            if not token or token == self.token:
+                return
+            self._set(token, persist)
+            self._stats["offered"] += 1
+
+    def get(self):
+        """
+        获取当前 token，没有 token 或已过期时登录
+        Returns:
+            (token, epoch)，请求返回 401 时把 epoch 传给 refresh
+        """
+        with self._cond:
+            token, epoch, expires_at = self.token, self.epoch, self.expires_at
+            refreshing = self._refreshing
+        now = time.time()
+        if token and (expires_at is None or expires_at - self.refresh_margin > now):
+            return token, epoch
+        if token and not self._expired(now):
+            if not refreshing:
+                self._stats["proactive"] += 1
+                threading.Thread(target=self.refresh, args=(epoch,), name=f"token-refresh-{self.name}",
+                                 daemon=True).start()
+            return token, epoch
+        return self.refresh(epoch), self.epoch
+
+    def refresh(self, epoch=None):
+        """
+        刷新 token，同一 epoch 只登录一次
+        Args:
+            epoch: 调用方使用的 token 的 epoch，已经刷新过时直接返回新 token
+        Returns:
+            新 token，登录失败时返回 None
+        """
+        with self._cond:
+            if epoch is not None and epoch != self.epoch:
+                return self.token
+            if self._refreshing:
+                self._stats["waits"] += 1
+                self._cond.wait_for(lambda: not self._refreshing, timeout=REFRESH_WAIT_TIMEOUT)
+                return self.token if self.epoch != epoch else None
+            self._refreshing = True
+        token = None
+        try:
+            token = self._login()
+        except Exception as e:
+            logger.error(f"登录失败: name={self.name}, error={e}")
+        with self._cond:
+            self._refreshing = False
+            self._stats["logins"] += 1
+            if token:
+                self._set(token)
+            else:
+                self._stats["login_failures"] += 1
+            self._cond.notify_all()
+        if token:
+            logger.info(f"token 已刷新: name={self.name}, epoch={self.epoch}")
+        return token
+
+    def get_stats(self):
+        """获取 token 管理器统计信息"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats["epoch"] = self.epoch
+            stats["expires_in"] = self.expires_at - time.time() if self.expires_at is not None else None
+        return stats
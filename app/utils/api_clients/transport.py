@@ -0,0 +1,270 @@
+import bisect
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from app.utils.api_clients.circuit_breaker import CircuitBreaker, CircuitOpenError
+from app.utils.cache import TTLCache, MISSING
+from app.utils.logger import logger
+from config import settings
+
+# 需要安装的模块：requests
+# pip install requests
+
+# 可以安全重试的请求方法，POST 等请求只在确认没有发出时重试
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE"))
+# 可以重试的响应状态码
+RETRY_STATUS_CODES = frozenset((429, 502, 503, 504))
+# 延迟直方图的桶上限（毫秒）
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf"))
+# 熔断时由最近一次成功响应的快照提供的响应带有这个头
+SNAPSHOT_HEADER = "X-Served-From-Snapshot"
+# 路径中看起来像 ID 的部分（数字、UUID、十六进制或包含数字的长字符串），统计时替换为 :id
+ID_SEGMENT = re.compile(r"^(\d+|[0-9a-fA-F-]{16,}|(?=.*\d)[A-Za-z0-9_-]{12,})$")
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def endpoint_template(method, url):
+    """把请求地址转换为统计用的端点名称，例如 GET /api/user/:id"""
+    path = urlsplit(url).path
+    segments = [":id" if ID_SEGMENT.match(segment) else segment for segment in path.split("/")]
+    return f"{method} {'/'.join(segments)}"
+
+
+class LatencyHistogram:
+    """
+    请求延迟直方图，按 LATENCY_BUCKETS 分桶计数
+    """
+    __slots__ = ("count", "errors", "retries", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def observe(self, elapsed_ms, error=False):
+        self.count += 1
+        self.errors += int(error)
+        self.total += elapsed_ms
+        self.max = max(self.max, elapsed_ms)
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, elapsed_ms)] += 1
+
+    def percentile(self, p):
+        """根据分桶估算分位数（返回桶上限）"""
+        if not self.count:
+            return 0.0
+        target = self.count * p
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "retries": self.retries,
+            "avg_ms": self.total / self.count if self.count else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": self.max,
+            "buckets": {str(bound): count for bound, count in zip(LATENCY_BUCKETS, self.buckets) if count},
+        }
+
+
+class HTTPTransport(requests.Session):
+    """
+    上游服务共用的 HTTP 传输层
+
+    在 requests.Session 的基础上增加：
+    - 默认的连接/读取超时，调用方没有指定 timeout 时使用；
+    - 按 HTTP_POOL_SIZE 设置连接池大小的 HTTPAdapter；
+    - 区分幂等性的重试：幂等请求在连接错误、超时和 429/502/503/504 时重试，
+      其他请求只在连接没有建立（请求确认没有发出）时重试，重试间隔为带随机抖动的指数退避；
+    - 按端点统计的延迟直方图；
+    - 熔断器：上游服务连续失败后打开，打开期间 GET 请求返回最近一次成功响应的快照（只读降级），
+      其他请求直接抛出 CircuitOpenError，不再等待超时。
+    客户端继续像使用 requests.Session 一样使用它。
+    """
+
+    def __init__(self, name, connect_timeout=None, read_timeout=None, pool_size=None, max_retries=None,
+                 backoff_base=None, backoff_max=None):
+        """
+        初始化传输层
+        Args:
+            name: 名称，用于日志和统计
+            connect_timeout: 连接超时（秒）
+            read_timeout: 读取超时（秒）
+            pool_size: 每个主机的连接池大小
+            max_retries: 最多重试次数
+            backoff_base: 退避的基础时间（秒）
+            backoff_max: 单次退避的最长时间（秒）
+        """
+        super().__init__()
+        self.name = name
+        self.timeout = (connect_timeout or settings.HTTP_CONNECT_TIMEOUT, read_timeout or settings.HTTP_READ_TIMEOUT)
+        self.max_retries = max_retries if max_retries is not None else settings.HTTP_MAX_RETRIES
+        self.backoff_base = backoff_base or settings.HTTP_BACKOFF_BASE
+        self.backoff_max = backoff_max or settings.HTTP_BACKOFF_MAX
+        pool_size = pool_size or settings.HTTP_POOL_SIZE
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+        self._histograms = {}
+        self._stats_lock = threading.Lock()
+        self.breaker = CircuitBreaker(name)
+        # 最近一次成功的 GET 响应，键为完整的请求地址
+        self._snapshots = TTLCache(maxsize=settings.CIRCUIT_SNAPSHOT_MAX_ENTRIES, ttl=settings.CIRCUIT_SNAPSHOT_TTL)
+        with _transports_lock:
+            _transports[name] = self
+
+    def _backoff(self, attempt, response=None):
+        """第 attempt 次重试前等待的秒数，响应带有 Retry-After 时优先使用"""
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                try:
+                    return min(max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0), self.backoff_max)
+                except (TypeError, ValueError):
+                    pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    @staticmethod
+    def _not_sent(error):
+        """请求是否确认没有发出（连接超时或无法建立连接）"""
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+            return isinstance(getattr(error.args[0], "reason", None), NewConnectionError)
+        return False
+
+    def _observe(self, key, elapsed_ms, error=False, retry=False):
+        with self._stats_lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = LatencyHistogram()
+            if retry:
+                histogram.retries += 1
+            else:
+                histogram.observe(elapsed_ms, error)
+
+    @staticmethod
+    def _snapshot_key(url, params=None):
+        return requests.Request("GET", url, params=params).prepare().url
+
+    def _save_snapshot(self, key, response):
+        self._snapshots.set(key, (response.status_code, dict(response.headers), response.content, response.encoding))
+
+    def _serve_snapshot(self, method, url, kwargs):
+        """熔断器打开时的响应：GET 请求返回快照，没有快照或其他请求抛出 CircuitOpenError"""
+        key = endpoint_template(method, url)
+        if method == "GET":
+            snapshot = self._snapshots.get(self._snapshot_key(url, kwargs.get("params")))
+            if snapshot is not MISSING:
+                status_code, headers, content, encoding = snapshot
+                response = requests.Response()
+                response.status_code = status_code
+                response.headers.update(headers)
+                response.headers[SNAPSHOT_HEADER] = "1"
+                response._content = content
+                response.encoding = encoding
+                response.url = url
+                self.breaker.record_snapshot_served()
+                logger.debug(f"{self.name} 熔断中，返回快照: {key}")
+                return response
+        raise CircuitOpenError(f"{self.name} 服务暂时不可用（熔断中）: {key}")
+
+    def request(self, method, url, *args, **kwargs):
+        """经过熔断器发送请求，GET 请求的成功响应保存为快照"""
+        method = method.upper()
+        if not self.breaker.allow():
+            return self._serve_snapshot(method, url, kwargs)
+        try:
+            response = self._send(method, url, *args, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            # 其他错误（例如地址配置错误）不能说明上游服务是否可用，只释放试探名额
+            self.breaker.release()
+            raise
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+            if method == "GET" and response.status_code == 200:
+                self._save_snapshot(self._snapshot_key(url, kwargs.get("params")), response)
+        return response
+
+    def _send(self, method, url, *args, **kwargs):
+        """发送请求，按重试策略重试，并记录延迟"""
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        idempotent = method in IDEMPOTENT_METHODS
+        key = endpoint_template(method, url)
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except requests.exceptions.RequestException as e:
+                elapsed_ms = (time.monotonic() - start) * 1000
+                retryable = isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)) and (
+                        idempotent or self._not_sent(e))
+                if not retryable or attempt >= self.max_retries:
+                    self._observe(key, elapsed_ms, error=True)
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning(f"{self.name} 请求失败，{delay:.2f} 秒后重试: {key}, attempt={attempt + 1}, error={e}")
+            else:
+                elapsed_ms = (time.monotonic() - start) * 1000
+                if response.status_code not in RETRY_STATUS_CODES or not idempotent or attempt >= self.max_retries:
+                    self._observe(key, elapsed_ms, error=response.status_code >= 500)
+                    return response
+                delay = self._backoff(attempt, response)
+                logger.warning(f"{self.name} 请求返回 {response.status_code}，{delay:.2f} 秒后重试: {key}, "
+                               f"attempt={attempt + 1}")
+                response.close()
+            self._observe(key, elapsed_ms, retry=True)
+            attempt += 1
+            time.sleep(delay)
+
+    def get_stats(self):
+        """获取按端点统计的延迟直方图"""
+        with self._stats_lock:
+            return {key: histogram.to_dict() for key, histogram in self._histograms.items()}
+
+    def get_breaker_stats(self):
+        """获取熔断器和快照统计信息"""
+        stats = self.breaker.get_stats()
+        stats["snapshots"] = self._snapshots.get_stats()
+        return stats
+
+
+def get_transport_stats():
+    """获取所有传输层的统计信息"""
+    with _transports_lock:
+        transports = dict(_transports)
+    return {name: transport.get_stats() for name, transport in transports.items()}
+
+
+def get_circuit_breaker_stats():
+    """获取所有传输层的熔断器状态"""
+    with _transports_lock:
+        transports = dict(_transports)
+    return {name: transport.get_breaker_stats() for name, transport in transports.items()}
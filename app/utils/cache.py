@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import OrderedDict
+
+# 需要安装的模块：无
+
+MISSING = object()  # 缓存未命中标记，与缓存的 None 值区分
+
+
+class TTLCache:
+    """
+    线程安全的 TTL + LRU 缓存
+
+    超过 maxsize 时淘汰最久未使用的条目，条目超过 ttl 秒后失效。
+    每次失效操作都会递增 generation，读取数据库前记录 generation，
+    写入缓存时若 generation 已变化则放弃写入，避免把并发写入之前读到的旧数据放进缓存。
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        """
+        初始化缓存
+        Args:
+            maxsize: 最大条目数
+            ttl: 条目有效期（秒）
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (过期时间, 值)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    @property
+    def generation(self):
+        """当前失效代数"""
+        return self._generation
+
+    def get(self, key):
+        """
+        获取缓存值
+        Returns:
+            缓存值，未命中或已过期时返回 MISSING
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self._stats["misses"] += 1
+                return MISSING
+            expire_at, value = item
+            if expire_at < time.monotonic():
+                del self._data[key]
+                self._stats["misses"] += 1
+                return MISSING
+            self._data.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def set(self, key, value, generation=None):
+        """
+        写入缓存
+        Args:
+            generation: 读取数据前记录的 generation，与当前值不同时放弃写入
+        Returns:
+            是否写入成功
+        """
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return False
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._stats["evictions"] += 1
+            return True
+
+    def delete(self, key):
+        """删除缓存条目"""
+        with self._lock:
+            self._generation += 1
+            self._stats["invalidations"] += 1
+            self._data.pop(key, None)
+
+    def delete_where(self, predicate):
+        """删除满足条件的缓存条目，predicate 接收 (key, value)"""
+        with self._lock:
+            self._generation += 1
+            self._stats["invalidations"] += 1
+            for key in [key for key, (_, value) in self._data.items() if predicate(key, value)]:
+                del self._data[key]
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._generation += 1
+            self._stats["invalidations"] += 1
+            self._data.clear()
+
+    def get_stats(self):
+        """获取缓存统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._data)
+        return stats
@@ -1,166 +1,507 @@
+import atexit
+import queue
 import sqlite3
 import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime
+import pytz
 from config import settings
+from app.utils.logger import logger
 
 # 需要安装的模块：无 (sqlite3 是 Python 内置模块)
 
-db_lock = threading.Lock()
-def get_db_connection():
-    """获取数据库连接"""
-    conn = sqlite3.connect(settings.DATABASE_URL)
-    conn.row_factory = sqlite3.Row  # 使查询结果可以像字典一样访问
-    return conn
+# 写锁，仅在 direct 写入模式下串行化写操作，读操作不再加锁
+db_lock = threading.RLock()
+
+
+class ConnectionManager:
+    """
+    SQLite 连接管理器
+
+    每个线程复用自己的连接（线程亲和），连接打开时统一设置 PRAGMA，
+    取用时按间隔做健康检查，并统计连接打开、复用次数和等待时间。
+    """
+
+    def __init__(self, database=None, max_connections=None, pragmas=None, health_check_interval=None):
+        """
+        初始化连接管理器
+        Args:
+            database: 数据库文件路径，默认为 settings.DATABASE_URL
+            max_connections: 同时使用中的最大连接数，超过时等待
+            pragmas: 连接打开时执行的 PRAGMA 字典
+            health_check_interval: 连接空闲超过该秒数时，取用前执行健康检查
+        """
+        self.database = database if database is not None else settings.DATABASE_URL
+        self.max_connections = max_connections if max_connections is not None else settings.DB_POOL_SIZE
+        if pragmas is None:
+            pragmas = {
+                "journal_mode": settings.DB_JOURNAL_MODE,
+                "busy_timeout": settings.DB_BUSY_TIMEOUT,
+                "temp_store": "MEMORY",
+                "cache_size": -8000,
+            }
+            if settings.DB_JOURNAL_MODE.upper() == "WAL":
+                pragmas["synchronous"] = "NORMAL"  # WAL 模式下 NORMAL 不会损坏数据库
+        self.pragmas = pragmas
+        self.health_check_interval = health_check_interval if health_check_interval is not None else settings.DB_HEALTH_CHECK_INTERVAL
+        self._local = threading.local()
+        self._slots = threading.BoundedSemaphore(self.max_connections)
+        self._lock = threading.Lock()
+        self._connections = {}  # 线程 -> 连接，用于回收已退出线程的连接
+        self._stats = {"opens": 0, "reuses": 0, "health_check_failures": 0, "closed": 0,
+                       "waits": 0, "wait_time": 0.0, "max_wait_time": 0.0}
+
+    def _open(self):
+        """打开新连接并应用 PRAGMA"""
+        conn = sqlite3.connect(self.database, check_same_thread=False)
+        conn.row_factory = sqlite3.Row  # 使查询结果可以像字典一样访问
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        with self._lock:
+            self._stats["opens"] += 1
+            self._connections[threading.current_thread()] = conn
+        logger.debug(f"打开数据库连接: thread={threading.current_thread().name}")
+        return conn
+
+    def _is_healthy(self, conn):
+        """健康检查"""
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error as e:
+            logger.warning(f"数据库连接健康检查失败: {e}")
+            return False
+
+    def _discard(self, conn):
+        """关闭并丢弃连接"""
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._stats["closed"] += 1
+
+    def _reap_dead_threads(self):
+        """关闭已退出线程遗留的连接"""
+        with self._lock:
+            dead = [thread for thread in self._connections if not thread.is_alive()]
+            conns = [self._connections.pop(thread) for thread in dead]
+        for conn in conns:
+            self._discard(conn)
+
+    def _checkout(self):
+        """取出当前线程的连接，没有则新建"""
+        start = time.monotonic()
+        self._slots.acquire()
+        waited = time.monotonic() - start
+        with self._lock:
+            self._stats["waits"] += 1
+            self._stats["wait_time"] += waited
+            self._stats["max_wait_time"] = max(self._stats["max_wait_time"], waited)
+
+        try:
+            conn = getattr(self._local, "conn", None)
+            if conn is not None:
+                now = time.monotonic()
+                if now - self._local.checked_at > self.health_check_interval and not self._is_healthy(conn):
+                    with self._lock:
+                        self._stats["health_check_failures"] += 1
+                        self._connections.pop(threading.current_thread(), None)
+                    self._discard(conn)
+                    conn = None
+                else:
+                    with self._lock:
+                        self._stats["reuses"] += 1
+            if conn is None:
+                self._reap_dead_threads()
+                conn = self._open()
+                self._local.conn = conn
+            self._local.checked_at = time.monotonic()
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    @contextmanager
+    def connection(self):
+        """
+        获取当前线程的数据库连接（上下文管理器）
+
+        同一线程内嵌套使用时复用同一连接，最外层退出时提交，出现异常时回滚。
+        """
+        depth = getattr(self._local, "depth", 0)
+        if depth:
+            self._local.depth = depth + 1
+            try:
+                yield self._local.conn
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn = self._checkout()
+        self._local.depth = 1
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            self._local.depth = 0
+            self._slots.release()
+
+    def close_all(self):
+        """关闭所有连接"""
+        with self._lock:
+            conns = list(self._connections.values())
+            self._connections.clear()
+        for conn in conns:
+            self._discard(conn)
+        self._local = threading.local()
+        logger.info(f"已关闭所有数据库连接, count={len(conns)}")
+
+    def get_stats(self):
+        """获取连接池统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["open_connections"] = len(self._connections)
+        stats["avg_wait_time"] = stats["wait_time"] / stats["waits"] if stats["waits"] else 0.0
+        return stats
+
+
+_connection_manager = None
+_connection_manager_lock = threading.Lock()
+
+
+def get_connection_manager():
+    """获取 ConnectionManager 实例"""
+    global _connection_manager
+    if not _connection_manager:
+        with _connection_manager_lock:
+            if not _connection_manager:
+                _connection_manager = ConnectionManager()
+    return _connection_manager
+
+
+def db_connection():
+    """获取当前线程的数据库连接（上下文管理器）"""
+    return get_connection_manager().connection()
+
+
+def get_db_stats():
+    """获取数据库连接池统计信息"""
+    return get_connection_manager().get_stats()
+
+
+class DatabaseWriter:
+    """
+    数据库写线程
+
+    所有写操作通过队列交给唯一的写线程串行执行，队列中积压的写操作合并为一个事务提交（group commit），
+    每个写操作使用独立的 SAVEPOINT，单个操作失败不影响同批次的其他操作。调用方拿到 Future 获取结果。
+    """
+
+    def __init__(self, batch_size=None):
+        """
+        初始化写线程
+        Args:
+            batch_size: 单个事务最多合并的写操作数量
+        """
+        self.batch_size = batch_size if batch_size is not None else settings.DB_WRITER_BATCH_SIZE
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "committed": 0, "failed": 0, "batches": 0, "max_batch": 0}
+
+    def start(self):
+        """启动写线程"""
+        with self._lock:
+            if not self._thread or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+                logger.info("数据库写线程已启动")
+
+    def submit(self, func, *args, **kwargs):
+        """
+        提交写操作
+        Args:
+            func: 写操作函数，第一个参数为数据库连接
+            args: 函数的参数
+        Returns:
+            concurrent.futures.Future，结果为 func 的返回值
+        """
+        future = Future()
+        if threading.current_thread() is self._thread:
+            # 写操作中嵌套提交写操作，直接在当前事务中执行，避免写线程等待自己
+            with db_connection() as conn:
+                future.set_result(func(conn, *args, **kwargs))
+            return future
+        self.start()
+        with self._lock:
+            self._stats["submitted"] += 1
+        self._queue.put((future, func, args, kwargs))
+        return future
+
+    def _run(self):
+        """写线程主循环"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._execute_batch(batch)
+            if stop:
+                break
+
+    def _execute_batch(self, batch):
+        """在一个事务中执行一批写操作"""
+        results = []
+        try:
+            with db_connection() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                for future, func, args, kwargs in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    conn.execute("SAVEPOINT write_op")
+                    try:
+                        result = func(conn, *args, **kwargs)
+                        conn.execute("RELEASE SAVEPOINT write_op")
+                        results.append((future, result, None))
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO SAVEPOINT write_op")
+                        conn.execute("RELEASE SAVEPOINT write_op")
+                        results.append((future, None, e))
+        except Exception as e:
+            logger.error(f"数据库批量写入失败: count={len(batch)}, error={e}")
+            for future, _, _, _ in batch:
+                if not future.done():
+                    if future.running():
+                        future.set_exception(e)
+                    else:
+                        future.cancel()
+            self._stats["failed"] += len(batch)
+            return
+
+        # 提交成功后再通知调用方，保证调用方随后读取时能看到写入结果
+        for future, result, error in results:
+            if error is not None:
+                self._stats["failed"] += 1
+                future.set_exception(error)
+            else:
+                self._stats["committed"] += 1
+                future.set_result(result)
+        self._stats["batches"] += 1
+        self._stats["max_batch"] = max(self._stats["max_batch"], len(batch))
+
+    def stop(self, timeout=5):
+        """停止写线程，等待队列中的写操作执行完成"""
+        if self._thread and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+            logger.info("数据库写线程已停止")
+
+    def get_stats(self):
+        """获取写线程统计信息"""
+        stats = dict(self._stats)
+        stats["pending"] = self._queue.qsize()
+        return stats
+
+
+_db_writer = None
+
+
+def get_db_writer():
+    """获取 DatabaseWriter 实例"""
+    global _db_writer
+    if not _db_writer:
+        with _connection_manager_lock:
+            if not _db_writer:
+                _db_writer = DatabaseWriter()
+                atexit.register(_db_writer.stop)
+    return _db_writer
+
+
+def submit_write(func, *args, **kwargs):
+    """
+    提交写操作，返回 Future
+
+    queue 模式下交给写线程执行；direct 模式下在当前线程加写锁执行，返回已完成的 Future。
+    Args:
+        func: 写操作函数，第一个参数为数据库连接
+    """
+    if settings.DB_WRITE_MODE == "queue":
+        return get_db_writer().submit(func, *args, **kwargs)
+
+    future = Future()
+    try:
+        with db_lock:
+            with db_connection() as conn:
+                future.set_result(func(conn, *args, **kwargs))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def execute_write(func, *args, **kwargs):
+    """执行写操作并等待结果"""
+    return submit_write(func, *args, **kwargs).result()
+
+
+def format_utc_datetime(value):
+    """
+    将时间转换为统一的 UTC 时间字符串，用于存储和范围查询
+
+    统一格式后时间字符串可以直接按字典序比较。无时区的时间按 Asia/Shanghai 处理。
+    Args:
+        value: datetime 对象或 ISO 格式字符串
+    Returns:
+        UTC 时间字符串，例如 '2024-12-25 02:00:00.000000+00:00'，value 为空时返回 None
+    """
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = pytz.timezone('Asia/Shanghai').localize(value)
+    return value.astimezone(pytz.utc).strftime("%Y-%m-%d %H:%M:%S.%f+00:00")
 
-def close_db_connection(conn):
-    """关闭数据库连接"""
-    if conn:
-        conn.close()
 
 def create_tables():
     """创建数据库表"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    # 创建 Users 表
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS Users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            telegram_id INTEGER UNIQUE NOT NULL,
-            service_type TEXT NOT NULL,
-            username TEXT,
-            service_user_id TEXT,
-            score INTEGER DEFAULT 0,
-            invite_code TEXT,
-            service_name TEXT,
-            status TEXT DEFAULT 'active',
-            expiration_date DATETIME, 
-            last_sign_in_date DATETIME,
-            create_time DATETIME DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(telegram_id, service_type) 
-        )
-    """)
-
-    # 创建 InviteCodes 表
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS InviteCodes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            code TEXT UNIQUE NOT NULL,
-            is_used BOOLEAN DEFAULT FALSE,
-            user_id INTEGER,
-            type TEXT NOT NULL CHECK(type IN ('invite', 'renew')),
-            create_time DATETIME DEFAULT CURRENT_TIMESTAMP,
-            expire_days INTEGER NOT NULL,
-            expire_time DATETIME,
-            create_user_id INTEGER NOT NULL,
-            FOREIGN KEY (user_id) REFERENCES Users(id)
-        )
-    """)
-    
-    # 创建 RandomScoreEvents 表
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS RandomScoreEvents (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            create_user_id INTEGER NOT NULL,
-            telegram_chat_id INTEGER NOT NULL,
-            total_score INTEGER NOT NULL,
-            participants_count INTEGER NOT NULL,
-            score_list TEXT NOT NULL,
-            score_result TEXT,
-            create_time DATETIME DEFAULT CURRENT_TIMESTAMP,
-            end_time DATETIME,
-            is_finished BOOLEAN DEFAULT FALSE
-        )
-    """)
-
-    conn.commit()
-    close_db_connection(conn)
+    with db_connection() as conn:
+        cursor = conn.cursor()
+
+        # 创建 Users 表
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS Users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                telegram_id INTEGER UNIQUE NOT NULL,
+                service_type TEXT NOT NULL,
+                username TEXT,
+                service_user_id TEXT,
+                score INTEGER DEFAULT 0,
+                invite_code TEXT,
+                service_name TEXT,
+                status TEXT DEFAULT 'active',
+                expiration_date DATETIME,
+                last_sign_in_date DATETIME,
+                create_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(telegram_id, service_type)
+            )
+        """)
+
+        # 创建 InviteCodes 表
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS InviteCodes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                code TEXT UNIQUE NOT NULL,
+                is_used BOOLEAN DEFAULT FALSE,
+                user_id INTEGER,
+                type TEXT NOT NULL CHECK(type IN ('invite', 'renew')),
+                create_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+                expire_days INTEGER NOT NULL,
+                expire_time DATETIME,
+                create_user_id INTEGER NOT NULL,
+                FOREIGN KEY (user_id) REFERENCES Users(id)
+            )
+        """)
+
+        # 创建 RandomScoreEvents 表
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS RandomScoreEvents (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                create_user_id INTEGER NOT NULL,
+                telegram_chat_id INTEGER NOT NULL,
+                total_score INTEGER NOT NULL,
+                participants_count INTEGER NOT NULL,
+                score_list TEXT NOT NULL,
+                score_result TEXT,
+                create_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+                end_time DATETIME,
+                is_finished BOOLEAN DEFAULT FALSE
+            )
+        """)
 
 def insert_data(table_name, data):
     """插入数据"""
-    with db_lock:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+    columns = ', '.join(data.keys())
+    placeholders = ', '.join(['?'] * len(data))
+    values = tuple(data.values())
 
-        columns = ', '.join(data.keys())
-        placeholders = ', '.join(['?'] * len(data))
-        values = tuple(data.values())
+    def _insert(conn):
+        cursor = conn.execute(f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})", values)
+        return cursor.lastrowid  # 返回插入的行ID
 
-        try:
-            cursor.execute(f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})", values)
-            conn.commit()
-            return cursor.lastrowid  # 返回插入的行ID
-        except sqlite3.Error as e:
-            print(f"Error inserting data into {table_name}: {e}")
-            return None
-        finally:
-            close_db_connection(conn)
+    try:
+        return execute_write(_insert)
+    except sqlite3.Error as e:
+        logger.error(f"Error inserting data into {table_name}: {e}")
+        return None
 
 def select_data(table_name, where_clause=None, order_by=None, where_values = None):
     """查询数据"""
-    with db_lock:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        query = f"SELECT * FROM {table_name}"
-        if where_clause:
-            query += f" WHERE {where_clause}"
-        if order_by:
-            query += f" ORDER BY {order_by}"
+    query = f"SELECT * FROM {table_name}"
+    if where_clause:
+        query += f" WHERE {where_clause}"
+    if order_by:
+        query += f" ORDER BY {order_by}"
 
-        try:
+    try:
+        with db_connection() as conn:
             if where_values:
-                cursor.execute(query, tuple(where_values))
+                rows = conn.execute(query, tuple(where_values)).fetchall()
             else:
-              cursor.execute(query)
-            rows = cursor.fetchall()
+                rows = conn.execute(query).fetchall()
             return [dict(row) for row in rows]
-        except sqlite3.Error as e:
-            print(f"Error selecting data from {table_name}: {e}")
-            return None
-        finally:
-            close_db_connection(conn)
+    except sqlite3.Error as e:
+        logger.error(f"Error selecting data from {table_name}: {e}")
+        return None
 
 def update_data(table_name, data, where_clause, where_values = None):
     """更新数据"""
-    with db_lock:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+    set_clause = ', '.join([f"{key} = ?" for key in data.keys()])
+    values = tuple(data.values())
+    if where_values:
+        values += tuple(where_values)
 
-        set_clause = ', '.join([f"{key} = ?" for key in data.keys()])
-        values = tuple(data.values())
+    def _update(conn):
+        cursor = conn.execute(f"UPDATE {table_name} SET {set_clause} WHERE {where_clause}", values)
+        return cursor.rowcount  # 返回更新的行数
 
-        try:
-            if where_values:
-              cursor.execute(f"UPDATE {table_name} SET {set_clause} WHERE {where_clause}", values + tuple(where_values))
-            else:
-              cursor.execute(f"UPDATE {table_name} SET {set_clause} WHERE {where_clause}", values )
-            conn.commit()
-            return cursor.rowcount  # 返回更新的行数
-        except sqlite3.Error as e:
-            print(f"Error updating data in {table_name}: {e}")
-            return None
-        finally:
-            close_db_connection(conn)
+    try:
+        return execute_write(_update)
+    except sqlite3.Error as e:
+        logger.error(f"Error updating data in {table_name}: {e}")
+        return None
 
 def delete_data(table_name, where_clause, where_values = None):
     """删除数据"""
-    with db_lock:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+    values = tuple(where_values) if where_values else ()
+
+    def _delete(conn):
+        cursor = conn.execute(f"DELETE FROM {table_name} WHERE {where_clause}", values)
+        return cursor.rowcount  # 返回删除的行数
+
+    try:
+        return execute_write(_delete)
+    except sqlite3.Error as e:
+        logger.error(f"Error deleting data from {table_name}: {e}")
+        return None
 
-        try:
-            if where_values:
-                cursor.execute(f"DELETE FROM {table_name} WHERE {where_clause}", tuple(where_values))
-            else:
-                cursor.execute(f"DELETE FROM {table_name} WHERE {where_clause}")
-            conn.commit()
-            return cursor.rowcount  # 返回删除的行数
-        except sqlite3.Error as e:
-            print(f"Error deleting data from {table_name}: {e}")
-            return None
-        finally:
-            close_db_connection(conn)
-        
 # 示例用法 (可选)
 if __name__ == "__main__":
-    create_tables()
\ No newline at end of file
+    create_tables()
@@ -0,0 +1,229 @@
+import threading
+from config import settings
+from app.utils.db_utils import db_connection
+from app.utils.logger import logger
+
+# 需要安装的模块：无
+
+_leaderboard = None
+
+
+class Leaderboard:
+    """
+    积分排行榜
+
+    在内存中维护积分前 K 名（按积分降序、用户 ID 升序），积分变动时增量更新，
+    无法增量确定结果时（例如前 K 名中的用户积分下降到榜外）标记为失效，下次查询时用 score 索引重新加载。
+    超出前 K 名的分页和排名查询直接走 score 索引。
+    每次更新带有版本号（积分流水 ID，按提交顺序递增），比加载时或该用户已应用的版本旧的更新直接丢弃，
+    因此调用方在各自线程中更新排行榜的先后顺序不会导致旧积分覆盖新积分。
+    """
+
+    def __init__(self, size=None):
+        """
+        初始化排行榜
+        Args:
+            size: 内存中保存的排行榜长度
+        """
+        self.size = size if size is not None else settings.LEADERBOARD_SIZE
+        self._entries = []  # 按 _key 升序排列的用户列表
+        self._loaded = False
+        self._complete = False  # 用户总数不足 size 时，内存中即为全部用户
+        self._load_version = 0  # 加载时的最大流水 ID，之前的积分变动已包含在加载结果中
+        self._versions = {}  # 用户 ID -> 加载之后已应用的最新版本号
+        self._lock = threading.Lock()
+        self._stats = {"loads": 0, "updates": 0, "invalidations": 0, "memory_hits": 0, "db_queries": 0,
+                       "stale": 0}
+
+    @staticmethod
+    def _key(entry):
+        """排序键，越小排名越靠前"""
+        return -entry["score"], entry["user_id"]
+
+    def _load(self):
+        """从数据库加载前 K 名，调用方需持有锁"""
+        with db_connection() as conn:
+            # 先读取版本号再读取积分：版本号之前提交的变动一定包含在积分中
+            load_version = conn.execute("SELECT COALESCE(MAX(id), 0) FROM ScoreLedger").fetchone()[0]
+            rows = conn.execute(
+                "SELECT id, telegram_id, username, score FROM Users ORDER BY score DESC, id ASC LIMIT ?",
+                (self.size,)
+            ).fetchall()
+        self._load_version = load_version
+        self._versions = {}
+        self._entries = [{"user_id": row["id"], "telegram_id": row["telegram_id"], "username": row["username"],
+                          "score": row["score"]} for row in rows]
+        self._complete = len(self._entries) < self.size
+        self._loaded = True
+        self._stats["loads"] += 1
+        logger.debug(f"加载积分排行榜: count={len(self._entries)}")
+
+    def _find(self, user_id):
+        """查找用户在内存排行榜中的位置"""
+        for index, entry in enumerate(self._entries):
+            if entry["user_id"] == user_id:
+                return index
+        return None
+
+    def _insert(self, entry):
+        """按排序键插入用户"""
+        key = self._key(entry)
+        index = len(self._entries)
+        for i, other in enumerate(self._entries):
+            if key < self._key(other):
+                index = i
+                break
+        self._entries.insert(index, entry)
+
+    def update_score(self, user_id, score, telegram_id=None, username=None, version=None):
+        """
+        用户积分变动后增量更新排行榜
+        Args:
+            user_id: 用户 ID
+            score: 变动后的积分
+            telegram_id: 用户 Telegram ID，用户不在榜上时用于入榜
+            username: 用户名，用户不在榜上时用于入榜
+            version: 积分版本号（积分流水 ID），None 表示无法确定版本，直接标记失效
+        """
+        with self._lock:
+            if not self._loaded:
+                return
+            if version is None:
+                self._invalidate()
+                return
+            if version <= max(self._load_version, self._versions.get(user_id, 0)):
+                self._stats["stale"] += 1
+                return
+            self._versions[user_id] = version
+            self._stats["updates"] += 1
+            index = self._find(user_id)
+            last_key = self._key(self._entries[-1]) if self._entries else None
+
+            if index is not None:
+                entry = self._entries.pop(index)
+                entry["score"] = score
+                if username is not None:
+                    entry["username"] = username
+                if not self._complete and self._key(entry) > last_key:
+                    # 积分下降到原最后一名之后，榜外用户可能排在它前面
+                    self._invalidate()
+                    return
+                self._insert(entry)
+                return
+
+            entry = {"user_id": user_id, "telegram_id": telegram_id, "username": username, "score": score}
+            if not self._complete and self._key(entry) > last_key:
+                return  # 仍在榜外
+            if telegram_id is None:
+                self._invalidate()  # 缺少用户信息，无法入榜
+                return
+            self._insert(entry)
+            if len(self._entries) > self.size:
+                self._entries.pop()
+                self._complete = False
+
+    def update_profile(self, user_id, username):
+        """用户名变动后更新排行榜中的用户名，不修改积分"""
+        with self._lock:
+            if not self._loaded:
+                return
+            index = self._find(user_id)
+            if index is not None and username is not None:
+                self._entries[index]["username"] = username
+
+    def remove(self, user_id):
+        """用户删除后从排行榜移除"""
+        with self._lock:
+            if not self._loaded:
+                return
+            index = self._find(user_id)
+            if index is None:
+                return
+            self._entries.pop(index)
+            if not self._complete:
+                self._invalidate()  # 需要从榜外补位
+
+    def _invalidate(self):
+        """标记排行榜失效，调用方需持有锁"""
+        self._loaded = False
+        self._stats["invalidations"] += 1
+
+    def invalidate(self):
+        """标记排行榜失效，用于批量修改积分之后"""
+        with self._lock:
+            self._invalidate()
+
+    def get_page(self, offset=0, limit=10):
+        """
+        分页获取排行榜
+        Args:
+            offset: 跳过的用户数量
+            limit: 返回的用户数量
+        Returns:
+            [{"rank", "user_id", "telegram_id", "username", "score"}] 列表
+        """
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            if offset + limit <= len(self._entries) or self._complete:
+                self._stats["memory_hits"] += 1
+                entries = self._entries[offset:offset + limit]
+                return [dict(entry, rank=offset + i + 1) for i, entry in enumerate(entries)]
+
+        self._stats["db_queries"] += 1
+        with db_connection() as conn:
+            rows = conn.execute(
+                "SELECT id, telegram_id, username, score FROM Users ORDER BY score DESC, id ASC LIMIT ? OFFSET ?",
+                (limit, offset)
+            ).fetchall()
+        return [{"rank": offset + i + 1, "user_id": row["id"], "telegram_id": row["telegram_id"],
+                 "username": row["username"], "score": row["score"]} for i, row in enumerate(rows)]
+
+    def get_rank(self, user_id):
+        """
+        获取用户排名
+        Returns:
+            排名（从 1 开始），用户不存在时返回 None
+        """
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            index = self._find(user_id)
+            if index is not None:
+                self._stats["memory_hits"] += 1
+                return index + 1
+
+        self._stats["db_queries"] += 1
+        with db_connection() as conn:
+            row = conn.execute("SELECT score FROM Users WHERE id = ?", (user_id,)).fetchone()
+            if not row:
+                return None
+            count = conn.execute(
+                "SELECT COUNT(*) FROM Users WHERE score > ? OR (score = ? AND id < ?)",
+                (row["score"], row["score"], user_id)
+            ).fetchone()[0]
+        return count + 1
+
+    def get_stats(self):
+        """获取排行榜统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+            stats["loaded"] = self._loaded
+        return stats
+
+
+def create_leaderboard():
+    """创建排行榜实例，并赋值给全局变量_leaderboard"""
+    global _leaderboard
+    if not _leaderboard:
+        _leaderboard = Leaderboard()
+    return _leaderboard
+
+
+def get_leaderboard():
+    """获取 Leaderboard 实例"""
+    global _leaderboard
+    if not _leaderboard:
+        _leaderboard = create_leaderboard()
+    return _leaderboard
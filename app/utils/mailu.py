@@ -1,5 +1,6 @@
 import requests
 from config import settings
+from app.utils.api_clients.transport import HTTPTransport
 from app.utils.logger import logger
 
 _mailu = None
@@ -11,7 +12,7 @@ class MailuClient:
     def __init__(self):
         self.mailu_url = settings.MAILU_URL
         self.mailu_token = settings.MAILU_TOKEN
-        self.session = requests.Session()
+        self.session = HTTPTransport("mailu")
         self.session.headers.update({"Authorization": f"{self.mailu_token}"})
     
     def _make_request(self, method, endpoint, params=None, data=None, headers=None):
@@ -20,6 +21,7 @@ class MailuClient:
         self.session.headers.update({"Content-Type": "application/json"})
         self.session.headers.update({"User-Agent": "Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.1 (KHTML, like Gecko) Chrome/22.0.1207.1 Safari/537.1"})
         
+        response = None
         try:
             response = self.session.request(method, url, params=params, json=data, headers=headers)
             # logger.debug(f"code: {response.status_code}, data: {response.json()}")
@@ -28,7 +30,7 @@ class MailuClient:
             else:
                 raise requests.exceptions.RequestException
         except requests.exceptions.RequestException as e:
-            if response.status_code == 409:
+            if response is not None and response.status_code == 409:
                 logger.warning(f"user is duplicate.")
                 return {"status": "duplicate", "message": response.json()['message']}
             logger.error(f"Mailu API 请求失败: {e}")
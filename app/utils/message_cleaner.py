@@ -1,35 +1,98 @@
+from itertools import zip_longest
 from app.utils.scheduler import get_scheduler
 from app.utils.logger import logger
 from app.utils.message_queue import get_message_queue
+from app.utils.rate_limiter import get_rate_limiter
 import telebot
 from app.bot.core.bot_instance import bot
 from config import settings
 # 需要安装的模块：无
 
+DELETE_BATCH_SIZE = 100  # Telegram deleteMessages 单次最多 100 条消息
+MAX_RETRY_DELAY = 300  # 失败重试的最大间隔（秒）
+
 class MessageCleaner:
     """
     消息清理器
+
+    到期的消息按聊天分成每批最多 100 条，各聊天的批次轮流发送，每批消耗一个共享令牌桶的令牌。
+    令牌不足的批次放回队列下一轮再删除；429 按 retry_after 暂停令牌桶并放回队列，
+    其他临时错误按指数退避重试，超过 MESSAGE_DELETE_MAX_RETRIES 次后放弃。
     """
 
     def __init__(self):
         self.scheduler = get_scheduler()
         self.bot = bot
         self.message_queue = get_message_queue()
+        self.rate_limiter = get_rate_limiter("delete_messages", settings.MESSAGE_DELETE_RATE)
+        self._attempts = {}  # (chat_id, message_id) -> 已失败次数
     
     def _clean_messages(self):
       """清理消息"""
 
       messages_to_delete = self.message_queue.get_messages_to_delete()
-      for chat_id, message_ids in messages_to_delete.items():
-          try:
-            self.bot.delete_messages(chat_id=chat_id, message_ids=message_ids)
-            logger.debug(f"定时清理消息成功, chat_id={chat_id}, message_id={message_ids}")
-          except telebot.apihelper.ApiTelegramException as e:
-            logger.warning(f"定时清理消息失败: chat_id={chat_id}, message_id={message_ids}, error={e}")
+      batches = [
+          [(chat_id, message_ids[i:i + DELETE_BATCH_SIZE]) for i in range(0, len(message_ids), DELETE_BATCH_SIZE)]
+          for chat_id, message_ids in messages_to_delete.items()
+      ]
+      # 各聊天的批次交替排列，避免一个聊天的大量消息占满本轮的令牌
+      for round_batches in zip_longest(*batches):
+          for batch in round_batches:
+              if batch is None:
+                  continue
+              chat_id, message_ids = batch
+              if not self.rate_limiter.try_acquire():
+                  self.message_queue.requeue(chat_id, message_ids, 0)
+                  continue
+              self._delete_batch(chat_id, message_ids)
+      self.message_queue.flush()
+
+    def _delete_batch(self, chat_id, message_ids):
+      """删除一批消息，失败时放回队列"""
+      try:
+        self.bot.delete_messages(chat_id=chat_id, message_ids=message_ids)
+        logger.debug(f"定时清理消息成功, chat_id={chat_id}, message_id={message_ids}")
+        self._forget(chat_id, message_ids)
+      except telebot.apihelper.ApiTelegramException as e:
+        if e.error_code == 429:
+          retry_after = (e.result_json.get("parameters") or {}).get("retry_after", 1)
+          self.rate_limiter.pause(retry_after)
+          self.message_queue.requeue(chat_id, message_ids, retry_after)
+          logger.warning(f"定时清理消息被限流: chat_id={chat_id}, count={len(message_ids)}, retry_after={retry_after}")
+        elif e.error_code >= 500:
+          self._retry(chat_id, message_ids, e)
+        else:
+          # 消息不存在、没有权限等，重试也不会成功
+          self._forget(chat_id, message_ids)
+          logger.warning(f"定时清理消息失败: chat_id={chat_id}, message_id={message_ids}, error={e}")
+      except Exception as e:
+        self._retry(chat_id, message_ids, e)
+
+    def _retry(self, chat_id, message_ids, error):
+      """按指数退避放回队列，超过最大重试次数时放弃"""
+      attempt = max(self._attempts.get((chat_id, message_id), 0) for message_id in message_ids) + 1
+      if attempt > settings.MESSAGE_DELETE_MAX_RETRIES:
+        self._forget(chat_id, message_ids)
+        logger.error(f"定时清理消息失败，放弃重试: chat_id={chat_id}, message_id={message_ids}, error={error}")
+        return
+      for message_id in message_ids:
+        self._attempts[(chat_id, message_id)] = attempt
+      delay = min(settings.DELAY_INTERVAL * 2 ** attempt, MAX_RETRY_DELAY)
+      self.message_queue.requeue(chat_id, message_ids, delay)
+      logger.warning(f"定时清理消息失败，{delay} 秒后重试: chat_id={chat_id}, count={len(message_ids)}, attempt={attempt}, error={error}")
+
+    def _forget(self, chat_id, message_ids):
+      """清除重试记录"""
+      if self._attempts:
+        for message_id in message_ids:
+          self._attempts.pop((chat_id, message_id), None)
             
     
     def start(self):
-      """启动定时清理任务"""
+      """启动定时清理任务，需要在数据库迁移之后调用"""
+      # 恢复重启前未删除的消息，并立即清理其中已过期的消息
+      self.message_queue.restore()
+      self._clean_messages()
       self.scheduler.add_job(job_name="clean_message", interval=settings.DELAY_INTERVAL, job_func=self._clean_messages)
       logger.info("启动消息清理器")
     
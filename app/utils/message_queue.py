@@ -1,5 +1,11 @@
+import atexit
+import heapq
+import itertools
+import threading
+import time
+from app.utils.db_utils import db_connection, submit_write
 from app.utils.logger import logger
-from datetime import datetime, timedelta
+from datetime import datetime
 from config import settings
 # 需要安装的模块：无
 
@@ -7,62 +13,201 @@ from config import settings
 class Message:
     def __init__(self, chat_id, message_id, delay=settings.DELAY_INTERVAL, create_time=None):
         self.chat_id = chat_id
-        # if isinstance(message_id, str):
-        #     self.message_id = list(message_id)
-        # self.message_id = message_id
+        self.message_id = message_id
         self.delay = delay
         self.create_time = create_time if create_time else datetime.now()
-        
+        self.created_at = time.monotonic()
+        self.deadline = self.created_at + delay  # 到期时间（单调时钟），不受系统时间调整影响
+        self.delete_at = time.time() + delay  # 到期时间（时间戳），持久化后用于重启恢复
+
 _message_queue = None
 
 class MessageQueue:
     """
     消息队列
+
+    待删除消息按到期时间放入最小堆，每次只弹出已到期的消息，取出代价为 O(到期数量 · log n)。
+    同一条消息重复添加时以最后一次为准，堆中旧的条目在弹出时跳过。
+    队列变更先记录在内存中，由清理任务或积累到 MESSAGE_QUEUE_FLUSH_SIZE 条时批量写入 PendingDeletions 表（write-behind），
+    不阻塞发送消息的流程；MessageCleaner 启动时（数据库迁移之后）调用 restore() 从表中恢复，
+    已过期的消息在第一次清理时删除。创建队列时不访问数据库。
     """
 
     def __init__(self):
-        self.messages = {}
+        self._heap = []  # (到期时间, 序号, Message)
+        self._pending = {}  # (chat_id, message_id) -> Message
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._dirty = {}  # 未写入数据库的变更：(chat_id, message_id) -> 删除时间戳，None 表示从表中删除
+        self._stats = {"added": 0, "deduplicated": 0, "drained": 0, "removed": 0, "total_lateness": 0.0,
+                       "max_lateness": 0.0, "requeued": 0, "restored": 0, "flushes": 0, "flush_errors": 0}
 
     def add_message(self, message, delay=settings.DELAY_INTERVAL):
         """添加待删除的消息"""
         if not settings.ENABLE_MESSAGE_CLEANER:
           logger.debug("清除消息已经关闭")
           return
-        
+
         chat_id = message.chat.id
-        message_id = message.message_id 
-        if chat_id not in self.messages:
-            self.messages[chat_id] = {}
-        self.messages[chat_id][message_id] =  Message(chat_id=chat_id, message_id=message_id, delay=delay)
+        message_id = message.message_id
+        item = Message(chat_id=chat_id, message_id=message_id, delay=delay)
+        with self._lock:
+            if (chat_id, message_id) in self._pending:
+                self._stats["deduplicated"] += 1
+            self._pending[(chat_id, message_id)] = item
+            heapq.heappush(self._heap, (item.deadline, next(self._seq), item))
+            self._dirty[(chat_id, message_id)] = item.delete_at
+            self._stats["added"] += 1
+            self._compact()
+            need_flush = len(self._dirty) >= settings.MESSAGE_QUEUE_FLUSH_SIZE
+        if need_flush:
+            self.flush()
         logger.debug(f"添加待删除的消息, chat_id={chat_id}, message_id={message_id}, delay={delay}")
-    
+
+    def remove_message(self, chat_id, message_id):
+        """取消删除消息"""
+        with self._lock:
+            if self._pending.pop((chat_id, message_id), None):
+                self._dirty[(chat_id, message_id)] = None
+                self._stats["removed"] += 1
+                self._compact()
+
+    def requeue(self, chat_id, message_ids, delay):
+        """
+        重新加入删除失败的消息
+        Args:
+            chat_id: 聊天 ID
+            message_ids: 消息 ID 列表
+            delay: 多少秒后重试
+        """
+        with self._lock:
+            for message_id in message_ids:
+                key = (chat_id, message_id)
+                if key in self._pending:
+                    continue  # 期间重新添加过，以新的为准
+                item = Message(chat_id=chat_id, message_id=message_id, delay=delay)
+                self._pending[key] = item
+                heapq.heappush(self._heap, (item.deadline, next(self._seq), item))
+                self._dirty[key] = item.delete_at
+            self._stats["requeued"] += len(message_ids)
+        logger.debug(f"重新加入待删除的消息, chat_id={chat_id}, count={len(message_ids)}, delay={delay}")
+
+    def _compact(self):
+        """堆中失效条目过多时重建堆，调用方需持有锁"""
+        if len(self._heap) > 2 * len(self._pending) + 64:
+            self._heap = [entry for entry in self._heap if self._pending.get((entry[2].chat_id, entry[2].message_id)) is entry[2]]
+            heapq.heapify(self._heap)
+
     def get_messages_to_delete(self):
         """获取需要删除的消息"""
         messages_to_delete = {}
-        for chat_id, msgs in list(self.messages.items()):
-          for message_id, message in list(msgs.items()):
-            if (datetime.now() - message.create_time) > timedelta(seconds = message.delay):
-               if chat_id not in messages_to_delete:
-                 messages_to_delete[chat_id] = []
-               messages_to_delete[chat_id].append(message_id)
-               del self.messages[chat_id][message_id]
-
-          if not msgs:
-            del self.messages[chat_id]
+        now = time.monotonic()
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, _, item = heapq.heappop(self._heap)
+                key = (item.chat_id, item.message_id)
+                if self._pending.get(key) is not item:
+                    continue  # 已被重新添加或取消
+                del self._pending[key]
+                self._dirty[key] = None
+                messages_to_delete.setdefault(item.chat_id, []).append(item.message_id)
+                lateness = now - item.deadline
+                self._stats["drained"] += 1
+                self._stats["total_lateness"] += lateness
+                self._stats["max_lateness"] = max(self._stats["max_lateness"], lateness)
         return messages_to_delete
-    
+
+    def flush(self, wait=False):
+        """
+        将内存中的变更批量写入数据库
+        Args:
+            wait: 是否等待写入完成
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, {}
+        upserts = [(chat_id, message_id, delete_at) for (chat_id, message_id), delete_at in dirty.items()
+                   if delete_at is not None]
+        deletes = [key for key, delete_at in dirty.items() if delete_at is None]
+
+        def _flush(conn):
+            conn.executemany("INSERT OR REPLACE INTO PendingDeletions (chat_id, message_id, delete_at) VALUES (?, ?, ?)",
+                             upserts)
+            conn.executemany("DELETE FROM PendingDeletions WHERE chat_id = ? AND message_id = ?", deletes)
+
+        def _done(future):
+            if future.exception():
+                logger.error(f"待删除消息写入数据库失败: count={len(dirty)}, error={future.exception()}")
+                with self._lock:
+                    self._stats["flush_errors"] += 1
+                    # 写入失败时放回，期间的新变更优先
+                    for key, delete_at in dirty.items():
+                        self._dirty.setdefault(key, delete_at)
+            else:
+                with self._lock:
+                    self._stats["flushes"] += 1
+                logger.debug(f"待删除消息写入数据库: upserts={len(upserts)}, deletes={len(deletes)}")
+
+        future = submit_write(_flush)
+        future.add_done_callback(_done)
+        if wait:
+            future.exception()
+
+    def restore(self):
+        """
+        从数据库恢复待删除的消息，已过期的消息立即到期
+        Returns:
+            恢复的消息数量
+        """
+        with db_connection() as conn:
+            rows = conn.execute("SELECT chat_id, message_id, delete_at FROM PendingDeletions").fetchall()
+        now = time.time()
+        with self._lock:
+            for row in rows:
+                key = (row["chat_id"], row["message_id"])
+                if key in self._pending:
+                    continue
+                item = Message(chat_id=row["chat_id"], message_id=row["message_id"], delay=max(0.0, row["delete_at"] - now))
+                item.delete_at = row["delete_at"]
+                self._pending[key] = item
+                heapq.heappush(self._heap, (item.deadline, next(self._seq), item))
+            self._stats["restored"] += len(rows)
+        logger.info(f"恢复待删除的消息: count={len(rows)}")
+        return len(rows)
+
+    def get_stats(self):
+        """
+        获取队列统计信息
+        Returns:
+            包含待删除数量、最早消息的等待时间、下一条消息的到期时间和删除延迟的字典
+        """
+        now = time.monotonic()
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._pending)
+            stats["heap_size"] = len(self._heap)
+            stats["oldest_age"] = max((now - item.created_at for item in self._pending.values()), default=0.0)
+            stats["next_due_in"] = self._heap[0][0] - now if self._heap else None
+        stats["avg_lateness"] = stats["total_lateness"] / stats["drained"] if stats["drained"] else 0.0
+        return stats
+
     def close(self):
         """清空消息列表"""
         global _message_queue
-        self.messages = None
+        self.flush(wait=True)
+        with self._lock:
+            self._heap = []
+            self._pending = {}
         _message_queue = None
         logger.info("消息队列已关闭")
-     
+
 def create_message_queue():
     """创建MessageQueue实例"""
     global _message_queue
     if not _message_queue:
        _message_queue = MessageQueue()
+       atexit.register(_message_queue.flush, wait=True)
     return _message_queue
 
 def get_message_queue():
@@ -70,4 +215,4 @@ def get_message_queue():
     global _message_queue
     if not _message_queue:
       _message_queue = create_message_queue()
-    return _message_queue
\ No newline at end of file
+    return _message_queue
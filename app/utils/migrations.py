@@ -0,0 +1,324 @@
+import sqlite3
+from contextlib import closing
+from app.utils.db_utils import db_connection, execute_write, format_utc_datetime
+from app.utils.logger import logger
+from config import settings
+
+# 需要安装的模块：无
+
+
+def _get_columns(conn, table_name):
+    """获取表的所有列名"""
+    return {row["name"] for row in conn.execute(f"PRAGMA table_info({table_name})").fetchall()}
+
+
+def _migrate_legacy_schema(conn):
+    """
+    旧版本数据库结构升级（原 migrate_db.py）
+
+    旧版 Users 表使用 navidrome_user_id 字段，旧版 InviteCodes 表没有 type 字段，
+    检测到旧结构时重建表并复制数据，新建的数据库不做任何处理。
+    """
+    # 重命名表时不改写其他表中的外键引用，避免 InviteCodes 的外键指向被删除的 Users_old
+    conn.execute("PRAGMA legacy_alter_table = ON")
+    if "navidrome_user_id" in _get_columns(conn, "Users"):
+        logger.info("检测到旧版 Users 表结构，开始升级")
+        conn.execute("ALTER TABLE Users RENAME TO Users_old")
+        conn.execute("""
+            CREATE TABLE Users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                telegram_id INTEGER UNIQUE NOT NULL,
+                service_type TEXT NOT NULL,
+                username TEXT,
+                service_user_id TEXT,
+                score INTEGER DEFAULT 0,
+                invite_code TEXT,
+                service_name TEXT,
+                status TEXT DEFAULT 'active',
+                expiration_date DATETIME DEFAULT NULL,
+                last_sign_in_date DATETIME,
+                create_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(telegram_id, service_type)
+            )
+        """)
+        conn.execute("""
+            INSERT INTO Users (
+                id, telegram_id, service_type, username,
+                service_user_id, score, invite_code,
+                service_name, status, expiration_date, last_sign_in_date
+            )
+            SELECT
+                id, telegram_id, 'navidrome', username,  -- 设置默认值为 'navidrome'
+                navidrome_user_id, score, invite_code,
+                service_name, 'active', NULL, last_sign_in_date  -- 设置 expiration_date 为 NULL
+            FROM Users_old
+        """)
+        conn.execute("DROP TABLE Users_old")
+
+    if "type" not in _get_columns(conn, "InviteCodes"):
+        logger.info("检测到旧版 InviteCodes 表结构，开始升级")
+        conn.execute("ALTER TABLE InviteCodes RENAME TO InviteCodes_old")
+        conn.execute("""
+            CREATE TABLE InviteCodes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                code TEXT UNIQUE NOT NULL,
+                is_used BOOLEAN DEFAULT FALSE,
+                user_id INTEGER,
+                type TEXT NOT NULL CHECK(type IN ('invite', 'renew')),
+                create_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+                expire_days INTEGER NOT NULL,
+                expire_time DATETIME,
+                create_user_id INTEGER NOT NULL,
+                FOREIGN KEY (user_id) REFERENCES Users(id)
+            )
+        """)
+        conn.execute("""
+            INSERT INTO InviteCodes (
+                id, code, is_used, user_id, type,
+                expire_days, create_time, expire_time, create_user_id
+            )
+            SELECT
+                id, code, is_used, user_id, 'invite', -- 分配默认值
+                30, -- 设定默认的过期期限天数
+                create_time, expire_time, create_user_id
+            FROM InviteCodes_old
+        """)
+        conn.execute("DROP TABLE InviteCodes_old")
+    conn.execute("PRAGMA legacy_alter_table = OFF")
+
+
+def _create_lookup_indexes(conn):
+    """为常用查询字段创建索引"""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_service_user_id ON Users(service_user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON Users(username)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_status ON Users(status)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_last_sign_in_date ON Users(last_sign_in_date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_create_time ON Users(create_time)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_invite_codes_is_used_type ON InviteCodes(is_used, type)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_random_score_events_is_finished ON RandomScoreEvents(is_finished)")
+
+
+def _normalize_sign_in_dates(conn):
+    """将 last_sign_in_date 统一转换为 UTC 时间字符串，使签到时间可以按范围查询"""
+    rows = conn.execute("SELECT id, last_sign_in_date FROM Users WHERE last_sign_in_date IS NOT NULL").fetchall()
+    params = []
+    for row in rows:
+        try:
+            value = format_utc_datetime(row["last_sign_in_date"])
+        except ValueError:
+            logger.warning(f"无法解析签到时间，已清空: id={row['id']}, last_sign_in_date={row['last_sign_in_date']}")
+            value = None
+        if value != row["last_sign_in_date"]:
+            params.append((value, row["id"]))
+    conn.executemany("UPDATE Users SET last_sign_in_date = ? WHERE id = ?", params)
+    logger.info(f"签到时间已转换为 UTC: count={len(params)}")
+
+
+
+def _create_score_ledger(conn):
+    """创建积分流水表和余额快照表，并为现有余额保存初始快照"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ScoreLedger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            delta INTEGER NOT NULL,
+            balance INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            ref_id TEXT,
+            create_time DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_score_ledger_user_id ON ScoreLedger(user_id, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_score_ledger_create_time ON ScoreLedger(create_time)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ScoreSnapshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            score INTEGER NOT NULL,
+            ledger_id INTEGER NOT NULL,
+            snapshot_time DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_score_snapshots_user_id ON ScoreSnapshots(user_id, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_score_snapshots_snapshot_time ON ScoreSnapshots(snapshot_time)")
+    if not conn.execute("SELECT 1 FROM ScoreSnapshots LIMIT 1").fetchone():
+        conn.execute("INSERT INTO ScoreSnapshots (user_id, score, ledger_id) SELECT id, score, 0 FROM Users")
+
+
+
+def _create_score_index(conn):
+    """为积分排行榜创建索引"""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_score ON Users(score DESC, id)")
+
+
+def _create_pending_deletions(conn):
+    """创建待删除消息表，重启后恢复自动删除任务"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS PendingDeletions (
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            delete_at REAL NOT NULL,
+            PRIMARY KEY (chat_id, message_id)
+        )
+    """)
+
+
+def _create_broadcast_tables(conn):
+    """创建群发任务表和不可达聊天表"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS BroadcastJobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            parse_mode TEXT,
+            service_type TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            sent_count INTEGER NOT NULL DEFAULT 0,
+            failed_count INTEGER NOT NULL DEFAULT 0,
+            blocked_count INTEGER NOT NULL DEFAULT 0,
+            create_user_id INTEGER,
+            create_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+            update_time DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status ON BroadcastJobs(status)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS BlockedChats (
+            chat_id INTEGER PRIMARY KEY,
+            reason TEXT,
+            create_time DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def _create_upstream_users(conn):
+    """创建上游服务用户镜像表"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS UpstreamUsers (
+            service_type TEXT NOT NULL,
+            service_user_id TEXT NOT NULL,
+            username TEXT,
+            is_admin INTEGER NOT NULL DEFAULT 0,
+            last_seen REAL,
+            fingerprint TEXT,
+            data TEXT,
+            sync_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (service_type, service_user_id)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_upstream_users_username ON UpstreamUsers(service_type, username)")
+
+
+def _create_api_tokens(conn):
+    """创建上游服务 token 表"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ApiTokens (
+            name TEXT PRIMARY KEY,
+            token TEXT NOT NULL,
+            expires_at REAL,
+            update_time DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+# 迁移列表：(版本号, 描述, 迁移函数)，版本号必须递增，迁移函数必须可重复执行
+MIGRATIONS = [
+    (1, "旧版数据库结构升级", _migrate_legacy_schema),
+    (2, "为常用查询字段创建索引", _create_lookup_indexes),
+    (3, "签到时间统一转换为 UTC", _normalize_sign_in_dates),
+    (4, "创建积分流水表和余额快照表", _create_score_ledger),
+    (5, "为积分排行榜创建索引", _create_score_index),
+    (6, "创建待删除消息表", _create_pending_deletions),
+    (7, "创建群发任务表和不可达聊天表", _create_broadcast_tables),
+    (8, "创建上游服务用户镜像表", _create_upstream_users),
+    (9, "创建上游服务 token 表", _create_api_tokens),
+]
+
+# 热点查询：名称 -> (SQL, 参数)，启动时通过 EXPLAIN QUERY PLAN 检查是否走索引
+HOT_QUERIES = {
+    "Users.telegram_id": ("SELECT * FROM Users WHERE telegram_id = ? AND service_type = ?", (0, "")),
+    "Users.service_user_id": ("SELECT * FROM Users WHERE service_user_id = ?", ("",)),
+    "Users.username": ("SELECT * FROM Users WHERE username = ?", ("",)),
+    "Users.status": ("SELECT * FROM Users WHERE status = ?", ("",)),
+    "Users.last_sign_in_date": ("SELECT id FROM Users WHERE last_sign_in_date >= ? AND last_sign_in_date < ?", ("", "")),
+    "Users.create_time": ("SELECT * FROM Users WHERE create_time >= ? AND create_time < ? "
+                          "AND (create_time > ? OR (create_time = ? AND id > ?)) ORDER BY create_time, id LIMIT ?",
+                          ("", "", "", "", 0, 1)),
+    "Users.score": ("SELECT id, telegram_id, username, score FROM Users ORDER BY score DESC, id ASC LIMIT ?", (10,)),
+    "Users.score_rank": ("SELECT COUNT(*) FROM Users WHERE score > ? OR (score = ? AND id < ?)", (0, 0, 0)),
+    "InviteCodes.code": ("SELECT * FROM InviteCodes WHERE code = ?", ("",)),
+    "InviteCodes.is_used": ("SELECT * FROM InviteCodes WHERE is_used = ?", (0,)),
+    "ScoreLedger.user_id": ("SELECT * FROM ScoreLedger WHERE user_id = ? ORDER BY id DESC LIMIT ?", (0, 20)),
+    "ScoreLedger.create_time": ("SELECT user_id, SUM(delta) FROM ScoreLedger WHERE create_time >= ? AND create_time < ? GROUP BY user_id", ("", "")),
+    "BroadcastJobs.status": ("SELECT * FROM BroadcastJobs WHERE status = ?", ("",)),
+    "RandomScoreEvents.is_finished": ("SELECT * FROM RandomScoreEvents WHERE is_finished = ?", (0,)),
+}
+
+
+def get_schema_version():
+    """获取当前数据库结构版本"""
+    with db_connection() as conn:
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'").fetchone():
+            return 0
+        row = conn.execute("SELECT MAX(version) AS version FROM schema_version").fetchone()
+    return row["version"] or 0
+
+
+def run_migrations():
+    """按版本顺序执行未应用的迁移，每个迁移在独立事务中执行"""
+    execute_write(lambda conn: conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_time DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+    current_version = get_schema_version()
+    pending = [migration for migration in MIGRATIONS if migration[0] > current_version]
+    if not pending:
+        logger.info(f"数据库结构已是最新版本: version={current_version}")
+        return current_version
+
+    for version, description, func in pending:
+        logger.info(f"执行数据库迁移: version={version}, description={description}")
+
+        def _apply(conn, version=version, description=description, func=func):
+            func(conn)
+            conn.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)", (version, description))
+
+        try:
+            execute_write(_apply)
+        except Exception as e:
+            logger.error(f"数据库迁移失败: version={version}, description={description}, error={e}")
+            raise
+        current_version = version
+
+    logger.info(f"数据库迁移完成: version={current_version}")
+    return current_version
+
+
+def check_query_plans(queries=None):
+    """
+    检查热点查询的执行计划，报告仍然全表扫描的查询
+
+    迁移在写线程的连接上执行，当前线程复用的连接可能还缓存着迁移前的表结构，
+    所以这里单独打开一个新连接读取最新的表结构和索引。
+    Args:
+        queries: 查询字典，默认为 HOT_QUERIES
+    Returns:
+        全表扫描的查询名称列表
+    """
+    queries = queries if queries is not None else HOT_QUERIES
+    scans = []
+    with closing(sqlite3.connect(settings.DATABASE_URL)) as conn:
+        conn.row_factory = sqlite3.Row
+        for name, (sql, params) in queries.items():
+            plan = [row["detail"] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+            if any(detail.startswith("SCAN") and "USING" not in detail for detail in plan):
+                scans.append(name)
+                logger.warning(f"查询未使用索引: name={name}, plan={plan}")
+            else:
+                logger.debug(f"查询使用索引: name={name}, plan={plan}")
+    if not scans:
+        logger.info(f"热点查询检查完成，全部使用索引: count={len(queries)}")
+    return scans
@@ -0,0 +1,131 @@
+import itertools
+from app.utils.cache import TTLCache, MISSING
+from app.utils.logger import logger
+from config import settings
+
+# 需要安装的模块：无
+
+_pagination_store = None
+
+
+class PageCursor:
+    """
+    分页游标：数据来源（已注册的查询名称或快照 ID）、查询参数和当前偏移量，不保存数据本身
+    """
+    __slots__ = ("query", "params", "snapshot_id", "offset", "page_size", "total")
+
+    def __init__(self, page_size, query=None, params=(), snapshot_id=None, total=0):
+        self.query = query
+        self.params = params
+        self.snapshot_id = snapshot_id
+        self.offset = 0
+        self.page_size = page_size
+        self.total = total
+
+    @property
+    def current_page(self):
+        return self.offset // self.page_size + 1
+
+    @property
+    def total_pages(self):
+        return max((self.total + self.page_size - 1) // self.page_size, 1)
+
+
+class PaginationStore:
+    """
+    分页状态存储
+
+    分页消息 (chat_id, message_id) -> PageCursor，按 LRU + TTL 淘汰。
+    数据来源有两种：register_query() 注册的查询，翻页时按偏移量从数据库读取当前页；
+    或者列表快照，保存在单独的 TTL 缓存中，快照的数量和长度都有上限。
+    """
+
+    def __init__(self, max_entries=None, ttl=None, max_snapshots=None, max_snapshot_items=None):
+        """
+        初始化分页状态存储
+        Args:
+            max_entries: 最多保存的分页状态数量
+            ttl: 分页状态和快照的有效期（秒）
+            max_snapshots: 最多保存的列表快照数量
+            max_snapshot_items: 单个快照最多保存的条目数量，超出部分丢弃
+        """
+        ttl = ttl or settings.PAGINATION_TTL
+        self.max_snapshot_items = max_snapshot_items or settings.PAGINATION_MAX_SNAPSHOT_ITEMS
+        self._cursors = TTLCache(maxsize=max_entries or settings.PAGINATION_MAX_ENTRIES, ttl=ttl)
+        self._snapshots = TTLCache(maxsize=max_snapshots or settings.PAGINATION_MAX_SNAPSHOTS, ttl=ttl)
+        self._queries = {}  # 查询名称 -> fetch(*params, offset=, limit=) -> (当前页条目, 总数)
+        self._snapshot_ids = itertools.count(1)
+
+    def register_query(self, name, fetch):
+        """
+        注册分页查询
+        Args:
+            name: 查询名称
+            fetch: 函数 fetch(*params, offset=, limit=)，返回 (当前页条目列表, 总条目数)，limit 为 0 时只需要返回总数
+        """
+        self._queries[name] = fetch
+
+    def open(self, source, page_size, params=()):
+        """
+        创建游标
+        Args:
+            source: 已注册的查询名称，或要分页的列表（保存为快照）
+            page_size: 每页条目数
+            params: 查询参数
+        """
+        if isinstance(source, str):
+            if source not in self._queries:
+                raise ValueError(f"分页查询未注册: {source}")
+            _, total = self._queries[source](*params, offset=0, limit=0)
+            return PageCursor(page_size, query=source, params=tuple(params), total=total)
+        items = list(source)
+        if len(items) > self.max_snapshot_items:
+            logger.warning(f"分页列表过长，只保留前 {self.max_snapshot_items} 项: size={len(items)}")
+            items = items[:self.max_snapshot_items]
+        snapshot_id = next(self._snapshot_ids)
+        self._snapshots.set(snapshot_id, items)
+        return PageCursor(page_size, snapshot_id=snapshot_id, total=len(items))
+
+    def fetch(self, cursor):
+        """
+        读取游标当前页的条目
+        Returns:
+            条目列表，快照已过期时返回 None
+        """
+        if cursor.query is not None:
+            items, cursor.total = self._queries[cursor.query](*cursor.params, offset=cursor.offset,
+                                                              limit=cursor.page_size)
+            return items
+        items = self._snapshots.get(cursor.snapshot_id)
+        if items is MISSING:
+            return None
+        return items[cursor.offset:cursor.offset + cursor.page_size]
+
+    def get(self, chat_id, message_id):
+        """获取分页消息的游标，不存在或已过期时返回 None"""
+        cursor = self._cursors.get((chat_id, message_id))
+        return None if cursor is MISSING else cursor
+
+    def put(self, chat_id, message_id, cursor):
+        """保存分页消息的游标"""
+        self._cursors.set((chat_id, message_id), cursor)
+
+    def get_stats(self):
+        """获取分页状态存储统计信息"""
+        return {"cursors": self._cursors.get_stats(), "snapshots": self._snapshots.get_stats()}
+
+
+def create_pagination_store():
+    """创建PaginationStore实例，并赋值给全局变量_pagination_store"""
+    global _pagination_store
+    if not _pagination_store:
+        _pagination_store = PaginationStore()
+    return _pagination_store
+
+
+def get_pagination_store():
+    """获取 PaginationStore 实例"""
+    global _pagination_store
+    if not _pagination_store:
+        _pagination_store = create_pagination_store()
+    return _pagination_store
@@ -0,0 +1,130 @@
+import threading
+import time
+
+# 需要安装的模块：无
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶
+
+    以 rate 个/秒的速度补充令牌，最多积累 capacity 个，每次调用消耗令牌，令牌不足时等待或直接返回失败。
+    pause() 用于服务端要求等待（例如 Telegram 返回 retry_after）时暂停发放令牌。
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        初始化令牌桶
+        Args:
+            rate: 每秒补充的令牌数量
+            capacity: 最多积累的令牌数量，默认等于 rate
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self._stats = {"acquired": 0, "rejected": 0, "wait_time": 0.0, "pauses": 0}
+
+    def _refill(self, now):
+        """补充令牌，调用方需持有锁"""
+        if now > self._updated_at:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+
+    def _wait_time(self, tokens, now):
+        """获取令牌还需等待的秒数，调用方需持有锁"""
+        if now < self._paused_until:
+            return self._paused_until - now
+        self._refill(now)
+        if self._tokens >= tokens:
+            return 0.0
+        return (tokens - self._tokens) / self.rate
+
+    def wait_time(self, tokens=1):
+        """获取令牌还需等待的秒数，不消耗令牌"""
+        with self._lock:
+            return self._wait_time(tokens, time.monotonic())
+
+    def try_acquire(self, tokens=1):
+        """
+        尝试获取令牌，不等待
+        Returns:
+            是否获取成功
+        """
+        with self._lock:
+            if self._wait_time(tokens, time.monotonic()) > 0:
+                self._stats["rejected"] += 1
+                return False
+            self._tokens -= tokens
+            self._stats["acquired"] += 1
+            return True
+
+    def acquire(self, tokens=1, timeout=None):
+        """
+        获取令牌，令牌不足时等待
+        Args:
+            tokens: 需要的令牌数量
+            timeout: 最长等待时间（秒），None 表示一直等待
+        Returns:
+            是否获取成功
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        start = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._wait_time(tokens, now)
+                if wait <= 0:
+                    self._tokens -= tokens
+                    self._stats["acquired"] += 1
+                    self._stats["wait_time"] += now - start
+                    return True
+                if deadline is not None and now + wait > deadline:
+                    self._stats["rejected"] += 1
+                    return False
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """在 seconds 秒内暂停发放令牌"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._stats["pauses"] += 1
+
+    def get_stats(self):
+        """获取令牌桶统计信息"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            stats = dict(self._stats)
+            stats["tokens"] = self._tokens
+            stats["paused_for"] = max(0.0, self._paused_until - now)
+        return stats
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name, rate=None, capacity=None):
+    """
+    获取指定名称的共享令牌桶，不存在时按 rate 和 capacity 创建
+    Args:
+        name: 令牌桶名称，同一名称的调用方共享限速
+        rate: 每秒补充的令牌数量，仅在创建时使用
+        capacity: 最多积累的令牌数量，仅在创建时使用
+    """
+    with _rate_limiters_lock:
+        if name not in _rate_limiters:
+            if rate is None:
+                raise ValueError(f"令牌桶不存在且未指定速率: {name}")
+            _rate_limiters[name] = TokenBucket(rate, capacity)
+        return _rate_limiters[name]
+
+
+def get_rate_limiter_stats():
+    """获取所有令牌桶的统计信息"""
+    with _rate_limiters_lock:
+        limiters = dict(_rate_limiters)
+    return {name: limiter.get_stats() for name, limiter in limiters.items()}
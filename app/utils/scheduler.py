@@ -1,21 +1,57 @@
-import schedule
+import heapq
+import itertools
 import time
-import uuid
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from app.utils.logger import logger
+from app.utils.timing_wheel import TimingWheel
+from config import settings
 
-# 需要安装的模块：schedule
-# pip install schedule
+# 需要安装的模块：无
 
 _scheduler = None
+
+
+class Job:
+    """
+    定时任务
+    """
+    def __init__(self, name, interval, func, args=None):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.args = args
+        self.next_run = time.monotonic() + interval  # 下次执行时间（单调时钟）
+        self.running = False
+        self.cancelled = False
+        self.stats = {"runs": 0, "failures": 0, "overlaps": 0, "total_time": 0.0, "max_time": 0.0, "last_time": 0.0,
+                      "total_lag": 0.0, "max_lag": 0.0}
+
+
 class Scheduler:
     """
     定时任务管理
+
+    任务按下次执行时间放入最小堆，调度线程通过条件变量等待到最近的执行时间或新任务加入，
+    到期的任务交给线程池执行，慢任务不会阻塞其他任务。
+    同一个任务上一次还没执行完时跳过本次执行，不会重叠运行。
+    延迟执行的一次性任务放在时间轮中，添加和取消都是 O(1)，不占用定时任务表。
     """
-    def __init__(self):
+    def __init__(self, max_workers=None):
         self.jobs = {}
         self.scheduler_thread = None
-    
+        self._heap = []  # (下次执行时间, 序号, Job)
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or settings.SCHEDULER_WORKERS,
+                                            thread_name_prefix="scheduler-worker")
+        self.timers = TimingWheel(executor=self._executor)
+
+    def _push(self, job):
+        """将任务放入堆中并唤醒调度线程，调用方需持有锁"""
+        heapq.heappush(self._heap, (job.next_run, next(self._seq), job))
+        self._condition.notify()
+
     def add_job(self, job_name, interval, job_func, args=None):
         """
         添加一个定时任务
@@ -25,15 +61,15 @@ class Scheduler:
           job_func: 需要执行的函数
           args: 函数需要的参数
         """
-        if job_name in self.jobs:
-          logger.warning(f"定时任务已存在，不能重复添加: job_name={job_name}")
-          return
-        schedule_job = schedule.every(interval).seconds
-        
-        schedule_job.do(self._safe_run, job_func, args)
-        self.jobs[job_name] = schedule_job
+        with self._condition:
+            if job_name in self.jobs:
+              logger.warning(f"定时任务已存在，不能重复添加: job_name={job_name}")
+              return
+            job = Job(job_name, interval, job_func, args)
+            self.jobs[job_name] = job
+            self._push(job)
         logger.info(f"添加定时任务成功: job_name={job_name}, interval={interval}")
-    
+
     def _safe_run(self, func, args):
         """安全地执行定时任务"""
         try:
@@ -41,30 +77,78 @@ class Scheduler:
              func(*args)
            else:
              func()
+           return True
         except Exception as e:
           logger.error(f"定时任务执行失败, error={e}")
-        
+          return False
+
+    def _run_job(self, job, lag):
+        """在线程池中执行任务并记录耗时"""
+        start = time.monotonic()
+        success = self._safe_run(job.func, job.args)
+        elapsed = time.monotonic() - start
+        with self._condition:
+            job.running = False
+            job.stats["runs"] += 1
+            if not success:
+                job.stats["failures"] += 1
+            job.stats["last_time"] = elapsed
+            job.stats["total_time"] += elapsed
+            job.stats["max_time"] = max(job.stats["max_time"], elapsed)
+            job.stats["total_lag"] += lag
+            job.stats["max_lag"] = max(job.stats["max_lag"], lag)
+        if job.interval and elapsed > job.interval:
+            logger.warning(f"定时任务执行时间超过间隔: job_name={job.name}, elapsed={elapsed:.2f}, interval={job.interval}")
+
+    def _dispatch(self, job, now):
+        """执行到期的任务并安排下次执行时间，调用方需持有锁"""
+        if job.running:
+            job.stats["overlaps"] += 1
+            logger.debug(f"定时任务上次执行尚未结束，跳过本次执行: job_name={job.name}")
+        else:
+            job.running = True
+            try:
+                self._executor.submit(self._run_job, job, now - job.next_run)
+            except RuntimeError:
+                job.running = False  # 解释器退出时线程池已关闭
+                return
+        # 积压多次时只补执行一次
+        job.next_run = max(job.next_run + job.interval, now)
+        self._push(job)
+
     def run_all(self):
-        """启动所有任务，并且保持运行，使用while True 循环"""
+        """调度线程主循环：等待最近的任务到期后交给线程池执行"""
         while True:
-            schedule.run_pending()
-            time.sleep(1)
-    
+            with self._condition:
+                while True:
+                    # 跳过已删除的任务
+                    while self._heap and (self._heap[0][2].cancelled or self._heap[0][0] != self._heap[0][2].next_run):
+                        heapq.heappop(self._heap)
+                    now = time.monotonic()
+                    if self._heap and self._heap[0][0] <= now:
+                        break
+                    self._condition.wait(self._heap[0][0] - now if self._heap else None)
+                _, _, job = heapq.heappop(self._heap)
+                self._dispatch(job, now)
+
     def start_scheduler(self):
         """启动定时任务"""
         if not self.scheduler_thread or not self.scheduler_thread.is_alive():
-          self.scheduler_thread = threading.Thread(target=self.run_all)
+          self.scheduler_thread = threading.Thread(target=self.run_all, name="scheduler")
           self.scheduler_thread.daemon = True
           self.scheduler_thread.start()
+          self.timers.start()
           logger.info("定时任务启动！")
         else:
           logger.warning("定时任务已经启动，无需重复启动")
 
     def remove_job(self, job_name):
       """移除定时任务"""
-      if job_name in self.jobs:
-          schedule.cancel_job(self.jobs[job_name])
-          del self.jobs[job_name]
+      with self._condition:
+          job = self.jobs.pop(job_name, None)
+          if job:
+              job.cancelled = True
+      if job:
           logger.info(f"删除定时任务成功， job_name = {job_name}")
       else:
           logger.warning(f"未找到要删除的任务, job_name={job_name}")
@@ -76,15 +160,33 @@ class Scheduler:
           delay:  延迟的时间(s)
           job_func: 需要执行的函数
           args: 函数的参数
+        Returns:
+          TimerHandle，调用 cancel() 取消任务
         """
-        def run_job():
-            self._safe_run(job_func, args)
-            self.remove_job(job_name)  # 执行完删除任务
-            
-        job_name = str(uuid.uuid4())
-        schedule_job = schedule.every(delay).seconds.do(run_job)
-        self.jobs[job_name] = schedule_job
-        logger.info(f"添加延迟执行任务成功， job_name= {job_name}")
+        handle = self.timers.schedule(delay, self._safe_run, (job_func, args))
+        logger.debug(f"添加延迟执行任务成功， timer_id= {handle.timer_id}, delay={delay}")
+        return handle
+
+    def get_stats(self):
+        """
+        获取所有任务的统计信息
+        Returns:
+            任务名称 -> 执行次数、失败次数、跳过的重叠次数、执行耗时和延迟的字典
+        """
+        now = time.monotonic()
+        with self._condition:
+            stats = {}
+            for name, job in self.jobs.items():
+                job_stats = dict(job.stats)
+                job_stats["interval"] = job.interval
+                job_stats["running"] = job.running
+                job_stats["next_run_in"] = job.next_run - now
+                stats[name] = job_stats
+        for job_stats in stats.values():
+            runs = job_stats["runs"]
+            job_stats["avg_time"] = job_stats["total_time"] / runs if runs else 0.0
+            job_stats["avg_lag"] = job_stats["total_lag"] / runs if runs else 0.0
+        return stats
 
 
 def create_scheduler():
@@ -99,4 +201,4 @@ def get_scheduler():
     global _scheduler
     if not _scheduler:
       _scheduler = create_scheduler()
-    return _scheduler
\ No newline at end of file
+    return _scheduler
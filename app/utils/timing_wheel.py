@@ -0,0 +1,152 @@
+import itertools
+import math
+import threading
+import time
+from app.utils.logger import logger
+from config import settings
+
+# 需要安装的模块：无
+
+
+class TimerHandle:
+    """
+    定时器句柄，用于取消尚未执行的定时器
+    """
+    __slots__ = ("timer_id", "target_tick", "func", "args", "_wheel")
+
+    def __init__(self, timer_id, target_tick, func, args, wheel):
+        self.timer_id = timer_id
+        self.target_tick = target_tick
+        self.func = func
+        self.args = args
+        self._wheel = wheel
+
+    def cancel(self):
+        """
+        取消定时器
+        Returns:
+            是否取消成功，已执行或已取消时返回 False
+        """
+        return self._wheel.cancel(self)
+
+
+class TimingWheel:
+    """
+    哈希时间轮
+
+    时间按 tick 秒划分刻度，定时器放入 (到期刻度 % 槽数) 对应的槽中，添加和取消都是 O(1)。
+    后台线程每个刻度处理一个槽，执行其中已到期的定时器，未到期的（相差整圈）留到下一圈。
+    到期的定时器交给 executor 执行，不阻塞时间轮。
+    """
+
+    def __init__(self, tick=None, slots=None, executor=None):
+        """
+        初始化时间轮
+        Args:
+            tick: 刻度长度（秒），决定定时器的精度
+            slots: 槽数量
+            executor: 执行到期定时器的线程池，None 表示在时间轮线程中直接执行
+        """
+        self.tick = tick if tick is not None else settings.TIMER_WHEEL_TICK
+        self._slots = [{} for _ in range(slots if slots is not None else settings.TIMER_WHEEL_SLOTS)]
+        self._executor = executor
+        self._start = time.monotonic()
+        self._current_tick = 0  # 已处理到的刻度
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._stats = {"scheduled": 0, "cancelled": 0, "fired": 0, "pending": 0}
+
+    def _now_tick(self):
+        """当前时间对应的刻度"""
+        return int((time.monotonic() - self._start) / self.tick)
+
+    def schedule(self, delay, func, args=None):
+        """
+        添加定时器
+        Args:
+            delay: 延迟时间（秒）
+            func: 到期后执行的函数
+            args: 函数的参数
+        Returns:
+            TimerHandle
+        """
+        target_tick = math.ceil((time.monotonic() - self._start + delay) / self.tick)
+        with self._lock:
+            handle = TimerHandle(next(self._ids), max(target_tick, self._current_tick + 1), func, args or (), self)
+            self._slots[handle.target_tick % len(self._slots)][handle.timer_id] = handle
+            self._stats["scheduled"] += 1
+            self._stats["pending"] += 1
+        return handle
+
+    def cancel(self, handle):
+        """
+        取消定时器
+        Returns:
+            是否取消成功
+        """
+        with self._lock:
+            if self._slots[handle.target_tick % len(self._slots)].pop(handle.timer_id, None) is None:
+                return False
+            self._stats["cancelled"] += 1
+            self._stats["pending"] -= 1
+            return True
+
+    def advance(self):
+        """处理从上次处理到当前时间之间所有到期的定时器"""
+        now_tick = self._now_tick()
+        due = []
+        with self._lock:
+            if now_tick <= self._current_tick:
+                return 0
+            # 落后超过一圈时每个槽只需要处理一次
+            first_tick = max(self._current_tick + 1, now_tick - len(self._slots) + 1)
+            for tick in range(first_tick, now_tick + 1):
+                slot = self._slots[tick % len(self._slots)]
+                if not slot:
+                    continue
+                expired = [timer_id for timer_id, handle in slot.items() if handle.target_tick <= now_tick]
+                for timer_id in expired:
+                    due.append(slot.pop(timer_id))
+            self._current_tick = now_tick
+            self._stats["fired"] += len(due)
+            self._stats["pending"] -= len(due)
+
+        for handle in due:
+            if self._executor:
+                try:
+                    self._executor.submit(handle.func, *handle.args)
+                except RuntimeError:
+                    return len(due)  # 解释器退出时线程池已关闭
+            else:
+                try:
+                    handle.func(*handle.args)
+                except Exception as e:
+                    logger.error(f"定时器执行失败: timer_id={handle.timer_id}, error={e}")
+        return len(due)
+
+    def _run(self):
+        """时间轮线程主循环"""
+        while not self._stop.wait(self.tick):
+            self.advance()
+
+    def start(self):
+        """启动时间轮线程"""
+        if not self._thread or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="timing-wheel", daemon=True)
+            self._thread.start()
+            logger.info("时间轮已启动")
+
+    def stop(self):
+        """停止时间轮线程"""
+        self._stop.set()
+
+    def get_stats(self):
+        """获取时间轮统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["tick"] = self.tick
+        stats["slots"] = len(self._slots)
+        return stats
@@ -0,0 +1,269 @@
+import bisect
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime
+from app.utils.db_utils import db_connection, execute_write, submit_write
+from app.utils.logger import logger
+from app.utils.scheduler import get_scheduler
+from config import settings
+
+# 需要安装的模块：无
+
+_user_directory = None
+
+DAY_SECONDS = 86400
+SYNC_DEBOUNCE = 5  # 上游用户变化后延迟多少秒同步，合并短时间内的多次变化
+
+
+def parse_upstream_time(time_str):
+    """
+    解析上游服务返回的 ISO 时间字符串
+    Returns:
+        时间戳（秒），无法解析时返回 None
+    """
+    if not time_str:
+        return None
+    try:
+        time_str = time_str.replace('Z', '+00:00')
+        if '.' in time_str:
+            # 删除微秒部分，保留时区
+            dot = time_str.find('.')
+            end = dot + 1
+            while end < len(time_str) and time_str[end].isdigit():
+                end += 1
+            time_str = time_str[:dot] + time_str[end:]
+        dt = datetime.fromisoformat(time_str)
+        if dt.tzinfo is None:
+            dt = dt.astimezone()
+        return dt.timestamp()
+    except Exception as e:
+        logger.error(f"解析时间字符串失败: {time_str}，错误信息为 {e}")
+        return None
+
+
+class UpstreamUser:
+    """
+    上游服务用户的本地镜像
+    """
+    __slots__ = ("service_user_id", "username", "is_admin", "last_seen", "fingerprint", "data")
+
+    def __init__(self, service_user_id, username, is_admin=False, last_seen=None, fingerprint=None, data=None):
+        self.service_user_id = service_user_id
+        self.username = username
+        self.is_admin = is_admin
+        self.last_seen = last_seen  # 最后登录或访问时间的时间戳，从未登录为 None
+        self.fingerprint = fingerprint
+        self.data = data  # 上游服务返回的原始用户数据
+
+
+class UserDirectory:
+    """
+    上游服务用户目录
+
+    在 UpstreamUsers 表和内存中镜像上游服务的用户列表，按 service_user_id 和用户名建立字典索引，
+    按最后活跃时间维护有序列表，查询用户和扫描过期用户都在本地完成，不再每次下载整个用户列表。
+    首次同步写入完整快照，之后每次同步只写入新增、变化（原始数据的指纹不同）和删除的用户。
+    客户端需要实现 _list_upstream_users() 和 _normalize_user(raw)。
+    """
+
+    def __init__(self, client, service_type=None):
+        """
+        初始化用户目录
+        Args:
+            client: 上游服务 API 客户端
+            service_type: 服务类型
+        """
+        self.client = client
+        self.service_type = service_type or settings.SERVICE_TYPE
+        self.ready = False  # 已从数据库加载或完成过一次同步
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._by_id = {}
+        self._by_username = {}
+        self._by_last_seen = []  # [(last_seen, service_user_id)]，只包含非管理员
+        self._last_seen_keys = []
+        self._never_seen = []  # 从未登录过的非管理员 service_user_id
+        self._sync_pending = False
+        self._stats = {"syncs": 0, "failures": 0, "added": 0, "updated": 0, "removed": 0, "last_sync_time": 0.0,
+                       "last_sync_duration": 0.0}
+
+    def _rebuild(self, users):
+        """用用户字典替换内存索引"""
+        by_username = {user.username: user for user in users.values()}
+        by_last_seen = sorted((user.last_seen, user.service_user_id) for user in users.values()
+                              if not user.is_admin and user.last_seen is not None)
+        never_seen = [user.service_user_id for user in users.values() if not user.is_admin and user.last_seen is None]
+        with self._lock:
+            self._by_id = users
+            self._by_username = by_username
+            self._by_last_seen = by_last_seen
+            self._last_seen_keys = [last_seen for last_seen, _ in by_last_seen]
+            self._never_seen = never_seen
+            self.ready = True
+
+    def load(self):
+        """从数据库加载镜像，启动后无需等待首次同步即可查询"""
+        with db_connection() as conn:
+            rows = conn.execute("SELECT * FROM UpstreamUsers WHERE service_type = ?", (self.service_type,)).fetchall()
+        if not rows:
+            return 0
+        users = {row['service_user_id']: UpstreamUser(row['service_user_id'], row['username'], bool(row['is_admin']),
+                                                      row['last_seen'], row['fingerprint'], json.loads(row['data']))
+                 for row in rows}
+        self._rebuild(users)
+        logger.info(f"从数据库加载上游用户镜像: service_type={self.service_type}, count={len(users)}")
+        return len(users)
+
+    def _fetch(self):
+        """下载上游用户列表并转换为 UpstreamUser 字典，失败时返回 None"""
+        raw_users = self.client._list_upstream_users()
+        if raw_users is None:
+            return None
+        users = {}
+        for raw in raw_users:
+            user = self.client._normalize_user(raw)
+            user.data = raw
+            user.fingerprint = hashlib.sha1(json.dumps(raw, sort_keys=True, default=str).encode()).hexdigest()
+            users[user.service_user_id] = user
+        return users
+
+    def sync(self):
+        """
+        与上游服务同步，只把变化写入数据库
+        Returns:
+            是否同步成功
+        """
+        with self._sync_lock:
+            start = time.monotonic()
+            users = self._fetch()
+            if users is None:
+                self._stats["failures"] += 1
+                logger.warning(f"同步上游用户失败: service_type={self.service_type}")
+                return False
+            with self._lock:
+                previous = self._by_id
+                full = not self.ready
+            changed = [user for user_id, user in users.items()
+                       if user_id not in previous or previous[user_id].fingerprint != user.fingerprint]
+            removed = [user_id for user_id in previous if user_id not in users]
+
+            def _write(conn):
+                if full:
+                    conn.execute("DELETE FROM UpstreamUsers WHERE service_type = ?", (self.service_type,))
+                conn.executemany(
+                    "INSERT OR REPLACE INTO UpstreamUsers (service_type, service_user_id, username, is_admin, last_seen, "
+                    "fingerprint, data, sync_time) VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)",
+                    [(self.service_type, user.service_user_id, user.username, int(user.is_admin), user.last_seen,
+                      user.fingerprint, json.dumps(user.data, default=str)) for user in changed]
+                )
+                conn.executemany("DELETE FROM UpstreamUsers WHERE service_type = ? AND service_user_id = ?",
+                                 [(self.service_type, user_id) for user_id in removed])
+
+            if changed or removed or full:
+                execute_write(_write)
+                self._rebuild(users)
+            added = sum(1 for user in changed if user.service_user_id not in previous)
+            self._stats["syncs"] += 1
+            self._stats["added"] += added
+            self._stats["updated"] += len(changed) - added
+            self._stats["removed"] += len(removed)
+            self._stats["last_sync_time"] = time.time()
+            self._stats["last_sync_duration"] = time.monotonic() - start
+            logger.debug(f"同步上游用户完成: service_type={self.service_type}, full={full}, total={len(users)}, "
+                         f"added={added}, updated={len(changed) - added}, removed={len(removed)}")
+            return True
+
+    def request_sync(self, delay=SYNC_DEBOUNCE):
+        """上游用户发生变化（创建、改名、禁用）后请求尽快同步，delay 秒内的多次请求只同步一次"""
+        with self._lock:
+            if self._sync_pending:
+                return
+            self._sync_pending = True
+        get_scheduler().add_delayed_job(delay, self._run_pending_sync)
+
+    def _run_pending_sync(self):
+        with self._lock:
+            self._sync_pending = False
+        self.sync()
+
+    def discard(self, service_user_id):
+        """上游用户已删除时立即从镜像中移除，不等待下一次同步"""
+        with self._lock:
+            if service_user_id not in self._by_id:
+                return
+            users = {user_id: user for user_id, user in self._by_id.items() if user_id != service_user_id}
+        self._rebuild(users)
+        submit_write(lambda conn: conn.execute(
+            "DELETE FROM UpstreamUsers WHERE service_type = ? AND service_user_id = ?", (self.service_type, service_user_id)
+        ))
+
+    def start(self):
+        """加载镜像并启动定时同步任务，首次同步立即执行"""
+        self.load()
+        scheduler = get_scheduler()
+        scheduler.add_delayed_job(0, self.sync)
+        scheduler.add_job(job_name="sync_upstream_users", interval=settings.USER_DIRECTORY_SYNC_INTERVAL,
+                          job_func=self.sync)
+
+    def get_by_id(self, service_user_id):
+        """根据 service_user_id 获取用户"""
+        with self._lock:
+            return self._by_id.get(service_user_id)
+
+    def get_by_username(self, username):
+        """根据用户名获取用户"""
+        with self._lock:
+            return self._by_username.get(username)
+
+    def count(self):
+        """上游用户数量"""
+        with self._lock:
+            return len(self._by_id)
+
+    def get_expired_users(self, expired_days, warning_days, now=None):
+        """
+        获取过期用户和即将过期的用户（不包括管理员），判断规则与原来的 _get_expired_users 相同：
+        超过 expired_days 天未活跃或从未登录为过期，warning_days 天内活跃过为即将过期
+        Returns:
+            {'expired': [{'service_user_id', 'username'}], 'warning': [...]}
+        """
+        now = now if now is not None else time.time()
+        with self._lock:
+            expired_end = bisect.bisect_left(self._last_seen_keys, now - expired_days * DAY_SECONDS)
+            warning_start = bisect.bisect_right(self._last_seen_keys, now - warning_days * DAY_SECONDS)
+            expired_ids = [user_id for _, user_id in self._by_last_seen[:expired_end]] + self._never_seen
+            warning_ids = [user_id for _, user_id in self._by_last_seen[warning_start:]]
+            by_id = self._by_id
+        return {
+            'expired': [{'service_user_id': user_id, 'username': by_id[user_id].username} for user_id in expired_ids],
+            'warning': [{'service_user_id': user_id, 'username': by_id[user_id].username} for user_id in warning_ids],
+        }
+
+    def get_stats(self):
+        """获取用户目录统计信息"""
+        stats = dict(self._stats)
+        stats["count"] = self.count()
+        stats["ready"] = self.ready
+        return stats
+
+
+def create_user_directory(client=None):
+    """创建UserDirectory实例，并赋值给全局变量_user_directory，客户端不支持时返回 None"""
+    global _user_directory
+    if not _user_directory:
+        if client is None:
+            from app.utils.api_clients import service_api_client
+            client = service_api_client
+        if not hasattr(client, "_normalize_user"):
+            logger.info(f"当前服务不支持上游用户镜像: service_type={settings.SERVICE_TYPE}")
+            return None
+        _user_directory = UserDirectory(client)
+        client.directory = _user_directory
+    return _user_directory
+
+
+def get_user_directory():
+    """获取 UserDirectory 实例，未创建时返回 None"""
+    return _user_directory
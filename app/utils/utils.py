@@ -2,6 +2,7 @@ import telebot
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
 from app.utils.logger import logger
 from app.utils.scheduler import get_scheduler
+from app.utils.pagination import get_pagination_store
 from app.bot.core.bot_instance import bot
 
 # 需要安装的模块：无
@@ -67,42 +68,37 @@ def paginate_list_text(data_list, page_size=None):
     return result
 
 
-# 用于存储每个用户的分页状态
-user_states = {}
-
-
-def create_pagination(chat_id, message_id, user_list, items_per_page):
-    if chat_id not in user_states:
-        user_states[chat_id] = {
-            'message_id': message_id + 1,
-            'current_page': 1,
-            'items_per_page': items_per_page,
-            'user_list': user_list
-        }
-    elif message_id != user_states[chat_id]['message_id']:
-        del user_states[chat_id]
-        user_states[chat_id] = {
-            'message_id': message_id + 1,
-            'current_page': 1,
-            'items_per_page': items_per_page,
-            'user_list': user_list
-        }
-
-    state = user_states[chat_id]
-    total_pages = (len(state['user_list']) + state['items_per_page'] - 1) // state['items_per_page']
-    current_page = state['current_page']
-
-    start_index = (current_page - 1) * state['items_per_page']
-    end_index = min(start_index + state['items_per_page'], len(state['user_list']))
-    items = state['user_list'][start_index:end_index]
-    
-    text = '\n'.join(map(str, items)) + f"\n\n当前页: {current_page}/{total_pages}页，{len(items)}/{len(state['user_list'])}项"
+def create_pagination(chat_id, source, items_per_page, params=(), **kwargs):
+    """
+    创建分页并发送第一页，游标以发出的消息 ID 保存，翻页时编辑这条消息
+    Args:
+        chat_id: 聊天 ID
+        source: 已注册的分页查询名称（见 PaginationStore.register_query），或要分页的列表
+        items_per_page: 每页条目数
+        params: 分页查询的参数
+        kwargs: 传给 send_message 的其他参数
+    Returns:
+        发出的消息，没有任何条目时不发送，返回 None
+    """
+    store = get_pagination_store()
+    cursor = store.open(source, items_per_page, params)
+    if not cursor.total:
+        return None
+    text, markup = render_pagination(cursor, store.fetch(cursor) or [])
+    sent_message = bot.send_message(chat_id, text, reply_markup=markup, **kwargs)
+    store.put(chat_id, sent_message.message_id, cursor)
+    return sent_message
+
+
+def render_pagination(cursor, items):
+    """生成当前页的文本和翻页按钮"""
+    text = '\n'.join(map(str, items)) + f"\n\n当前页: {cursor.current_page}/{cursor.total_pages}页，{len(items)}/{cursor.total}项"
 
     markup = InlineKeyboardMarkup()
     markup.row_width = 2
-    if current_page > 1:
+    if cursor.current_page > 1:
         markup.add(InlineKeyboardButton("⬅️ 上一页", callback_data='prev'))
-    if current_page < total_pages:
+    if cursor.current_page < cursor.total_pages:
         markup.add(InlineKeyboardButton("下一页 ➡️", callback_data='next'))
 
     return text, markup
@@ -110,23 +106,26 @@ def create_pagination(chat_id, message_id, user_list, items_per_page):
 
 @bot.callback_query_handler(func=lambda call: call.data in ['prev', 'next'])
 def callback_inline(call):
-    logger.info(f"call.message: {call.message}")
     chat_id = call.message.chat.id
     message_id = call.message.id
-    logger.info(f"status: {user_states}")
-    # 确保用户状态存在
-    if chat_id in user_states and message_id == user_states[chat_id]['message_id']:
-        if call.data == 'next':
-            user_states[chat_id]['current_page'] += 1
-        elif call.data == 'prev':
-            user_states[chat_id]['current_page'] -= 1
-
-        text, markup = create_pagination(
-            chat_id,
-            message_id,
-            user_states[chat_id]['user_list'],
-            user_states[chat_id]['items_per_page']
-        )
-        bot.edit_message_text(text, chat_id=chat_id, message_id=call.message.message_id, reply_markup=markup)
-
-
+    store = get_pagination_store()
+    cursor = store.get(chat_id, message_id)
+    logger.debug(f"分页翻页: chat_id={chat_id}, message_id={message_id}, action={call.data}, "
+                 f"page={cursor.current_page if cursor else None}")
+    if cursor is None:
+        bot.answer_callback_query(call.id, "分页已过期，请重新查询")
+        return
+    if call.data == 'next' and cursor.current_page < cursor.total_pages:
+        cursor.offset += cursor.page_size
+    elif call.data == 'prev' and cursor.offset > 0:
+        cursor.offset -= cursor.page_size
+    else:
+        bot.answer_callback_query(call.id, "没有更多了")
+        return
+    items = store.fetch(cursor)
+    if items is None:
+        bot.answer_callback_query(call.id, "分页已过期，请重新查询")
+        return
+    store.put(chat_id, message_id, cursor)
+    text, markup = render_pagination(cursor, items)
+    bot.edit_message_text(text, chat_id=chat_id, message_id=call.message.message_id, reply_markup=markup)
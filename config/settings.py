@@ -7,6 +7,14 @@ load_dotenv()
 
 # --- 数据库配置 ---
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./data/db.sqlite3")  # 数据库连接 URL，默认为 SQLite
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 8))  # 同时使用中的最大数据库连接数
+DB_BUSY_TIMEOUT = int(os.getenv("DB_BUSY_TIMEOUT", 5000))  # 数据库忙等待时间（毫秒）
+DB_HEALTH_CHECK_INTERVAL = int(os.getenv("DB_HEALTH_CHECK_INTERVAL", 60))  # 连接空闲超过该秒数时做健康检查
+DB_JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE", "WAL")  # 数据库日志模式，WAL 模式下读写互不阻塞
+DB_WRITE_MODE = os.getenv("DB_WRITE_MODE", "queue")  # 写入模式，queue: 单写线程合并提交，direct: 调用线程加锁直接写入
+DB_WRITER_BATCH_SIZE = int(os.getenv("DB_WRITER_BATCH_SIZE", 100))  # 写线程单个事务最多合并的写操作数量
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 1024))  # 用户缓存最大条目数
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 60))  # 用户缓存有效期（秒）
 
 # --- 服务类型配置 ---
 SERVICE_TYPE = os.getenv("SERVICE_TYPE")  # 支持的服务类型列表
@@ -14,6 +22,25 @@ SERVICE_TYPE = os.getenv("SERVICE_TYPE")  # 支持的服务类型列表
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")  # Telegram Bot Token
 ADMIN_TELEGRAM_IDS = [int(id) for id in os.getenv("ADMIN_TELEGRAM_IDS", "").split(",") if id]  # 管理员 Telegram ID 列表，用逗号分隔
 WEBHOOK_URL = os.getenv("WEBHOOK_URL", None)
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")  # Webhook 服务监听地址
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 7000))  # Webhook 服务监听端口，默认为 7000
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "")  # Webhook 请求的 secret token，为空时不校验
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000))  # Webhook update 队列长度，队列满时返回 503，默认为 1000
+DISPATCHER_LANES = int(os.getenv("DISPATCHER_LANES", 8))  # 按 chat_id 分配 update 的处理通道数量，默认为 8
+DISPATCHER_QUEUE_SIZE = int(os.getenv("DISPATCHER_QUEUE_SIZE", 100))  # 每个处理通道的队列长度，默认为 100
+# --- 上游服务 HTTP 配置 ---
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))  # 连接上游服务的超时时间（秒），默认为 5
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 30))  # 读取上游服务响应的超时时间（秒），默认为 30
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 10))  # 每个上游服务的连接池大小，默认为 10
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", 3))  # 请求失败的最多重试次数，默认为 3
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", 0.5))  # 重试退避的基础时间（秒），默认为 0.5
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", 10))  # 单次重试退避的最长时间（秒），默认为 10
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))  # 上游服务连续失败多少次后熔断，默认为 5
+CIRCUIT_RECOVERY_TIMEOUT = float(os.getenv("CIRCUIT_RECOVERY_TIMEOUT", 60))  # 熔断多少秒后尝试恢复，默认为 60
+CIRCUIT_SNAPSHOT_TTL = int(os.getenv("CIRCUIT_SNAPSHOT_TTL", 3600))  # 熔断时可用的响应快照有效期（秒），默认为 3600
+CIRCUIT_SNAPSHOT_MAX_ENTRIES = int(os.getenv("CIRCUIT_SNAPSHOT_MAX_ENTRIES", 200))  # 每个上游服务最多保存的响应快照数量，默认为 200
+TOKEN_REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", 300))  # 上游服务 token 距过期多少秒时提前刷新，默认为 300
+USER_DIRECTORY_SYNC_INTERVAL = int(os.getenv("USER_DIRECTORY_SYNC_INTERVAL", 300))  # 同步上游服务用户镜像的时间间隔（秒），默认为 5 分钟
 # --- Navidrome 配置 ---
 NAVIDROME_API_URL = os.getenv("NAVIDROME_API_URL")  # Navidrome API 地址
 NAVIDROME_API_USERNAME = os.getenv("NAVIDROME_API_USERNAME")  # Navidrome API 用户名
@@ -39,6 +66,9 @@ INVITE_CODE_EXPIRATION_DAYS = int(os.getenv("INVITE_CODE_EXPIRATION_DAYS", 7))
 INVITE_CODE_SYSTEM_ENABLED=bool(os.getenv("INVITE_CODE_SYSTEM_ENABLED", False) == 'True')
 INVITE_CODE_PRICE=int(os.getenv("INVITE_CODE_PRICE", 100))
 CREATE_USER_EXPIRED_DAYS = int(os.getenv("CREATE_USER_EXPIRED_DAYS", 30))  # 用户过期时间（天），默认为 30
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", 4))  # 定时任务线程池大小，默认为 4
+TIMER_WHEEL_TICK = float(os.getenv("TIMER_WHEEL_TICK", 0.1))  # 延迟任务时间轮的刻度（秒），默认为 0.1
+TIMER_WHEEL_SLOTS = int(os.getenv("TIMER_WHEEL_SLOTS", 512))  # 延迟任务时间轮的槽数量，默认为 512
 # --- 清理不活跃用户 ---
 EXPIRED_DAYS = int(os.getenv("EXPIRED_DAYS", 30))  # 用户过期时间（天），默认为 30
 WARNING_DAYS = int(os.getenv("WARNING_DAYS", 27)) #  提前警告天数，默认为3
@@ -47,8 +77,27 @@ ENABLE_EXPIRED_USER_CLEAN = bool(os.getenv("ENABLE_EXPIRED_USER_CLEAN", 'False')
 
 DELAY_INTERVAL = int(os.getenv("DELAY_INTERVAL", 5))
 ENABLE_MESSAGE_CLEANER = bool(os.getenv("ENABLE_MESSAGE_CLEANER", 'False') == 'True') # 是否开启消息清理系统，默认关闭
+MESSAGE_QUEUE_FLUSH_SIZE = int(os.getenv("MESSAGE_QUEUE_FLUSH_SIZE", 50))  # 待删除消息积累多少条变更后写入数据库，默认为 50
+MESSAGE_DELETE_RATE = float(os.getenv("MESSAGE_DELETE_RATE", 20))  # 每秒最多调用多少次删除消息接口，默认为 20
+MESSAGE_DELETE_MAX_RETRIES = int(os.getenv("MESSAGE_DELETE_MAX_RETRIES", 5))  # 删除消息失败的最大重试次数，默认为 5
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", 30))  # 每秒最多发送多少条消息，默认为 30
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", 1))  # 每个私聊每秒最多发送多少条消息，默认为 1
+TELEGRAM_GROUP_RATE = float(os.getenv("TELEGRAM_GROUP_RATE", 20))  # 每个群组每分钟最多发送多少条消息，默认为 20
+TELEGRAM_SEND_WORKERS = int(os.getenv("TELEGRAM_SEND_WORKERS", 4))  # 发送消息的线程数量，默认为 4
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", 100))  # 群发时每页的用户数量，每页完成后保存进度，默认为 100
+PAGINATION_MAX_ENTRIES = int(os.getenv("PAGINATION_MAX_ENTRIES", 1000))  # 最多保存多少条分页消息的翻页状态，默认为 1000
+PAGINATION_TTL = int(os.getenv("PAGINATION_TTL", 600))  # 翻页状态的有效期（秒），默认为 600
+PAGINATION_MAX_SNAPSHOTS = int(os.getenv("PAGINATION_MAX_SNAPSHOTS", 100))  # 最多缓存多少个分页列表快照，默认为 100
+PAGINATION_MAX_SNAPSHOT_ITEMS = int(os.getenv("PAGINATION_MAX_SNAPSHOT_ITEMS", 5000))  # 单个分页列表快照最多保存的条目数量，默认为 5000
+STATS_CACHE_TTL = int(os.getenv("STATS_CACHE_TTL", 60))  # 统计信息缓存多少秒后在后台刷新，默认为 60
+STATS_CACHE_MAX_AGE = int(os.getenv("STATS_CACHE_MAX_AGE", 600))  # 统计信息缓存多少秒后失效，需要重新收集，默认为 600
 
 # --- Mailu 配置 ---
 MAILU_URL = os.getenv("MAILU_URL")
 MAILU_TOKEN = os.getenv("MAILU_TOKEN")
-MAILU_PRICE = int(os.getenv("MAILU_PRICE", 200))
\ No newline at end of file
+MAILU_PRICE = int(os.getenv("MAILU_PRICE", 200))
+
+# --- 积分配置 ---
+SCORE_SNAPSHOT_INTERVAL = int(os.getenv("SCORE_SNAPSHOT_INTERVAL", 86400))  # 积分余额快照和流水压缩的时间间隔（秒），默认为 1 天
+SCORE_LEDGER_RETENTION_DAYS = int(os.getenv("SCORE_LEDGER_RETENTION_DAYS", 90))  # 积分流水保留天数，默认为 90
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", 100))  # 内存中保存的积分排行榜长度，默认为 100
@@ -1,4 +1,5 @@
 from app.utils.db_utils import create_tables
+from app.utils.migrations import run_migrations, check_query_plans
 from app.bot.bot_manager import run_bot
 from config import settings
 from app.utils.logger import logger
@@ -6,6 +7,8 @@ from app.utils.scheduler import create_scheduler
 from app.utils.message_queue import create_message_queue
 from app.utils.message_cleaner import create_message_cleaner
 from app.utils.mailu import create_mailu
+from app.services.score_service import ScoreService
+from app.utils.user_directory import create_user_directory
 # 需要安装的模块：无
 
         
@@ -17,10 +20,21 @@ def init_app():
     create_tables()
     logger.info("数据库表创建完成")
     
+    run_migrations()
+    check_query_plans()
+    
     scheduler = create_scheduler()
     scheduler.start_scheduler()
     logger.info(f"定时器已启动！")
     
+    ScoreService.start_ledger_jobs()
+    logger.info(f"积分快照任务已启动！")
+    
+    user_directory = create_user_directory()
+    if user_directory:
+        user_directory.start()
+        logger.info(f"上游用户同步任务已启动！")
+    
     create_message_queue()
     logger.info(f"消息管理队列已启动！")
     
@@ -0,0 +1,31 @@
+# 时间轮性能测试，不属于单元测试（pytest 只收集 test_*.py），手动运行：
+# python tests/bench_timing_wheel.py [定时器数量]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SERVICE_TYPE", "navidrome")
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:test")
+
+from app.utils.timing_wheel import TimingWheel  # noqa: E402
+
+# 需要安装的模块：无
+
+
+def main(count=100000):
+    wheel = TimingWheel(tick=0.01, slots=512)
+    start = time.perf_counter()
+    handles = [wheel.schedule(30 + i % 600, print, (i,)) for i in range(count)]
+    scheduled = time.perf_counter() - start
+    start = time.perf_counter()
+    for handle in handles:
+        handle.cancel()
+    cancelled = time.perf_counter() - start
+    print(f"timers={count}, schedule: {scheduled:.3f}s ({scheduled * 1e6 / count:.2f}us/timer), "
+          f"cancel: {cancelled:.3f}s ({cancelled * 1e6 / count:.2f}us/timer)")
+    print(wheel.get_stats())
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
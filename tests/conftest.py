@@ -0,0 +1,26 @@
+# 测试配置
+import os
+import sys
+import tempfile
+import pytest
+
+# 需要安装的模块：pytest
+# pip install pytest
+
+# 导入 app 之前设置测试环境变量，数据库使用临时文件
+os.environ.setdefault("DATABASE_URL", os.path.join(tempfile.mkdtemp(prefix="tgbot-test-"), "test.db"))
+os.environ.setdefault("SERVICE_TYPE", "navidrome")
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:test")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def database():
+    """创建数据表并执行迁移，整个测试会话共用一个临时数据库，结束时停止写线程"""
+    from app.utils.db_utils import create_tables, get_db_writer
+    from app.utils.migrations import run_migrations
+    create_tables()
+    run_migrations()
+    yield
+    get_db_writer().stop()
@@ -1 +1,108 @@
-# Bot 测试
\ No newline at end of file
+# Bot 测试
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import Future
+from types import SimpleNamespace
+from app.bot.core import bot_instance
+
+
+class _FakeTimer:
+    def __init__(self, func):
+        self.func = func
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+        return True
+
+
+def test_expired_step_timer_does_not_clear_newer_handler(monkeypatch):
+    """旧定时器来不及取消而执行时，不会清除同一聊天新注册的下一步处理器"""
+    timers = []
+    cleared = []
+    monkeypatch.setattr(bot_instance, "ENABLE_MESSAGE_CLEANER", True)
+    monkeypatch.setattr(bot_instance, "original_register_next_step_handler", lambda *args, **kwargs: None)
+    monkeypatch.setattr(bot_instance.scheduler, "add_delayed_job",
+                        lambda delay, func, args=None: timers.append(_FakeTimer(func)) or timers[-1])
+    monkeypatch.setattr(bot_instance, "clear_step_handler", cleared.append)
+
+    chat = SimpleNamespace(id=42)
+    first, second = SimpleNamespace(chat=chat, message_id=1), SimpleNamespace(chat=chat, message_id=2)
+    bot_instance.register_next_step_handler_with_delete(first, print)
+    bot_instance.register_next_step_handler_with_delete(second, print)
+    assert timers[0].cancelled
+
+    timers[0].func()
+    assert cleared == []
+    assert bot_instance.step_handler_timers[42] is timers[1]
+
+    timers[1].func()
+    assert cleared == [second]
+    assert 42 not in bot_instance.step_handler_timers
+
+
+def test_bot_imports_with_cleaner_on_unmigrated_database(tmp_path):
+    """开启消息清理时，在还没有执行迁移的数据库上导入 bot 不访问 PendingDeletions 表"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, DATABASE_URL=str(tmp_path / "fresh.db"), ENABLE_MESSAGE_CLEANER="True", PYTHONPATH=root)
+    code = "import app.bot.core.bot_instance, app.bot.handlers.user_handlers, app.bot.handlers.admin_handlers"
+    result = subprocess.run([sys.executable, "-c", code], cwd=tmp_path, env=env, capture_output=True, text=True,
+                            timeout=60)
+    assert result.returncode == 0, result.stderr[-2000:]
+
+
+class _FlakyBot:
+    """群发测试用的 bot：failing 为 True 时提交发送就抛出异常"""
+
+    def __init__(self):
+        self.failing = True
+        self.sent = []
+
+    def register_my_chat_member_handler(self, handler):
+        pass
+
+    def send_message(self, chat_id, text, **kwargs):
+        if self.failing:
+            raise RuntimeError("send queue unavailable")
+        self.sent.append(chat_id)
+        future = Future()
+        future.set_result(None)
+        return future
+
+
+def _wait_until_stopped(broadcaster, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while job_id in broadcaster.get_running_jobs():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_broadcast_pauses_after_retries_and_can_be_resumed(database):
+    """一页多次出错时任务在数据库中标记为已暂停，恢复后从保存的进度继续，已暂停的任务可以取消"""
+    from app.bot.broadcaster import Broadcaster
+    from app.models import BroadcastJob, ServiceUser
+    ServiceUser(telegram_id=3000, service_type="navidrome", username="u3000").save()
+
+    fake_bot = _FlakyBot()
+    broadcaster = Broadcaster(fake_bot, page_size=10, retry_delay=0)
+    job = broadcaster.start("hello")
+    _wait_until_stopped(broadcaster, job.id)
+    assert BroadcastJob.get_by_id(job.id).status == BroadcastJob.STATUS_PAUSED
+    assert broadcaster.resume() == 0
+
+    fake_bot.failing = False
+    assert broadcaster.resume_job(job.id)
+    _wait_until_stopped(broadcaster, job.id)
+    job = BroadcastJob.get_by_id(job.id)
+    assert job.status == BroadcastJob.STATUS_FINISHED
+    assert 3000 in fake_bot.sent and job.sent_count == len(fake_bot.sent)
+    assert broadcaster.resume_job(job.id) is None
+
+    fake_bot.failing = True
+    paused = broadcaster.start("bye")
+    _wait_until_stopped(broadcaster, paused.id)
+    assert broadcaster.cancel(paused.id)
+    assert BroadcastJob.get_by_id(paused.id).status == BroadcastJob.STATUS_CANCELLED
+    assert not broadcaster.cancel(paused.id)
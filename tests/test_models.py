@@ -1 +1,39 @@
-# 模型测试
\ No newline at end of file
+# 模型测试
+from concurrent.futures import ThreadPoolExecutor
+from app.models import ServiceUser, ScoreLedger
+
+
+def test_stale_save_does_not_overwrite_score(database):
+    """拿着旧对象 save() 不会覆盖期间通过 change_score 修改的积分"""
+    user = ServiceUser(telegram_id=1001, score=5, service_type="navidrome", username="stale").save()
+    stale = ServiceUser.get_by_id(user.id)
+    ServiceUser.change_score(user.id, 10)
+
+    stale.status = "blocked"
+    stale.save()
+
+    current = ServiceUser.get_by_id(user.id)
+    assert current.score == 15
+    assert current.status == "blocked"
+    assert ScoreLedger.audit(user.id) == []
+
+
+def test_concurrent_change_score_loses_no_update(database):
+    """并发加减积分没有丢失更新，流水与余额一致"""
+    user = ServiceUser(telegram_id=1002, score=0, service_type="navidrome", username="concurrent").save()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda _: ServiceUser.change_score(user.id, 1), range(200)))
+
+    assert ServiceUser.get_by_id(user.id).score == 200
+    assert ScoreLedger.audit(user.id) == []
+
+
+def test_add_scores_reports_missing_users(database):
+    """批量加积分时不存在的用户不计入更新数量，流水记录返回不存在的用户 ID"""
+    from app.utils.db_utils import execute_write
+    user = ServiceUser(telegram_id=1003, score=0, service_type="navidrome", username="grant").save()
+    assert ServiceUser.add_scores({user.id: 5, 999999: 5}) == 1
+    assert ServiceUser.get_by_id(user.id).score == 5
+    assert execute_write(lambda conn: ScoreLedger.record_many(conn, {user.id: 0, 999998: 1}, ScoreLedger.REASON_SYSTEM)) \
+        == (1, [999998])
+    assert ScoreLedger.audit(user.id) == []
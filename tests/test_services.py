@@ -1 +1,52 @@
-# 服务测试
\ No newline at end of file
+# 服务测试
+from concurrent.futures import ThreadPoolExecutor
+from app.models import ServiceUser, ScoreLedger
+from app.services.score_service import ScoreService
+from app.utils.db_utils import db_connection
+
+
+def _create_users(start, count, score=0):
+    return [ServiceUser(telegram_id=start + i, score=score, service_type="navidrome", username=f"u{start + i}").save()
+            for i in range(count)]
+
+
+def test_random_score_event_debits_sender_or_is_not_created(database):
+    """红包创建和扣除积分在同一个写操作中：积分不足时不创建活动"""
+    sender = _create_users(2000, 1, score=30)[0]
+    assert ScoreService.create_random_score_event(sender.telegram_id, -1, 50, 5, payer_id=sender.id) is None
+    with db_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM RandomScoreEvents WHERE create_user_id = ?",
+                            (sender.telegram_id,)).fetchone()[0] == 0
+
+    event_id = ScoreService.create_random_score_event(sender.telegram_id, -1, 20, 4, payer_id=sender.id)
+    assert event_id is not None
+    assert ServiceUser.get_by_id(sender.id).score == 10
+    assert ScoreLedger.audit(sender.id) == []
+
+
+def test_concurrent_random_score_claims_pay_out_exactly_the_total(database):
+    """并发领取时每一份只发给一个用户，同一用户只能领取一次，发放总额等于红包总额"""
+    sender = _create_users(2100, 1, score=100)[0]
+    claimers = _create_users(2200, 20)
+    event_id = ScoreService.create_random_score_event(sender.telegram_id, -1, 50, 5, payer_id=sender.id)
+
+    attempts = [user.telegram_id for user in claimers] + [claimers[0].telegram_id] * 5
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        scores = list(executor.map(lambda tid: ScoreService.use_random_score(event_id, tid, str(tid)), attempts))
+
+    assert len([score for score in scores if score]) == 5
+    assert sum(score for score in scores if score) == 50
+    assert sum(ServiceUser.get_by_id(user.id).score for user in claimers) == 50
+    event = ScoreService.get_random_score_event(event_id)
+    assert event["is_finished"]
+    assert ScoreService.use_random_score(event_id, claimers[-1].telegram_id, "late") in (0, None)
+    assert ScoreLedger.audit() == []
+
+
+def test_random_scores_split_the_exact_total():
+    """随机积分列表的份数等于参与人数，每份至少 1 分，总和等于总积分"""
+    for total_score, participants_count in [(50, 5), (5, 5), (7, 2), (1000, 30), (1, 1)]:
+        for _ in range(200):
+            scores = ScoreService._generate_random_scores(total_score, participants_count)
+            assert len(scores) == participants_count
+            assert min(scores) >= 1 and sum(scores) == total_score
@@ -1 +1,132 @@
-# 工具类测试
\ No newline at end of file
+# 工具类测试
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from app.utils.timing_wheel import TimingWheel
+
+
+def test_timing_wheel_schedule_and_cancel_100k():
+    """创建并取消 10 万个定时器，取消后不会执行（耗时见 tests/bench_timing_wheel.py）"""
+    wheel = TimingWheel(tick=0.01, slots=512)
+    fired = []
+    handles = [wheel.schedule(30 + i % 600, fired.append, (i,)) for i in range(100000)]
+    assert all(handle.cancel() for handle in handles)
+
+    stats = wheel.get_stats()
+    assert stats["scheduled"] == 100000
+    assert stats["cancelled"] == 100000
+    assert stats["pending"] == 0
+    assert not handles[0].cancel()
+    assert all(not slot for slot in wheel._slots)
+    assert fired == []
+
+
+def test_timing_wheel_fires_due_timers():
+    """到期的定时器在 advance 时执行，未到期的留在时间轮中"""
+    wheel = TimingWheel(tick=0.01, slots=8)
+    fired = []
+    wheel.schedule(0.01, fired.append, ("due",))
+    later = wheel.schedule(60, fired.append, ("later",))
+    time.sleep(0.05)
+    wheel.advance()
+    assert fired == ["due"]
+    assert later.cancel()
+
+
+def test_writer_rolls_back_only_failed_operation(database):
+    """同一批次中失败的写操作回滚到自己的 SAVEPOINT，其他操作正常提交"""
+    from concurrent.futures import Future
+    from app.utils.db_utils import DatabaseWriter, db_connection, execute_write
+    execute_write(lambda conn: conn.execute("CREATE TABLE IF NOT EXISTS WriterTest (name TEXT PRIMARY KEY)"))
+
+    def insert(conn, name, fail=False):
+        conn.execute("INSERT INTO WriterTest (name) VALUES (?)", (name,))
+        if fail:
+            raise ValueError(name)
+        return name
+
+    writer = DatabaseWriter()
+    batch = [(Future(), insert, ("a",), {}), (Future(), insert, ("b",), {"fail": True}), (Future(), insert, ("c",), {})]
+    writer._execute_batch(batch)
+
+    assert batch[0][0].result() == "a"
+    with pytest.raises(ValueError):
+        batch[1][0].result()
+    assert batch[2][0].result() == "c"
+    with db_connection() as conn:
+        names = [row["name"] for row in conn.execute("SELECT name FROM WriterTest ORDER BY name")]
+    assert names == ["a", "c"]
+    assert writer.get_stats()["committed"] == 2 and writer.get_stats()["failed"] == 1
+
+
+def test_circuit_breaker_transitions():
+    """closed -> open -> half_open -> open -> half_open -> closed"""
+    from app.utils.api_clients.circuit_breaker import CircuitBreaker, STATE_CLOSED, STATE_OPEN, STATE_HALF_OPEN
+    breaker = CircuitBreaker("test", failure_threshold=2, recovery_timeout=0.05)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == STATE_CLOSED
+    breaker.record_failure()
+    assert breaker.state == STATE_OPEN
+    assert not breaker.allow() and breaker.is_open()
+
+    time.sleep(0.06)
+    assert breaker.allow() and breaker.state == STATE_HALF_OPEN
+    assert not breaker.allow()  # 只放行一个试探请求
+    breaker.record_failure()
+    assert breaker.state == STATE_OPEN
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.release()  # 试探请求没有结果时只释放名额，状态不变
+    assert breaker.state == STATE_HALF_OPEN
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == STATE_CLOSED and breaker.allow()
+    assert breaker.get_stats()["opened"] == 2
+
+
+def test_token_refresh_is_single_flight(database):
+    """同一 epoch 的并发刷新只登录一次，其余调用方拿到同一个新 token"""
+    from app.utils.api_clients.token_manager import TokenManager
+    logins = []
+
+    def login():
+        time.sleep(0.1)
+        logins.append(1)
+        return f"token-{len(logins)}"
+
+    tokens = TokenManager("test:single-flight", login)
+    tokens.offer("token-0", persist=False)
+    _, epoch = tokens.get()
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        results = list(executor.map(lambda _: tokens.refresh(epoch), range(10)))
+
+    assert len(logins) == 1
+    assert results == ["token-1"] * 10
+    assert tokens.get() == ("token-1", epoch + 1)
+    # 使用旧 epoch 再次刷新时直接返回新 token，不重复登录
+    assert tokens.refresh(epoch) == "token-1"
+    assert len(logins) == 1
+
+
+def test_message_queue_restores_pending_deletions(database):
+    """重启后从 PendingDeletions 恢复待删除消息，已过期的立即到期，未到期的保留"""
+    from app.utils.db_utils import execute_write
+    from app.utils.message_queue import MessageQueue
+    now = time.time()
+    execute_write(lambda conn: conn.executemany(
+        "INSERT OR REPLACE INTO PendingDeletions (chat_id, message_id, delete_at) VALUES (?, ?, ?)",
+        [(-100, 1, now - 60), (-100, 2, now - 1), (-100, 3, now + 3600)]))
+
+    queue = MessageQueue()
+    assert queue.get_stats()["pending"] == 0  # 创建时不访问数据库
+    assert queue.restore() == 3
+    assert queue.get_messages_to_delete() == {-100: [1, 2]}
+    assert queue.get_stats()["pending"] == 1
+
+    queue.flush(wait=True)
+    from app.utils.db_utils import db_connection
+    with db_connection() as conn:
+        rows = conn.execute("SELECT message_id FROM PendingDeletions WHERE chat_id = -100").fetchall()
+    assert [row["message_id"] for row in rows] == [3]